@@ -0,0 +1,142 @@
+import numpy as np
+
+from utils import *
+
+
+class IVFIndex:
+    """
+    Inverted-file approximate nearest-neighbour index over unit-normalized vectors.
+
+    Vectors are clustered with spherical k-means; each list stores its members contiguously
+    (ids and float16 vectors), so a query scores the centroids, scans the nprobe best lists
+    and optionally re-ranks the best candidates against the exact source vectors.
+    nprobe is the recall/latency knob: nprobe == n_lists is an exhaustive search.
+    """
+    def __init__(self, centroids, offsets, ids, vectors, nprobe=8):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+        self.nprobe = nprobe
+        self.source = None
+        # WordIndex.checksum of the words the index was built over
+        self.checksum = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    def attach(self, keyed_vectors):
+        """Use keyed_vectors (indexed by the same ids) for exact re-ranking."""
+        keyed_vectors.fill_norms()
+        self.source = keyed_vectors
+
+    @staticmethod
+    def iter_normed(keyed_vectors, ids, batch_size=65536):
+        keyed_vectors.fill_norms()
+        for start in range(0, len(ids), batch_size):
+            rows = ids[start:start + batch_size]
+            norms = np.maximum(keyed_vectors.norms[rows], np.finfo(np.float32).tiny)
+            yield start, keyed_vectors.vectors[rows].astype(np.float32) / norms[:, None]
+
+    @staticmethod
+    def assign(vectors, centroids, batch_size=65536):
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), batch_size):
+            labels[start:start + batch_size] = np.argmax(vectors[start:start + batch_size] @ centroids.T, axis=1)
+        return labels
+
+    @staticmethod
+    def kmeans(vectors, n_lists, n_iter=10, rng=None):
+        """Spherical k-means (cosine); empty clusters are re-seeded from random points."""
+        if rng is None:
+            rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            labels = IVFIndex.assign(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, vectors)
+            counts = np.bincount(labels, minlength=n_lists)
+            empty = counts == 0
+            sums[empty] = vectors[rng.choice(len(vectors), empty.sum(), replace=False)]
+            centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        return centroids.astype(np.float32)
+
+    @staticmethod
+    def build(keyed_vectors, ids, n_lists=None, n_iter=10, train_size=65536, nprobe=8, random_state=0):
+        """
+        Args:
+            keyed_vectors: source vectors (gensim KeyedVectors)
+            ids (np.array): rows of keyed_vectors to index, e.g. WordIndex.indices
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(ids))))
+        n_lists = min(n_lists, len(ids))
+        rng = np.random.default_rng(random_state)
+
+        vectors = np.empty((len(ids), keyed_vectors.vector_size), dtype=np.float32)
+        for start, batch in IVFIndex.iter_normed(keyed_vectors, ids):
+            vectors[start:start + len(batch)] = batch
+
+        train = vectors[rng.choice(len(ids), min(train_size, len(ids)), replace=False)]
+        centroids = IVFIndex.kmeans(train, n_lists, n_iter, rng)
+        labels = IVFIndex.assign(vectors, centroids)
+
+        order = np.argsort(labels, kind='stable')
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+        return IVFIndex(centroids, offsets, ids[order], vectors[order].astype(np.float16), nprobe)
+
+    def save(self, path):
+        with atomic_path(path) as tmp:
+            np.savez(
+                tmp, centroids=self.centroids, offsets=self.offsets, ids=self.ids, vectors=self.vectors,
+                checksum=-1 if self.checksum is None else self.checksum,
+            )
+
+    @staticmethod
+    def load(path, nprobe=8):
+        data = np.load(path)
+        index = IVFIndex(data['centroids'], data['offsets'], data['ids'], data['vectors'], nprobe)
+        if 'checksum' in data and int(data['checksum']) >= 0:
+            index.checksum = int(data['checksum'])
+        return index
+
+    def get_candidates(self, vec, nprobe):
+        nprobe = min(nprobe, self.n_lists)
+        lists = np.argpartition(-(self.centroids @ vec), nprobe - 1)[:nprobe]
+        return np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+
+    def query(self, vec, topn=5, nprobe=None, rerank=True, rerank_factor=4, exclude=()):
+        """
+        Return:
+            list(tuple(int, float)): (id, cosine similarity) of the topn approximate neighbours of vec
+        """
+        if nprobe is None:
+            nprobe = self.nprobe
+        vec = np.asarray(vec, dtype=np.float32)
+        vec = vec / max(np.linalg.norm(vec), np.finfo(np.float32).tiny)
+
+        positions = self.get_candidates(vec, nprobe)
+        ids = self.ids[positions]
+        keep = ~np.isin(ids, np.asarray(exclude, dtype=np.int64))
+        positions, ids = positions[keep], ids[keep]
+        scores = self.vectors[positions].astype(np.float32) @ vec
+
+        rerank = rerank and self.source is not None
+        n = min(len(ids), topn * rerank_factor if rerank else topn)
+        if n == 0:
+            return []
+        best = np.argpartition(-scores, n - 1)[:n]
+        ids, scores = ids[best], scores[best]
+
+        if rerank:
+            exact = self.source.vectors[ids].astype(np.float32) @ vec
+            scores = exact / self.source.norms[ids]
+
+        order = np.argsort(-scores)[:topn]
+        return [(int(ids[i]), float(scores[i])) for i in order]
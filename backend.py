@@ -1,8 +1,6 @@
 from gensim.models import Word2Vec
 from gensim.models import KeyedVectors
 
-from sklearn.manifold import TSNE
-
 import random
 import numpy as np
 
@@ -10,54 +8,98 @@ from config import *
 from utils import *
 
 import dataloader
+from embedding import Embedding2D
+from projection import ProjectionPipeline
+from solver import ChainSolver
+from engine import Engine
+import similarity
+from targettable import TargetTable
+from metrics import METRICS, timed
+
+
+def record_update(metrics, args, result):
+    agent = args[0]
+    metrics.count('update_results', result=RESULT_NAMES[result[0]])
+    if result[0] == VALID or result[0] == WON:
+        # chains are per session, so their lengths are a distribution rather than one gauge
+        metrics.record('chain_length', len(agent.guesses))
 
 
 class Agent:
 
     class Bounds:
-        def __init__(self, arr: np.array):
-            self.minX = min(arr[:, 0])
-            self.maxX = max(arr[:, 0])
-            self.minY = min(arr[:, 1])
-            self.maxY = max(arr[:, 1])
+        def __init__(self, minX, maxX, minY, maxY):
+            self.minX = minX
+            self.maxX = maxX
+            self.minY = minY
+            self.maxY = maxY
             self.rangeX = self.maxX - self.minX
             self.rangeY = self.maxY - self.minY
             self.maxDist = np.linalg.norm([self.rangeX, self.rangeY])
         
+        @staticmethod
+        def from_array(arr: np.array):
+            return Agent.Bounds(*Embedding2D.calc_limits(arr))
+
         def __str__(self):
             return f"minX: {self.minX}, minY: {self.minY}, maxX: {self.maxX}, maxY: {self.maxY}, rangeX: {self.rangeX}, rangeY: {self.rangeY}"
 
-    def __init__(self, model_name='v1', tolerance=0.3, algo='default'):
-        self.model = dataloader.load(model_name)
-        self.vocab = list(self.model.wv.key_to_index.keys())
-        self.vocab_set = set(self.vocab)
-        self.dictionary = dataloader.load_words()
-        self.dict_set = set(self.dictionary)
-
-        if algo == '2d':
-            self.embedding = dataloader.load_embedding(model_name)
-            self.bounds = Agent.Bounds(np.array(list(self.embedding.values())))
-
+    def __init__(self, model_name='v1', tolerance=0.3, algo='default', mmap=False, lexicon=False, full_hints=False,
+                 ann_hints=False, nprobe=HINT_NPROBE, puzzles=False, quantized=False, engine=None, power=ADJUST_POWER):
+        if engine is None:
+            engine = Engine(model_name, mmap, lexicon, full_hints, ann_hints, nprobe, puzzles, quantized=quantized)
+        self.engine = engine
+
+        # shared, read-only resources
+        self.model = engine.model
+        self.hint_model = engine.hint_model
+        self.vocab = engine.vocab
+        self.vocab_set = engine.vocab_set
+        self.dictionary = engine.dictionary
+        self.dict_set = engine.dict_set
+        self.file_name = engine.file_name
+        self.model_name = engine.model_name
+        self.word_index = engine.word_index
+        self.guessable = engine.guessable
+        self.guess_slots = engine.guess_slots
+        self.ann_index = engine.ann_index
+        self.puzzle_bank = None
+        self.quantized = engine.quantized
+
+        self.solver = None
+
+        if similarity.ENGINES.get(algo, similarity.SimilarityEngine).needs_embedding:
+            self.embedding = engine.load_embedding()
+            self.bounds = Agent.Bounds(*self.embedding.limits)
+            self.embedding_matrix = engine.embedding_matrix
+        self.similarity = similarity.create(algo, self)
+
+        # session state
         self.tolerance = tolerance
+        self.power = power
+        if engine.puzzles:
+            self.load_puzzle_bank()
 
         self.start = None
         self.target = None
 
         self.guesses = []
         self.guesses_set = set()
+        self.target_table = None
+        # optional TargetTableCache, so games on the same target share one table
+        self.target_tables = None
 
-        self.algos = {
-            'default': self.get_cosine_similarity,
-            '2d': self.get_2d_similarity,
-        }
-        self.algo = self.algos[algo]
+        self.algo = self.get_engine_similarity
+        self.batch_algo = self.get_engine_similarities
 
-    def train_embedding(self):
-        vectors = np.array(self.model.wv.vectors)
-        tsne = TSNE(n_components=2, random_state=0)
-        raw = tsne.fit_transform(vectors).tolist()
-        embedding = {word: val for word, val in zip(self.vocab, raw)}
-        return embedding
+        # chain frontier: best similarity of every guessable word to any chain word, by get_slot
+        self.frontier = None
+        self.frontier_owner = None
+        self.reset_frontier()
+
+    def train_embedding(self, **kwargs):
+        pipeline = ProjectionPipeline(self.model, self.dictionary, self.file_name, **kwargs)
+        return pipeline.run()
 
     def get_random_word(self):
         return random.choice(self.vocab)
@@ -68,11 +110,8 @@ class Agent:
     def check_valid_word(self, word):
         return word.isalpha() and word.islower() and word in self.vocab_set
 
-    def find_valid_word(self):
-        word = "_"
-        while not self.check_valid_word(word):
-            word = self.get_random_dictionary_word()
-        return word
+    def find_valid_word(self, basic=False, top_n=None):
+        return self.word_index.draw(basic=basic, top_n=top_n)
 
     def parse_input(self, stream):
         return stream.strip()
@@ -82,6 +121,7 @@ class Agent:
         stream = self.parse_input(raw_stream)
         return stream
     
+    @timed('agent.validate_word')
     def validate_word(self, word):
         try:
             self.model.wv.key_to_index[word]
@@ -89,20 +129,21 @@ class Agent:
         except:
             return False
 
+    def get_index(self, word):
+        return self.model.wv.key_to_index[word]
+
     def get_2d(self, word):
         return self.embedding[word]
 
-    def norm_cosine_similarity(self, sim):
-        return (sim + 1) / 2
-    
-    def get_cosine_similarity(self, w1, w2):
-        sim = self.model.wv.similarity(w1, w2)
-        return self.norm_cosine_similarity(sim)
+    def get_engine_similarity(self, w1, w2):
+        return self.similarity.similarity(self.get_index(w1), self.get_index(w2))
 
-    def get_2d_similarity(self, w1, w2):
-        v = self.get_2d(w1) - self.get_2d(w2)
-        dist = np.linalg.norm(v) / self.bounds.maxDist
-        return 1 - dist
+    def get_engine_similarities(self, word):
+        """
+        Return:
+            np.array: similarity of word to every vocab word, indexed like key_to_index
+        """
+        return self.similarity.one_to_many(self.get_index(word))
     
     def get_similarity(self, w1, w2, adjust=False):
         sim = self.algo(w1, w2)
@@ -111,19 +152,35 @@ class Agent:
         return sim
     
     def adjust(self, sim):
-        return np.power(sim, 3)
+        return np.power(sim, self.power)
 
     def norm(self, pos):
         return (pos - (self.bounds.minX, self.bounds.minY)) / (self.bounds.rangeX, self.bounds.rangeY)
     
+    @timed('agent.get_closest_word_and_score')
     def get_closest_word_and_score(self, word):
         """
         Return:
             tuple(str, float): (best word, best score)
         """
-        sims = [self.algo(word, guess) for guess in self.guesses]
-        best_index = np.argmax(sims)
-        return self.guesses[best_index], self.adjust(sims[best_index])
+        index = self.get_index(word)
+        slot = self.get_slot(index)
+        if self.similarity.approximate and self.near_tolerance(self.frontier[slot]):
+            return self.get_exact_closest_word_and_score(index)
+        best_word = self.guesses[self.frontier_owner[slot]]
+        return best_word, self.adjust(self.frontier[slot])
+
+    def near_tolerance(self, sim):
+        """Whether the range the exact score of sim lies in (SimilarityEngine.bounds) straddles the tolerance."""
+        low, high = self.similarity.bounds(sim)
+        return self.validate_score(self.adjust(low)) != self.validate_score(self.adjust(high))
+
+    def get_exact_closest_word_and_score(self, index):
+        """Float re-rank of the chain, for decisions the quantized frontier cannot make."""
+        chain = np.array([self.get_index(guess) for guess in self.guesses])
+        sims = self.similarity.exact_one_to_many(index, chain)
+        best = int(np.argmax(sims))
+        return self.guesses[best], self.adjust(sims[best])
     
     def validate_score(self, score):
         return score >= self.tolerance
@@ -137,6 +194,27 @@ class Agent:
     def add_word(self, word):
         self.guesses.append(word)
         self.guesses_set.add(word)
+        self.update_frontier(word)
+
+    def get_slot(self, index):
+        """
+        Return:
+            int: position of a model index in the frontier, or -1 if the word cannot be guessed
+        """
+        if self.guess_slots is None:
+            return index
+        return int(self.guess_slots[index])
+
+    def reset_frontier(self):
+        self.frontier = np.full(len(self.guessable), -np.inf, dtype=np.float32)
+        self.frontier_owner = np.full(len(self.guessable), -1, dtype=np.int32)
+
+    @timed('agent.update_frontier')
+    def update_frontier(self, word):
+        sims = self.similarity.one_to_many(self.get_index(word), None if self.guess_slots is None else self.guessable)
+        closer = sims > self.frontier
+        self.frontier[closer] = sims[closer]
+        self.frontier_owner[closer] = len(self.guesses) - 1
 
     def win(self):
         print(f"Congratulations! You chained from '{self.start}' to '{self.target}' in {len(self.guesses) - 1} guesses!")
@@ -171,23 +249,79 @@ class Agent:
         print(f"Hint: Try these words: {', '.join(hints)}\n")
 
     def get_similarity_to_target(self, word, adjust=False):
-        sim = self.algo(word, self.target)
+        if self.target_table is not None:
+            sim = self.target_table.get_similarity(self.get_index(word))
+        else:
+            sim = self.algo(word, self.target)
         if adjust:
             return self.adjust(sim)
         return sim
     
-    def get_max_similarity(self, word):
-        return max([self.algo(word, guess) for guess in self.guesses])
+    def get_target_rank(self, word):
+        """
+        Return:
+            int: 1 + number of playable words closer to the target than word (0 for the target)
+        """
+        return self.target_table.get_rank(self.get_index(word))
 
+    def get_warmth_feedback(self, word):
+        rank = self.get_target_rank(word)
+        if rank == 0:
+            return f"'{word}' is the target!"
+        percentile = round(self.target_table.get_percentile(self.get_index(word)) * 100, 1)
+        return f"'{word}' is the {ordinal(rank)} closest word to the target (warmer than {percentile}% of words)."
+
+    def get_max_similarity(self, word):
+        index = self.get_index(word)
+        slot = self.get_slot(index)
+        if slot < 0:
+            chain = np.array([self.get_index(guess) for guess in self.guesses])
+            return float(np.max(self.similarity.one_to_many(index, chain)))
+        return self.frontier[slot]
+
+    def get_ann_hints(self, word, topn=5):
+        vec = self.hint_model.wv.get_vector(word, norm=True)
+        closest = self.ann_index.query(vec, topn=topn, rerank=HINT_RERANK, exclude=[self.get_index(word)])
+        return [self.vocab[i] for i in self.get_column(closest, axis=0)]
+
+    def get_quantized_hints(self, word, topn=5):
+        vec = self.hint_model.wv.get_vector(word, norm=True)
+        closest = self.quantized.product.query(vec, topn=topn, rerank=HINT_RERANK, exclude=[self.get_index(word)])
+        return [self.vocab[i] for i in self.get_column(closest, axis=0)]
+
+    @timed('agent.get_hints')
     def get_hints(self, word):
-        closest_words = self.model.wv.most_similar(positive=[word], topn=5)
-        closest_words = self.get_column(closest_words, axis=0)
+        if self.quantized is not None:
+            closest_words = self.get_quantized_hints(word)
+        elif self.ann_index is not None:
+            closest_words = self.get_ann_hints(word)
+        else:
+            closest_words = self.hint_model.wv.most_similar(positive=[word], topn=5)
+            closest_words = self.get_column(closest_words, axis=0)
         closest_words.sort(key=self.get_max_similarity, reverse=True)
         return closest_words
 
+    def load_solver(self):
+        self.solver = ChainSolver(self.engine.load_graph(), self)
+
+    def get_solution(self, method='bfs'):
+        """
+        Return:
+            list(str): shortest chain from start to target under the current tolerance, or None
+        """
+        if self.solver is None:
+            self.load_solver()
+        return self.solver.solve(self.start, self.target, self.tolerance, method=method)
+
+    def get_par(self):
+        if self.solver is None:
+            self.load_solver()
+        return self.solver.get_par(self.start, self.target, self.tolerance)
+
     def get_column(self, arr, axis=0):
         return [item[axis] for item in arr]
     
+    @timed('agent.update', on_result=record_update)
     def update(self, guess):
         if not self.validate_word(guess):
             return INVALID, self.get_invalid_feedback()
@@ -206,12 +340,57 @@ class Agent:
                 return UNSIMILAR, self.get_unsimilar_feedback(best_word, best_score)
                 self.display_hints(guess)
 
-    def init_core(self):
-        self.start = self.find_valid_word()
-        self.target = self.find_valid_word()
+    def use_puzzle_bank(self, bank):
+        """Draw games from bank, unless it is empty or was generated for another tolerance or adjust power."""
+        self.puzzle_bank = None
+        if bank is not None and len(bank) and bank.matches(self.word_index, float(self.tolerance), float(self.power)):
+            self.puzzle_bank = bank
+
+    def load_puzzle_bank(self):
+        self.use_puzzle_bank(self.engine.load_puzzle_bank(self.tolerance, self.power))
+
+    def set_rules(self, tolerance, power):
+        """Change the tolerance and adjust power, switching to the puzzle bank generated for them."""
+        self.tolerance, self.power = tolerance, power
+        if self.engine.puzzles:
+            self.load_puzzle_bank()
+
+    def draw_puzzle(self, difficulty=None):
+        position = self.puzzle_bank.draw(difficulty)
+        start = self.vocab[self.puzzle_bank.starts[position]]
+        target = self.vocab[self.puzzle_bank.targets[position]]
+        return start, target
+
+    def reset(self):
+        self.start = None
+        self.target = None
+        self.guesses = []
+        self.guesses_set = set()
+        self.target_table = None
+        self.reset_frontier()
+
+    @timed('agent.init_core')
+    def init_core(self, difficulty=None):
+        self.reset()
+        if self.puzzle_bank is not None:
+            self.start, self.target = self.draw_puzzle(difficulty)
+        else:
+            self.start = self.find_valid_word()
+            self.target = self.find_valid_word()
+        if self.target_tables is not None:
+            self.target_table = self.target_tables.get(self.target, self.get_index(self.target))
+        else:
+            self.target_table = TargetTable(self.similarity, self.target, self.get_index(self.target), self.word_index)
         self.add_word(self.start)
 
-    def main(self):
+    def main(self, headless=False, socket_path=None):
+        """Play in the terminal, or with headless serve NDJSON commands for any number of games (see headless.py)."""
+        if headless:
+            from server import SessionManager
+            from headless import LineProtocol
+            LineProtocol(SessionManager(self.engine, self.tolerance, self.similarity.name)).run(socket_path)
+            return
+
         self.init_core()
 
         self.running = True
@@ -220,6 +399,19 @@ class Agent:
             self.update(guess)
 
 
+METRICS.register(Agent)
+
+
 if __name__ == '__main__':
-    game = Agent('v1', tolerance=0.3)
-    game.main()
+    import argparse
+    import contextlib
+    import sys
+
+    parser = argparse.ArgumentParser(description="Play WordChain in the terminal.")
+    parser.add_argument('--headless', action='store_true', help="read NDJSON commands from stdin instead")
+    parser.add_argument('--socket', default=None, help="with --headless, serve on this Unix socket")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(sys.stderr if args.headless else sys.stdout):
+        game = Agent('v1', tolerance=0.3)
+    game.main(args.headless, args.socket)
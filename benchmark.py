@@ -0,0 +1,247 @@
+"""
+Headless benchmark harness.
+
+Runs against a small synthetic model (random vectors over real dictionary words), so it needs
+no downloads, and writes JSON that can be compared between commits:
+
+    python benchmark.py --out before.json
+    python benchmark.py --out after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from config import *
+from utils import *
+
+import dataloader
+
+
+FIXTURE_NAME = '_benchmark'
+
+
+def summarize(times):
+    times = np.array(times) * 1000
+    return {
+        'n': int(len(times)),
+        'median_ms': float(np.median(times)),
+        'p95_ms': float(np.percentile(times, 95)),
+        'min_ms': float(times.min()),
+    }
+
+def measure(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+def measure_once(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, summarize([time.perf_counter() - start])
+
+def measure_cold(statement):
+    """Time statement once in a fresh interpreter, which has no module-level or allocator state to reuse."""
+    code = f"import time, dataloader; t = time.perf_counter(); {statement}; print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, '-c', code], cwd=DIR_PATH, capture_output=True, text=True, check=True)
+    return summarize([float(output.stdout.split()[-1])])
+
+
+class Benchmark:
+    def __init__(self, n_words=50000, dims=100, repeat=50, seed=0, verbose=True):
+        self.n_words = n_words
+        self.dims = dims
+        self.repeat = repeat
+        self.seed = seed
+        self.verbose = verbose
+        self.results = {}
+
+    def log(self, message):
+        if self.verbose:
+            print(f"[benchmark] {message}", flush=True)
+
+    def record(self, name, stats):
+        self.results[name] = stats
+        self.log(f"{name}: median {stats['median_ms']:.3f} ms (n={stats['n']})")
+
+    # Fixture
+    def build_fixture(self):
+        """Write a KeyedVectors model with random vectors over dictionary words."""
+        from gensim.models import KeyedVectors
+
+        shutil.rmtree(dataloader.get_model_path(FIXTURE_NAME), ignore_errors=True)
+        rng = random.Random(self.seed)
+        words = [word for word in dataloader.load_words() if word.isalpha()]
+        vocab = rng.sample(words, min(self.n_words, len(words)))
+        vectors = np.random.default_rng(self.seed).standard_normal((len(vocab), self.dims)).astype(np.float32)
+
+        keyed_vectors = KeyedVectors(self.dims)
+        keyed_vectors.add_vectors(vocab, vectors)
+        keyed_vectors.save(f"{dataloader.get_model_path(FIXTURE_NAME)}/{FIXTURE_NAME}.model")
+
+    def remove_fixture(self):
+        shutil.rmtree(dataloader.get_model_path(FIXTURE_NAME), ignore_errors=True)
+
+    # Benchmarks
+    def bench_load(self):
+        # the first mmap load builds the sidecar, so cold loads below only measure loading it
+        _, stats = measure_once(lambda: dataloader.load(FIXTURE_NAME, mmap=True))
+        self.record('build.mmap', stats)
+
+        self.record('load.model.cold', measure_cold(f"dataloader.load({FIXTURE_NAME!r})"))
+        self.record('load.model.warm', measure(lambda: dataloader.load(FIXTURE_NAME), max(1, self.repeat // 10)))
+
+        self.record('load.mmap.cold', measure_cold(f"dataloader.load({FIXTURE_NAME!r}, mmap=True)"))
+        self.record('load.mmap.warm', measure(lambda: dataloader.load(FIXTURE_NAME, mmap=True), max(1, self.repeat // 10)))
+
+        self.record('load_words.cold', measure_cold("dataloader.load_words()"))
+        self.record('load_words.warm', measure(dataloader.load_words, max(1, self.repeat // 10)))
+
+    def bench_engine(self):
+        from engine import Engine
+
+        engine, stats = measure_once(lambda: Engine(FIXTURE_NAME, mmap=True, ann_hints=True))
+        self.record('engine.cold', stats)
+        self.record('engine.warm', measure(lambda: Engine(FIXTURE_NAME, mmap=True, ann_hints=True), 3))
+        return engine
+
+    def bench_agent(self, engine, chain_lengths=(1, 10, 100, 1000)):
+        from backend import Agent
+
+        agent = Agent(FIXTURE_NAME, tolerance=0, engine=engine)
+        agent.init_core()
+        self.record('find_valid_word', measure(agent.find_valid_word, self.repeat * 10))
+
+        valid = agent.word_index.get_words()
+        random.Random(self.seed).shuffle(valid)
+        valid = [word for word in valid if word != agent.start]
+        for length in chain_lengths:
+            while len(agent.guesses) < length:
+                agent.add_word(valid.pop())
+            times = []
+            for _ in range(self.repeat):
+                word = valid.pop()
+                start = time.perf_counter()
+                agent.update(word)
+                times.append(time.perf_counter() - start)
+            self.record(f'update.chain_{length}', summarize(times))
+
+        self.record('get_hints.ann', measure(lambda: agent.get_hints(agent.guesses[-1]), self.repeat))
+        agent.ann_index = None
+        self.record('get_hints.exact', measure(lambda: agent.get_hints(agent.guesses[-1]), self.repeat))
+        agent.ann_index = engine.ann_index
+        return agent
+
+    def bench_gui(self, engine, node_counts=(10, 25, 50, 100), samples=5):
+        os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+        from PySide6.QtCore import QPointF
+        from PySide6.QtWidgets import QApplication
+        from backend import Agent
+        from gui import Gui
+
+        app = QApplication.instance() or QApplication([])
+        gui = Gui()
+        gui.backend = Agent(FIXTURE_NAME, tolerance=0, engine=engine)
+        gui.backend.init_core()
+        gui.start_game()
+
+        words = gui.backend.word_index.get_words()
+        random.Random(self.seed).shuffle(words)
+        words = [word for word in words if word != gui.backend.start]
+        for count in node_counts:
+            while len(gui.backend.guesses) < count:
+                self.add_gui_word(gui, words.pop())
+            times = []
+            for _ in range(samples):
+                word = words.pop()
+                start = time.perf_counter()
+                self.add_gui_word(gui, word)
+                times.append(time.perf_counter() - start)
+            self.record(f'gui.add_node.items_{len(gui.items)}', summarize(times))
+        app.processEvents()
+
+    def add_gui_word(self, gui, word):
+        state, closest_word = gui.backend.update(word)
+        gui.add_node(word, closest_word)
+
+    def get_meta(self):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=DIR_PATH, capture_output=True, text=True,
+            ).stdout.strip()
+        except OSError:
+            commit = None
+        return {
+            'commit': commit,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'n_words': self.n_words,
+            'dims': self.dims,
+            'repeat': self.repeat,
+        }
+
+    def run(self, gui=True, keep_fixture=False):
+        self.build_fixture()
+        try:
+            self.bench_load()
+            engine = self.bench_engine()
+            self.bench_agent(engine)
+            if gui:
+                self.bench_gui(engine)
+        finally:
+            if not keep_fixture:
+                self.remove_fixture()
+        return {'meta': self.get_meta(), 'results': self.results}
+
+
+def compare(current, baseline, threshold=1.2):
+    """
+    Return:
+        list(str): benchmarks whose median got slower than threshold x the baseline
+    """
+    regressions = []
+    for name, stats in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        before, after = baseline['results'][name]['median_ms'], stats['median_ms']
+        ratio = after / before if before > 0 else 1
+        flag = 'REGRESSION' if ratio > threshold else ''
+        print(f"{name:<32} {before:>10.3f} ms -> {after:>10.3f} ms  x{ratio:.2f} {flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="WordChain benchmark suite.")
+    parser.add_argument('--words', type=int, default=50000)
+    parser.add_argument('--dims', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--no-gui', action='store_true')
+    parser.add_argument('--keep-fixture', action='store_true')
+    parser.add_argument('--out', help="write results JSON here")
+    parser.add_argument('--compare', help="baseline results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=1.2)
+    args = parser.parse_args()
+
+    results = Benchmark(args.words, args.dims, args.repeat).run(gui=not args.no_gui, keep_fixture=args.keep_fixture)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(1)
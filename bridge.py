@@ -0,0 +1,82 @@
+import itertools
+import queue
+import threading
+import traceback
+
+from PySide6.QtCore import QObject, Signal
+
+
+class Request:
+    def __init__(self, seq, kind, fn, args):
+        self.seq = seq
+        self.kind = kind
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+
+class BackendBridge(QObject):
+    """
+    Runs backend calls on one worker thread (the Agent is not thread-safe, so requests are
+    served in order) and reports back through Qt signals, which are delivered on the UI thread.
+    Submitting with replace=True cancels a queued, not yet started request of the same kind;
+    cancel_all() drops everything queued and makes results of running requests stale.
+    """
+    finished = Signal(int, str, object)   # seq, kind, result
+    failed = Signal(int, str, str)        # seq, kind, error
+    status = Signal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.requests = queue.Queue()
+        self.counter = itertools.count(1)
+        self.queued = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, kind, fn, *args, replace=False):
+        """
+        Return:
+            int: request sequence number, passed back with the result
+        """
+        with self.lock:
+            request = Request(next(self.counter), kind, fn, args)
+            if replace and kind in self.queued:
+                self.queued[kind].cancelled = True
+            self.queued[kind] = request
+        self.requests.put(request)
+        return request.seq
+
+    def cancel_all(self):
+        with self.lock:
+            for request in self.queued.values():
+                request.cancelled = True
+            self.queued.clear()
+            self.generation = next(self.counter)
+
+    def is_stale(self, seq):
+        return seq < self.generation
+
+    def close(self):
+        self.cancel_all()
+        self.requests.put(None)
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            with self.lock:
+                if request.cancelled:
+                    continue
+                if self.queued.get(request.kind) is request:
+                    del self.queued[request.kind]
+            try:
+                result = request.fn(*request.args)
+            except Exception as e:
+                traceback.print_exc()
+                self.failed.emit(request.seq, request.kind, str(e))
+            else:
+                self.finished.emit(request.seq, request.kind, result)
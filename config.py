@@ -3,6 +3,43 @@
 # ---------------- Model config ----------------
 MODEL_NAME = 'word2vec-google-news-300'
 FILE_NAME = 'googlenews'
+LOAD_MMAP = True
+LOAD_LEXICON = True
+FULL_PRECISION_HINTS = True
+ANN_HINTS = True
+HINT_NPROBE = 16
+HINT_RERANK = True
+QUANTIZED = False
+PQ_SUBSPACES = 50
+# most edges kept per word in the solver graph, bounding its memory; None keeps every edge >= TOLERANCE
+# (tens of millions on a full dictionary). Pars found on a capped graph are upper bounds.
+GRAPH_K = 50
+
+SIMILARITY_ALGO = 'default'
+RANK_SAMPLE_SIZE = 100000
+BLEND_WEIGHT = 0.7
+
+DIFFICULTIES = ('easy', 'medium', 'hard')
+PUZZLE_PAR_RANGES = {
+    'easy': (2, 3),
+    'medium': (4, 5),
+    'hard': (6, 1000),
+}
+PUZZLE_BANK_SIZE = 10000
+USE_PUZZLE_BANK = True
+PUZZLE_DIFFICULTY = 'medium'
+
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+SESSION_IDLE_TIMEOUT = 900
+# threads running game commands off the server's event loop
+SERVER_THREADS = 4
+# threads computing target tables, and how many tables sessions share before the least recent is dropped
+TARGET_TABLE_THREADS = 2
+TARGET_TABLE_CACHE = 64
+
+METRICS_ENABLED = False
+METRICS_SLOW_MS = 100
 # ----------------------------------------------
 
 FPS = 60
@@ -22,10 +59,30 @@ MIN_SIM = 0.35
 MAX_SIM = 1
 MAX_SIM_POS = 0.55
 MIN_SIM_FEEDBACK = 0.2
+# exponent of Agent.adjust, applied to similarities before comparing them with TOLERANCE
+ADJUST_POWER = 3
 MAX_TRIES = 5000
 
+# 'collision': fixed positions from the placement search, 'force': incremental force-directed relaxation
+LAYOUT_MODE = 'collision'
+LAYOUT_STEPS = 30
+LAYOUT_HOPS = 2
+LAYOUT_MAX_ACTIVE = 64
+LAYOUT_REPULSION = 2.0e5
+LAYOUT_SPRING = 0.1
+LAYOUT_MAX_MOVE = 20
+
 DISPLAY_TEXT_PAD = 20
 
+# 'view': pan and zoom the view transform, 'items': move every item when panning
+NAVIGATION_MODE = 'view'
+SCENE_EXTENT = 1000000
+ZOOM_MIN = 0.05
+ZOOM_MAX = 4
+ZOOM_STEP = 1.15
+LOD_LABEL_SCALE = 0.5
+LOD_SIMPLE_SCALE = 0.2
+
 TOLERANCE = 0.25
 
 LOGO_SIZE = 125
@@ -38,3 +95,11 @@ INVALID = 1
 GUESSED = 2
 UNSIMILAR = 3
 WON = 4
+
+RESULT_NAMES = {
+    VALID: 'VALID',
+    INVALID: 'INVALID',
+    GUESSED: 'GUESSED',
+    UNSIMILAR: 'UNSIMILAR',
+    WON: 'WON',
+}
@@ -3,10 +3,18 @@ from gensim.models import Word2Vec
 from gensim.models import KeyedVectors
 
 import numpy as np
+import glob
 import json
 import os
 
 from utils import *
+from wordindex import WordIndex
+from embedding import Embedding2D
+from annindex import IVFIndex
+from solver import WordGraph
+from puzzles import PuzzleBank
+from quantization import QuantizedStore
+from metrics import METRICS, timed
 
 
 def get_model_path(file_name):
@@ -19,29 +27,310 @@ def download(model_name, file_name):
     model = api.load(model_name)
     model.save(f"{get_model_path(file_name)}/{file_name}.model")
 
-def load(file_name):
+def get_vectors_path(file_name, full=False):
+    suffix = '_full' if full else ''
+    return f"{get_model_path(file_name)}/{file_name}_vectors{suffix}.npy"
+
+def get_lexicon_name(file_name):
+    return f"{file_name}_lexicon"
+
+def get_model_name(file_name, lexicon=False):
+    if lexicon:
+        return get_lexicon_name(file_name)
+    return file_name
+
+def get_word_index_path(file_name):
+    return f"{get_model_path(file_name)}/{file_name}_valid.npz"
+
+def get_vocab_path(file_name):
+    return f"{get_model_path(file_name)}/{file_name}_vocab.txt"
+
+def wrap_keyed_vectors(keyed_vectors):
+    model = Word2Vec()
+    model.wv = keyed_vectors
+    return model
+
+def wrap_vectors(vocab, vectors, normalized=False):
+    """
+    Build a model around existing arrays without copying them.
+    normalized=True marks the rows as unit length so gensim never computes norms.
+    """
+    keyed_vectors = KeyedVectors(vectors.shape[1], dtype=vectors.dtype)
+    keyed_vectors.vectors = vectors
+    keyed_vectors.index_to_key = vocab
+    keyed_vectors.key_to_index = {word: i for i, word in enumerate(vocab)}
+    if normalized:
+        keyed_vectors.norms = np.ones(len(vocab), dtype=np.float32)
+    return wrap_keyed_vectors(keyed_vectors)
+
+@timed('dataloader.load')
+def load(file_name, mmap=False, lexicon=False, full_precision=False):
+    if lexicon:
+        return load_lexicon(file_name, full_precision=full_precision)
+    if mmap:
+        return load_mmap(file_name)
+
     path = f"{get_model_path(file_name)}/{file_name}.model"
     try:
         return Word2Vec.load(path)
     except AttributeError:
-        keyed_vectors = KeyedVectors.load(path)
-        model = Word2Vec()
-        model.wv = keyed_vectors
-        return model
+        return wrap_keyed_vectors(KeyedVectors.load(path))
     except FileNotFoundError:
         raise FileNotFoundError(f"{file_name}.model does not exist! Try running init.py first with the correct file name.")
 
+def load_vocab(file_name):
+    return open(get_vocab_path(file_name), 'r').read().split('\n')
+
+def save_vocab(file_name, vocab):
+    if any('\n' in word for word in vocab):
+        raise ValueError(f"{file_name} vocab contains newlines and cannot be stored as a vocab index.")
+    with atomic_path(get_vocab_path(file_name)) as tmp:
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(vocab))
+
+def save_normalized(path, vectors, norms, indices=None, dtype=np.float32, chunk_size=100000):
+    """
+    Write the unit-normalized rows of vectors (optionally only those in indices) to a .npy file.
+    Normalization is done in chunks so the full matrix is never copied on the heap.
+    """
+    if indices is None:
+        indices = np.arange(len(vectors))
+    with atomic_path(path) as tmp:
+        out = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=(len(indices), vectors.shape[1]))
+        for start in range(0, len(indices), chunk_size):
+            rows = indices[start:start + chunk_size]
+            row_norms = np.maximum(norms[rows], np.finfo(np.float32).tiny)
+            out[start:start + len(rows)] = vectors[rows] / row_norms[:, None]
+        out.flush()
+        del out
+
+def save_mmap(file_name, model=None):
+    """
+    Write the vocab index (.txt) and unit-normalized vectors (.npy) sidecars read by load_mmap.
+    Both are moved into place whole, vectors last, so an interrupted write is rebuilt next time.
+    """
+    if model is None:
+        model = load(file_name)
+    wv = model.wv
+    wv.fill_norms()
+
+    save_vocab(file_name, wv.index_to_key)
+    save_normalized(get_vectors_path(file_name), wv.vectors, wv.norms)
+
+@timed('dataloader.load_mmap')
+def load_mmap(file_name):
+    """
+    Open the vectors sidecar read-only with mmap, so processes on one host share the page cache.
+    The sidecar is built from the full model on first use, and rebuilt if it does not match its vocab.
+    """
+    model = open_sidecar(file_name, get_vectors_path(file_name))
+    if model is None:
+        save_mmap(file_name)
+        model = open_sidecar(file_name, get_vectors_path(file_name))
+    return model
+
+def open_sidecar(file_name, path):
+    """
+    Return:
+        Word2Vec: model wrapping the mmapped vectors at path and file_name's vocab, or None if
+            either file is missing or they disagree on the number of words
+    """
+    if not (os.path.isfile(path) and os.path.isfile(get_vocab_path(file_name))):
+        return None
+    vectors = np.load(path, mmap_mode='r')
+    vocab = load_vocab(file_name)
+    if len(vocab) != vectors.shape[0]:
+        return None
+    return wrap_vectors(vocab, vectors, normalized=True)
+
+@timed('dataloader.build_lexicon')
+def build_lexicon(file_name):
+    """
+    Write a pruned "playable lexicon" model holding only the words Agent.validate_word accepts
+    (model vocab ∩ dictionary), in model order, unit-normalized and stored as float16, together
+    with a float32 copy used for hints. Files that already match the lexicon are left in place.
+
+    Return:
+        str: name of the lexicon model
+    """
+    model = load(file_name, mmap=os.path.isfile(get_vectors_path(file_name)))
+    wv = model.wv
+    wv.fill_norms()
+
+    dict_set = set(load_words())
+    indices = np.array([i for i, word in enumerate(wv.index_to_key) if word in dict_set], dtype=np.int64)
+
+    lexicon_name = get_lexicon_name(file_name)
+    vocab = [wv.index_to_key[i] for i in indices]
+    changed = not os.path.isfile(get_vocab_path(lexicon_name)) or load_vocab(lexicon_name) != vocab
+    if changed:
+        save_vocab(lexicon_name, vocab)
+    for full, dtype in ((False, np.float16), (True, np.float32)):
+        path = get_vectors_path(lexicon_name, full=full)
+        if changed or not os.path.isfile(path) or np.load(path, mmap_mode='r').shape[0] != len(vocab):
+            save_normalized(path, wv.vectors, wv.norms, indices, dtype=dtype)
+    return lexicon_name
+
+@timed('dataloader.load_lexicon')
+def load_lexicon(file_name, full_precision=False):
+    """Memory-map the playable lexicon of file_name, building it on first use."""
+    lexicon_name = get_lexicon_name(file_name)
+    path = get_vectors_path(lexicon_name, full=full_precision)
+    model = open_sidecar(lexicon_name, path)
+    if model is None:
+        build_lexicon(file_name)
+        model = open_sidecar(lexicon_name, path)
+    return model
+
 def load_words():
     return open(f"{DIR_PATH}/datasets/words/en.txt", 'r').read().split('\n')
 
+def load_basic_words():
+    return open(f"{DIR_PATH}/datasets/words/en-basic.txt", 'r').read().split('\n')
+
+def get_word_index_stamp(vocab, dictionary):
+    return np.array([len(vocab), len(dictionary), vocab_checksum(vocab), vocab_checksum(dictionary)], dtype=np.int64)
+
+def save_word_index(file_name, word_index, dictionary):
+    with atomic_path(get_word_index_path(file_name)) as tmp:
+        np.savez(
+            tmp,
+            indices=word_index.indices,
+            basic=word_index.basic,
+            stamp=get_word_index_stamp(word_index.vocab, dictionary),
+        )
+
+@timed('dataloader.load_word_index')
+def load_word_index(file_name, model, dictionary):
+    """
+    Load the cached valid-word index of a model, (re)building it if it is missing or was
+    built against a different vocab or dictionary.
+    """
+    vocab = model.wv.index_to_key
+    path = get_word_index_path(file_name)
+    if os.path.isfile(path):
+        data = np.load(path)
+        if np.array_equal(data['stamp'], get_word_index_stamp(vocab, dictionary)):
+            return WordIndex(vocab, data['indices'], data['basic'])
+
+    word_index = WordIndex.build(vocab, model.wv.key_to_index, dictionary, load_basic_words())
+    save_word_index(file_name, word_index, dictionary)
+    return word_index
+
+def get_embedding_path(file_name):
+    return f"{get_model_path(file_name)}/{file_name}_embed.bin"
+
+def get_embedding_words_path(file_name):
+    return f"{get_model_path(file_name)}/{file_name}_embed_words.txt"
+
+def get_ann_index_path(file_name):
+    return f"{get_model_path(file_name)}/{file_name}_ann.npz"
+
+@timed('dataloader.load_ann_index')
+def load_ann_index(file_name, model, word_index, nprobe=8):
+    """
+    Load the hint ANN index of a model (restricted to word_index), building it if it is missing
+    or was built over other words.
+    """
+    path = get_ann_index_path(file_name)
+    if os.path.isfile(path):
+        index = IVFIndex.load(path, nprobe=nprobe)
+        if len(index) == len(word_index) and index.checksum == word_index.checksum:
+            return index
+
+    index = IVFIndex.build(model.wv, word_index.indices, nprobe=nprobe)
+    index.checksum = word_index.checksum
+    index.save(path)
+    return index
+
+def get_quantized_path(file_name):
+    return f"{get_model_path(file_name)}/{file_name}_quant.npz"
+
+@timed('dataloader.load_quantized')
+def load_quantized(file_name, model, word_index):
+    """
+    Load the quantized store of a model (product codes restricted to word_index), building it
+    if it is missing or stale.
+    """
+    path = get_quantized_path(file_name)
+    if os.path.isfile(path):
+        try:
+            store = QuantizedStore.load(path)
+        except (FileNotFoundError, KeyError):
+            # a store saved as one .npz, before the row arrays were split out
+            store = None
+        if (store is not None and store.n_vocab == len(model.wv.vectors) == len(store.scalar)
+                and len(store.product) == len(store.product.codes) == len(word_index)
+                and store.checksum == word_index.checksum):
+            return store
+
+    store = QuantizedStore.build(model.wv, word_index.indices)
+    store.checksum = word_index.checksum
+    store.save(path)
+    return store
+
+def get_graph_path(file_name):
+    return f"{get_model_path(file_name)}/{file_name}_graph.npz"
+
+@timed('dataloader.load_graph')
+def load_graph(file_name, word_index=None):
+    """Load the solver graph, refusing one built over other words than word_index (when given)."""
+    try:
+        graph = WordGraph.load(get_graph_path(file_name))
+    except FileNotFoundError:
+        raise FileNotFoundError(f"{file_name}_graph.npz does not exist! Try running solver.py first with the correct file name.")
+    if word_index is not None and (len(graph) != len(word_index) or graph.checksum != word_index.checksum):
+        raise ValueError(f"{file_name}_graph.npz was built for another vocabulary or dictionary! Run solver.py again to rebuild it.")
+    return graph
+
+def get_puzzle_bank_path(file_name, tolerance=None, power=None):
+    """Banks are keyed by the tolerance and adjust power their pars and tiers were computed at."""
+    if tolerance is None:
+        # from before banks were keyed
+        return f"{get_model_path(file_name)}/{file_name}_puzzles.npz"
+    return f"{get_model_path(file_name)}/{file_name}_puzzles_t{tolerance:g}_p{power:g}.npz"
+
+@timed('dataloader.load_puzzle_bank')
+def load_puzzle_bank(file_name, tolerance, power):
+    for path in (get_puzzle_bank_path(file_name, tolerance, power), get_puzzle_bank_path(file_name)):
+        if os.path.isfile(path):
+            return PuzzleBank.load(path)
+    raise FileNotFoundError(f"No puzzle bank of {file_name} for tolerance {tolerance:g} and power {power:g}! Try running puzzles.py first.")
+
+def get_derived_paths(file_name):
+    """
+    Return:
+        list(str): every file (or folder) built from the model file_name, but not the model itself
+    """
+    return [
+        get_vocab_path(file_name), get_vectors_path(file_name), get_vectors_path(file_name, full=True),
+        get_word_index_path(file_name), get_embedding_path(file_name), get_embedding_words_path(file_name),
+        get_ann_index_path(file_name), get_graph_path(file_name),
+        f"{get_model_path(file_name)}/projection",
+    ] + QuantizedStore.get_paths(get_quantized_path(file_name)) + glob.glob(f"{get_model_path(file_name)}/{file_name}_puzzles*.npz")
+
+@timed('dataloader.load_embedding')
 def load_embedding(file_name):
-    path = f"{get_model_path(file_name)}/{file_name}_embed.json"
-    f = open(path, 'r')
-    data = json.load(f)
-    return {word: np.array(data[word]) for word in data}
+    """
+    Memory-map the binary 2D embedding, converting a legacy {file_name}_embed.json on first use.
+    """
+    path = get_embedding_path(file_name)
+    if not os.path.isfile(path):
+        json_path = f"{get_model_path(file_name)}/{file_name}_embed.json"
+        f = open(json_path, 'r')
+        save_embedding(file_name, json.load(f))
+        f.close()
+    words = open(get_embedding_words_path(file_name), 'r').read().split('\n')
+    return Embedding2D.load(path, words)
 
 def save_embedding(file_name, embedding):
-    path = f"{get_model_path(file_name)}/{file_name}_embed.json"
-    f = open(path, 'w')
-    data = json.dumps(embedding)
-    f.write(data)
+    if isinstance(embedding, dict):
+        embedding = Embedding2D.from_dict(embedding)
+    with atomic_path(get_embedding_words_path(file_name)) as tmp:
+        f = open(tmp, 'w')
+        f.write('\n'.join(embedding.words))
+        f.close()
+    embedding.save(get_embedding_path(file_name))
+
+
+METRICS.register(__name__)
@@ -1,36 +1,130 @@
 from gensim.models import Word2Vec
 
+import math
+import multiprocessing
 import random
+from collections import deque
+from itertools import islice
 
 from utils import *
 
 
+def clean_line(line):
+    splitted = line.split()
+    return [word.strip(" \"'.,-_/") for word in splitted]
+
+def clean_chunk(lines):
+    return [clean_line(line) for line in lines]
+
+def iter_chunks(iterable, chunk_size):
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def _uniform(rng):
+    """Uniform in (0, 1), so its log is finite."""
+    u = rng.random()
+    while u == 0:
+        u = rng.random()
+    return u
+
+def reservoir_sample(iterable, sample_size, rng=random):
+    """
+    Uniform sample of sample_size items in one pass and O(sample_size) memory
+    (Li's algorithm L: jumps over runs of skipped items instead of drawing for each one).
+    """
+    it = iter(iterable)
+    end = object()
+    reservoir = list(islice(it, sample_size))
+    if len(reservoir) < sample_size:
+        raise ValueError("Sample larger than population")
+    if sample_size == 0:
+        return reservoir
+
+    w = math.exp(math.log(_uniform(rng)) / sample_size)
+    while True:
+        skip = math.floor(math.log(_uniform(rng)) / math.log(1 - w))
+        item = next(islice(it, skip, skip + 1), end)
+        if item is end:
+            return reservoir
+        reservoir[rng.randrange(sample_size)] = item
+        w *= math.exp(math.log(_uniform(rng)) / sample_size)
+
+
+class Corpus:
+    """
+    Restartable iterable of cleaned sentences (lists of words), e.g. for Word2Vec.
+    Every iteration re-reads the file in chunks of lines and cleans them on a process pool,
+    so only a few chunks are in memory at once. With sample_size, a reservoir sample of lines
+    is drawn on the first iteration and reused by later ones.
+    """
+    def __init__(self, file, sample_size=None, processes=None, chunk_size=10000, seed=None):
+        self.file = file
+        self.sample_size = sample_size
+        self.processes = processes or multiprocessing.cpu_count()
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.sample = None
+
+    def read(self):
+        with open(f"{DIR_PATH}/datasets/{self.file}", 'r', encoding='utf-8') as f:
+            for line in f:
+                yield line.rstrip('\n')
+
+    def get_lines(self):
+        if self.sample_size is None:
+            return self.read()
+        if self.sample is None:
+            self.sample = reservoir_sample(self.read(), self.sample_size, random.Random(self.seed))
+        return self.sample
+
+    def __iter__(self):
+        chunks = iter_chunks(self.get_lines(), self.chunk_size)
+        if self.processes == 1:
+            for chunk in chunks:
+                yield from clean_chunk(chunk)
+            return
+        # Pool.imap would queue the whole file; keep a bounded window of chunks in flight
+        with multiprocessing.Pool(self.processes) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(clean_chunk, (chunk,)))
+                if len(pending) >= 2 * self.processes:
+                    yield from pending.popleft().get()
+            while pending:
+                yield from pending.popleft().get()
+
+
 class DataProcessor:
     def __init__(self):
         self.data = None
-    
+
     def read(self, file):
-        return open(f"datasets/{file}", 'r').read().split('\n')
+        return Corpus(file).read()
 
     def get_sample(self, population, sample_size):
-        return random.sample(population, sample_size)
+        return reservoir_sample(population, sample_size)
 
     def _clean_line(self, line):
-        splitted = line.split()
-        return [word.strip(" \"'.,-_/") for word in splitted]
+        return clean_line(line)
 
     def _clean(self, raw_data):
         words = [self._clean_line(line) for line in raw_data]
         return words
-    
-    def clean(self, file, sample_size=None):
-        raw_data = self.read(file)
-        if sample_size is not None:
-            sample = self.get_sample(raw_data, sample_size)
-            self.data = self._clean(sample)
-        else:
-            self.data = self._clean(raw_data)
-    
+
+    def stream(self, file, sample_size=None, processes=None, chunk_size=10000, seed=None):
+        """
+        Return:
+            Corpus: restartable iterable of cleaned sentences, never holding the whole file
+        """
+        return Corpus(file, sample_size, processes, chunk_size, seed)
+
+    def clean(self, file, sample_size=None, processes=None):
+        self.data = list(self.stream(file, sample_size, processes))
+
     def get_data(self):
         return self.data
 
@@ -0,0 +1,81 @@
+import numpy as np
+import struct
+
+from utils import *
+
+
+class Embedding2D:
+    """
+    N x 2 float32 projection of the vocab plus a word-index table.
+    The binary file is a fixed-size header (magic, N, minX, maxX, minY, maxY)
+    followed by the raw row-major array, so it can be memory-mapped directly.
+    """
+    MAGIC = b'WCE2'
+    HEADER = struct.Struct('<4sQ4f')
+    HEADER_SIZE = 64
+
+    def __init__(self, words, vectors, limits=None):
+        self.words = words
+        self.key_to_index = {word: i for i, word in enumerate(words)}
+        self.vectors = vectors
+        if limits is None:
+            limits = self.calc_limits(vectors)
+        self.limits = limits
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, word):
+        return self.vectors[self.key_to_index[word]]
+
+    def __contains__(self, word):
+        return word in self.key_to_index
+
+    @staticmethod
+    def calc_limits(vectors):
+        """
+        Return:
+            tuple(float, float, float, float): (minX, maxX, minY, maxY)
+        """
+        mins = np.nanmin(vectors, axis=0)
+        maxs = np.nanmax(vectors, axis=0)
+        return float(mins[0]), float(maxs[0]), float(mins[1]), float(maxs[1])
+
+    @staticmethod
+    def from_dict(embedding):
+        words = list(embedding.keys())
+        vectors = np.array([embedding[word] for word in words], dtype=np.float32).reshape(-1, 2)
+        return Embedding2D(words, vectors)
+
+    def align(self, vocab):
+        """
+        Return:
+            np.array: len(vocab) x 2 rows matching vocab order (NaN for words without a projection).
+                      Zero-copy when the embedding was saved in vocab order.
+        """
+        if self.words == vocab:
+            return self.vectors
+        rows = np.array([self.key_to_index.get(word, -1) for word in vocab], dtype=np.int64)
+        matrix = self.vectors[np.maximum(rows, 0)].astype(np.float32)
+        matrix[rows < 0] = np.nan
+        return matrix
+
+    def save(self, path):
+        with atomic_path(path) as tmp:
+            f = open(tmp, 'wb')
+            header = self.HEADER.pack(self.MAGIC, len(self.words), *self.limits)
+            f.write(header.ljust(self.HEADER_SIZE, b'\0'))
+            f.write(np.ascontiguousarray(self.vectors, dtype=np.float32).tobytes())
+            f.close()
+
+    @staticmethod
+    def load(path, words):
+        f = open(path, 'rb')
+        magic, n, *limits = Embedding2D.HEADER.unpack(f.read(Embedding2D.HEADER.size))
+        f.close()
+        if magic != Embedding2D.MAGIC:
+            raise ValueError(f"{path} is not a 2D embedding file.")
+        if n != len(words):
+            raise ValueError(f"{path} has {n} rows but its word table has {len(words)} words.")
+        vectors = np.memmap(path, dtype=np.float32, mode='r', offset=Embedding2D.HEADER_SIZE, shape=(n, 2))
+        return Embedding2D(words, vectors, tuple(limits))
@@ -0,0 +1,99 @@
+import numpy as np
+
+from config import *
+from utils import *
+
+import dataloader
+
+
+class Engine:
+    """
+    Read-only resources loaded once per model and shared by every Agent (game session):
+    vectors, vocab, dictionary, word index, hint index, quantized store and, on demand, the 2D
+    embedding, solver graph and puzzle bank.
+    """
+    def __init__(self, model_name='v1', mmap=False, lexicon=False, full_hints=False,
+                 ann_hints=False, nprobe=HINT_NPROBE, puzzles=False, model=None, quantized=False):
+        """
+        Args:
+            model: an already loaded model (e.g. wrapping shared memory) to use instead of loading one
+        """
+        if model is None:
+            model = dataloader.load(model_name, mmap=mmap, lexicon=lexicon)
+        self.model = model
+        self.hint_model = self.model
+        if lexicon and full_hints:
+            self.hint_model = dataloader.load(model_name, lexicon=True, full_precision=True)
+        self.vocab = list(self.model.wv.key_to_index.keys())
+        self.vocab_set = set(self.vocab)
+        self.dictionary = dataloader.load_words()
+        self.dict_set = set(self.dictionary)
+        self.file_name = model_name
+        self.model_name = dataloader.get_model_name(model_name, lexicon)
+        self.word_index = dataloader.load_word_index(self.model_name, self.model, self.dictionary)
+        self.load_guessable()
+
+        self.ann_index = None
+        if ann_hints:
+            self.ann_index = dataloader.load_ann_index(self.model_name, self.hint_model, self.word_index, nprobe)
+            self.ann_index.attach(self.hint_model.wv)
+
+        self.quantized = None
+        if quantized:
+            self.quantized = dataloader.load_quantized(self.model_name, self.model, self.word_index)
+            self.quantized.attach(self.hint_model.wv)
+
+        self.embedding = None
+        self.embedding_matrix = None
+        self.graph = None
+        # per-model state of the similarity engines, e.g. the 'rank' reference sample
+        self.similarity_cache = {}
+
+        # Agents load the bank of their own tolerance and adjust power (see load_puzzle_bank)
+        self.puzzles = puzzles
+        self.puzzle_banks = {}
+
+    def load_guessable(self):
+        """
+        Model indices of the words Agent.validate_word accepts (vocab ∩ dictionary). Per-session
+        state such as the chain frontier is sized over these, not the whole vocab; guess_slots maps
+        a model index to its position (-1 if not guessable), or is None when every word is guessable.
+        """
+        key_to_index = self.model.wv.key_to_index
+        self.guessable = np.array(sorted(key_to_index[word] for word in self.dict_set if word in key_to_index), dtype=np.int64)
+        self.guess_slots = None
+        if len(self.guessable) < len(self.vocab):
+            self.guess_slots = np.full(len(self.vocab), -1, dtype=np.int32)
+            self.guess_slots[self.guessable] = np.arange(len(self.guessable), dtype=np.int32)
+
+    def load_embedding(self):
+        if self.embedding is None:
+            self.embedding = dataloader.load_embedding(self.file_name)
+            self.embedding_matrix = self.embedding.align(self.vocab)
+        return self.embedding
+
+    def load_graph(self):
+        if self.graph is None:
+            self.graph = dataloader.load_graph(self.model_name, self.word_index)
+        return self.graph
+
+    def load_puzzle_bank(self, tolerance=TOLERANCE, power=ADJUST_POWER):
+        """
+        Return:
+            PuzzleBank: the bank puzzles.py generated for this model at tolerance and power, or None
+                if there is none and games use random pairs. Banks are cached per setting and never
+                generated here.
+        """
+        key = (float(tolerance), float(power))
+        if key not in self.puzzle_banks:
+            try:
+                bank = dataloader.load_puzzle_bank(self.model_name, *key)
+            except FileNotFoundError:
+                bank = None
+            if bank is not None and not bank.matches(self.word_index, *key):
+                bank = None
+            if bank is None:
+                print(f"No puzzle bank of {self.model_name} for tolerance {key[0]:g} and adjust power {key[1]:g}, "
+                      f"using random pairs. Run puzzles.py --tolerance {key[0]:g} --power {key[1]:g} to generate one.", flush=True)
+            self.puzzle_banks[key] = bank
+        return self.puzzle_banks[key]
@@ -1,13 +1,17 @@
 from config import *
 from utils import *
 from backend import Agent
+from placement import PlacementEngine
+from layout import ForceLayout
+from bridge import BackendBridge
 import init
 
 import random
 import math
+import threading
+import numpy as np
 
 import time
-import threading
 
 from PySide6.QtCore import (
     Qt,
@@ -16,6 +20,8 @@ from PySide6.QtCore import (
     QEvent,
     QLine,
     QLineF,
+    QRectF,
+    QTimer,
     Signal,
 )
 from PySide6.QtGui import (
@@ -32,6 +38,7 @@ from PySide6.QtGui import (
     QWindow,
     QImage,
     QFont,
+    QTransform,
 )
 from PySide6.QtWidgets import (
     QApplication,
@@ -55,9 +62,22 @@ from PySide6.QtWidgets import (
     QSizePolicy,
     QLabel,
     QStackedWidget,
+    QStyleOptionGraphicsItem,
 )
 
 
+def get_lod(painter):
+    return QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+
+
+class NodeLabel(QGraphicsTextItem):
+    def paint(self, painter, option, widget=None):
+        # unreadable when zoomed out, and text is the most expensive thing to draw
+        if get_lod(painter) < LOD_LABEL_SCALE:
+            return
+        super().paint(painter, option, widget)
+
+
 class Node(QGraphicsEllipseItem):
     def __init__(self, text, x, y, w, h, colour=NODE_COLOUR):
         super().__init__(0, 0, w, h)
@@ -69,12 +89,20 @@ class Node(QGraphicsEllipseItem):
         colour = QRgba64.fromRgba(*colour)
         self.setBrush(QBrush(colour))
         self.setPen(QColor(Qt.white))
+        self.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
 
         # label
-        self.label = QGraphicsTextItem(text, self)
+        self.label = NodeLabel(text, self)
         offset = self.boundingRect().center() - self.label.boundingRect().center()
         self.label.setPos(offset)
         self.label.setDefaultTextColor(Qt.white)
+        self.label.setCacheMode(QGraphicsItem.DeviceCoordinateCache)
+
+    def paint(self, painter, option, widget=None):
+        if get_lod(painter) < LOD_SIMPLE_SCALE:
+            painter.fillRect(self.rect(), self.brush())
+            return
+        super().paint(painter, option, widget)
     
     def add_edge(self, edge):
         self.edges.add(edge)
@@ -91,12 +119,22 @@ class Line(QGraphicsLineItem):
         end1.add_edge(self)
         end2.add_edge(self)
 
-        center1 = end1.scenePos() + QPointF(NODE_SIZE / 2, NODE_SIZE / 2)
-        center2 = end2.scenePos() + QPointF(NODE_SIZE / 2, NODE_SIZE / 2)
         self.setPen(QColor(Qt.white))
-        self.setLine(QLineF(center1, center2))
+        self.update_line()
 
         self.setZValue(-1)
+        # a cached pixmap of a diagonal line is mostly empty and is invalidated whenever an end moves
+        self.setCacheMode(QGraphicsItem.NoCache)
+
+    def paint(self, painter, option, widget=None):
+        if get_lod(painter) < LOD_SIMPLE_SCALE:
+            painter.setRenderHint(QPainter.Antialiasing, False)
+        super().paint(painter, option, widget)
+
+    def update_line(self):
+        center1 = self.end1.scenePos() + QPointF(NODE_SIZE / 2, NODE_SIZE / 2)
+        center2 = self.end2.scenePos() + QPointF(NODE_SIZE / 2, NODE_SIZE / 2)
+        self.setLine(QLineF(center1 - self.pos(), center2 - self.pos()))
     
     def is_connected(self, node):
         return (
@@ -118,7 +156,10 @@ class StaticText(QGraphicsTextItem):
     def update(self, text=None):
         if text is not None:
             self.setPlainText(text)
-        self.setPos(self.base_pos - self.boundingRect().center())
+        # offset in item coordinates so it stays correct when the item ignores the view's zoom
+        centre = self.boundingRect().center()
+        self.setPos(self.base_pos)
+        self.setTransform(QTransform.fromTranslate(-centre.x(), -centre.y()))
     
     def update_pos(self, pos: QPointF):
         self.base_pos = pos
@@ -151,11 +192,26 @@ class Gui(QWidget):
         self.items = {}
         self.origin = Node("", 0, 0, 0, 0)
         self.prev_node = None
+        # the bridge worker places guesses while the UI thread moves nodes during layout
+        self.placement = PlacementEngine()
+        self.placement_lock = threading.Lock()
+        self.force_layout = ForceLayout() if LAYOUT_MODE == 'force' else None
+        self.layout_timer = QTimer(self)
+        self.layout_timer.setInterval(1000 // FPS)
+        self.layout_timer.timeout.connect(self.step_layout)
         
         self.autocenterflag = False
 
         # backend
         self.backend = None
+        self.bridge = BackendBridge(self)
+        self.bridge.finished.connect(self.handle_finished)
+        self.bridge.failed.connect(self.handle_failed)
+        self.bridge.status.connect(self.loading_text.setText)
+        # seq -> word of every submitted guess without a result yet, in submission order
+        self.pending_guesses = {}
+        # guesses are refused while a new game is being drawn
+        self.starting = False
 
         # debug
         self.debug = debug
@@ -201,6 +257,8 @@ class Gui(QWidget):
         self.view.setMouseTracking(True)
         self.view.setRenderHint(QPainter.Antialiasing)
         self.view.viewport().installEventFilter(self)
+        if NAVIGATION_MODE == 'view':
+            self.init_view_navigation()
 
         # interface
         self.textbox = QLineEdit()
@@ -212,7 +270,13 @@ class Gui(QWidget):
         self.autocenterbtn.clicked.connect(self.toggle_autocenter)
         self.autocenterbtn.setCheckable(True)
         self.autocenterbtn.resize(0.2 * WIDTH, 0.1 * HEIGHT)
-        self.scene.addWidget(self.autocenterbtn)
+        self.autocenterbtn.setParent(self.view)
+
+        self.newgamebtn = QPushButton("New game")
+        self.newgamebtn.clicked.connect(self.new_game)
+        self.newgamebtn.resize(0.2 * WIDTH, 0.1 * HEIGHT)
+        self.newgamebtn.move(0.2 * WIDTH, 0)
+        self.newgamebtn.setParent(self.view)
 
         self.installEventFilter(self)
 
@@ -224,29 +288,79 @@ class Gui(QWidget):
 
         self.root.addWidget(self.game_widget)
 
+    def init_view_navigation(self):
+        """Pan and zoom through the view transform; items stay where they are in the scene."""
+        # let the scene (and its BSP index) grow with the items
+        self.scene.setSceneRect(QRectF())
+        self.view.setSceneRect(-SCENE_EXTENT, -SCENE_EXTENT, 2 * SCENE_EXTENT, 2 * SCENE_EXTENT)
+        self.view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.view.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.view.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
+        self.view.setOptimizationFlag(QGraphicsView.DontSavePainterState)
+        self.view.horizontalScrollBar().valueChanged.connect(self.update_overlays)
+        self.view.verticalScrollBar().valueChanged.connect(self.update_overlays)
+
+        # overlays are repositioned on every view change instead
+        self.display_text.setFlag(QGraphicsItem.ItemIgnoresTransformations)
+        self.bkgrd.setFlag(QGraphicsItem.ItemIgnoresTransformations)
+
+    def update_overlays(self):
+        size = self.view.viewport().size()
+        self.bkgrd.setPos(self.view.mapToScene(0, 0))
+        self.display_text.update_pos(self.view.mapToScene(size.width() // 2, size.height() - DISPLAY_TEXT_PAD))
+
+    def load(self):
+        self.bridge.submit('load', self.load_backend)
+
     def load_backend(self):
+        """Runs on the bridge worker thread; the loaded Agent is handed back by handle_finished."""
         try:
-            self.backend = Agent(model_name=FILE_NAME, tolerance=TOLERANCE, algo='default')
+            backend = Agent(model_name=FILE_NAME, tolerance=TOLERANCE, algo=SIMILARITY_ALGO, mmap=LOAD_MMAP, lexicon=LOAD_LEXICON, full_hints=FULL_PRECISION_HINTS, ann_hints=ANN_HINTS, puzzles=USE_PUZZLE_BANK, quantized=QUANTIZED)
         
         except FileNotFoundError:
-            self.loading_text.setText("Downloading model...")
+            self.bridge.status.emit("Downloading model...")
             init.init()
 
-            self.loading_text.setText("Loading...")
-            self.backend = Agent(model_name=FILE_NAME, tolerance=TOLERANCE, algo='default')
+            self.bridge.status.emit("Loading...")
+            backend = Agent(model_name=FILE_NAME, tolerance=TOLERANCE, algo=SIMILARITY_ALGO, mmap=LOAD_MMAP, lexicon=LOAD_LEXICON, full_hints=FULL_PRECISION_HINTS, ann_hints=ANN_HINTS, puzzles=USE_PUZZLE_BANK, quantized=QUANTIZED)
         
-        self.backend.init_core()
-        QApplication.postEvent(self, QEvent(QEvent.User))
+        backend.init_core(PUZZLE_DIFFICULTY)
+        return backend
     
     def start_game(self):
         start_node = self.add_node(self.backend.start, coords=QPointF(0, 0), center_flag=True)
         self.prev_node = start_node
+        self.starting = False
         self.root.setCurrentIndex(1)
 
         if self.debug:
             print(f"Start word: {self.backend.start}")
             print(f"Target word: {self.backend.target}\n")
 
+    def new_game(self):
+        """Drop queued guesses and results still in flight, then draw the next puzzle on the bridge worker."""
+        if self.backend is None or self.starting:
+            return
+        self.bridge.cancel_all()
+        self.pending_guesses.clear()
+        self.set_in_flight()
+        self.layout_timer.stop()
+        self.starting = True
+        self.bridge.submit('new_game', self.run_new_game)
+
+    def run_new_game(self):
+        """Runs on the bridge worker thread, after any guess that was already running."""
+        self.backend.init_core(PUZZLE_DIFFICULTY)
+        with self.placement_lock:
+            self.placement = PlacementEngine()
+
+    def clear_game(self):
+        for key in list(self.items):
+            self.remove_item(key)
+        self.prev_node = None
+        self.force_layout = ForceLayout() if LAYOUT_MODE == 'force' else None
+        self.display_text.clear()
+
     def add_item(self, item, key):
         self.items[key] = item
         self.scene.addItem(item)
@@ -268,7 +382,7 @@ class Gui(QWidget):
         return norm_minX + (x - minX) * (norm_maxX - norm_minX) / (maxX - minX)
     
     def norm_colour(self, x):
-        return 1 / (1 + math.exp(-10 * (x - 0.5)))
+        return norm_colour(x)
 
     def calc_line_len(self, word, closest_word):
         sim = self.backend.get_similarity(word, closest_word, adjust=True)
@@ -296,6 +410,14 @@ class Gui(QWidget):
         colour = (int(255 * red_val), int(255 * green_val), 0, 255)
         return colour
 
+    def to_world(self, pos: QPointF):
+        """Top-left scene position -> world centre used by the placement engine."""
+        centre = pos - self.origin.scenePos() + QPointF(NODE_SIZE / 2, NODE_SIZE / 2)
+        return np.array((centre.x(), centre.y()))
+
+    def to_scene(self, centre):
+        return QPointF(*centre) + self.origin.scenePos() - QPointF(NODE_SIZE / 2, NODE_SIZE / 2)
+
     def _add_node(self, word, coords, colour):
         node = Node(word, coords.x(), coords.y(), NODE_SIZE, NODE_SIZE, colour)
         self.add_item(node, word)
@@ -305,63 +427,71 @@ class Gui(QWidget):
         line = Line(self.items[word1], self.items[word2])
         self.add_item(line, f'line_{word1}_{word2}')
         return line
-    
-    def collide(self, src: QGraphicsItem):
-        node_cols, line_cols = 0, 0
-        for other in self.items.values():
-            if other is src or src.is_connected(other):
-                continue
-            if src.collidesWithItem(other):
-                if isinstance(other, Node):
-                    node_cols += 1
-                elif isinstance(other, Line):
-                    line_cols += 1
-        return node_cols, line_cols
-
-    def add_node_min_collision(self, word, closest_word=None, coords=None):
-        colour = self.calc_colour(word)
+
+    def place(self, word, closest_word, line_len):
+        """
+        Find a spot for word line_len away from closest_word and reserve it in the placement engine.
+        Called on the bridge worker, so the UI thread only receives the centre.
+
+        Return:
+            tuple(np.array, int, int): (centre, node_node, other), see PlacementEngine.find_position
+        """
+        with self.placement_lock:
+            centre, node_node, other = self.placement.find_position(closest_word, line_len, MAX_TRIES)
+            self.placement.add_node(word, centre)
+            self.placement.add_segment(word, closest_word)
+        return centre, node_node, other
+
+    def add_node_min_collision(self, word, closest_word=None, coords=None, colour=None, line_len=None, placed=None):
+        if colour is None:
+            colour = self.calc_colour(word)
 
         if closest_word is None:
-            return self._add_node(word, coords, colour)
+            node = self._add_node(word, coords, colour)
+            with self.placement_lock:
+                self.placement.add_node(word, self.to_world(node.pos()))
+            if self.force_layout is not None:
+                self.force_layout.add_node(word, self.to_world(node.pos()))
+            return node
         
-        line_len = self.calc_line_len(word, closest_word)
-        best_node, best_line = None, None
-        min_node_node, min_other = math.inf, math.inf
-
-        try_num = 0
-        while try_num < MAX_TRIES:
-            pos = self.calc_pos(closest_word, line_len)
-            node = self._add_node(word, pos, colour)
-            line = self._add_line(word, closest_word)
-
-            node_node, node_line = self.collide(node)
-            line_node, line_line = self.collide(line)
-            other = node_line + line_node + line_line
-
-            if (node_node, other) < (min_node_node, min_other):
-                min_node_node = node_node
-                min_other = other
-                best_node = node
-                best_line = line
-            
-            self.remove_item(word)
-            self.remove_item(f'line_{word}_{closest_word}')
-
-            try_num += 1
-            if (min_node_node, min_other) == (0, 0):
-                break
-        
-        self.add_item(best_node, word)
-        self.add_item(best_line, f'line_{word}_{closest_word}')
+        if line_len is None:
+            line_len = self.calc_line_len(word, closest_word)
+        if placed is None:
+            placed = self.place(word, closest_word, line_len)
+        centre, node_node, other = placed
+
+        node = self._add_node(word, self.to_scene(centre), colour)
+        self._add_line(word, closest_word)
+
+        if self.force_layout is not None:
+            self.force_layout.add_node(word, centre)
+            self.force_layout.add_edge(word, closest_word, line_len)
+            self.force_layout.start(word)
+            self.layout_timer.start()
 
         if self.debug:
-            if try_num >= MAX_TRIES:
-                print(f"Exhausted {MAX_TRIES} tries for '{word}'. Node-node: {min_node_node}, Other: {min_other}")
+            if (node_node, other) != (0, 0):
+                print(f"Exhausted {MAX_TRIES} tries for '{word}'. Node-node: {node_node}, Other: {other}")
         
-        return best_node
+        return node
 
-    def add_node(self, word, closest_word=None, coords=None, center_flag=None):
-        node = self.add_node_min_collision(word, closest_word, coords)
+    def step_layout(self):
+        """One frame of the force-directed relaxation: move the active nodes and their lines."""
+        moved = self.force_layout.step()
+        lines = set()
+        for word, centre in moved:
+            node = self.items[word]
+            node.setPos(self.to_scene(centre))
+            with self.placement_lock:
+                self.placement.move_node(word, centre)
+            lines.update(node.edges)
+        for line in lines:
+            line.update_line()
+        if not self.force_layout.running:
+            self.layout_timer.stop()
+
+    def add_node(self, word, closest_word=None, coords=None, center_flag=None, colour=None, line_len=None, placed=None):
+        node = self.add_node_min_collision(word, closest_word, coords, colour, line_len, placed)
         self.prev_node = node
         if center_flag:
             self.center_on(node)
@@ -371,8 +501,27 @@ class Gui(QWidget):
         self.origin.moveBy(dx, dy)
         for item in self.items.values():
             item.moveBy(dx, dy)
+
+    def pan(self, dx, dy):
+        if NAVIGATION_MODE != 'view':
+            self.move_all_items(dx, dy)
+            return
+        hbar, vbar = self.view.horizontalScrollBar(), self.view.verticalScrollBar()
+        hbar.setValue(hbar.value() - round(dx))
+        vbar.setValue(vbar.value() - round(dy))
+
+    def zoom(self, steps):
+        scale = self.view.transform().m11()
+        factor = min(ZOOM_MAX, max(ZOOM_MIN, scale * ZOOM_STEP ** steps)) / scale
+        self.view.scale(factor, factor)
+        self.update_overlays()
     
     def center_on(self, item: QGraphicsItem):
+        if NAVIGATION_MODE == 'view':
+            if item is not None:
+                self.view.centerOn(item.sceneBoundingRect().center())
+                self.update_overlays()
+            return
         try:
             width, height = self.scene.sceneRect().width(), self.scene.sceneRect().height()
             offset = QPointF((width - NODE_SIZE)/ 2, (height - NODE_SIZE) / 2)
@@ -389,34 +538,91 @@ class Gui(QWidget):
         self.display_text.update(message)
         self.display_text.setDefaultTextColor(QColor(Qt.red))
 
-    def successful_guess(self, word, closest_word):
-        self.add_node(word, closest_word, center_flag=self.autocenterflag)
-        self.display_text.clear()
+    def successful_guess(self, word, closest_word, colour=None, line_len=None, warmth=None, placed=None):
+        self.add_node(word, closest_word, center_flag=self.autocenterflag, colour=colour, line_len=line_len, placed=placed)
+        if warmth is None:
+            self.display_text.clear()
+        else:
+            self.display_text.update(warmth)
+            self.display_text.setDefaultTextColor(QColor(Qt.white))
+
+    def set_in_flight(self, word=None):
+        if word is None:
+            self.textbox.setPlaceholderText("Enter your guess: ")
+        else:
+            self.textbox.setPlaceholderText(f"Checking '{word}'...")
 
     def guess(self, word):
-        try:
-            state, message = self.backend.update(word)
-            if state == VALID or state == WON:
-                closest_word = message
-                self.successful_guess(word, closest_word)
-                if state == WON:
-                    self.win()
-                # Debug
-                if self.debug:
-                    print(f"Similarity: {self.backend.get_similarity(word, closest_word, adjust=True)}")
-            else:
-                self.display(message)
-        except AttributeError:
-            pass
-    
+        """Queue a guess; guesses are checked in the order they were typed."""
+        if self.backend is None or self.starting or not word:
+            return
+        seq = self.bridge.submit('guess', self.run_guess, word)
+        self.pending_guesses[seq] = word
+        self.set_in_flight(word)
         self.textbox.clear()
 
+    def guess_done(self, seq):
+        self.pending_guesses.pop(seq, None)
+        # show the latest guess still waiting, if any
+        self.set_in_flight(next(reversed(self.pending_guesses.values()), None))
+
+    def run_guess(self, word):
+        """Runs on the bridge worker thread: everything that touches the model, and the node placement."""
+        state, message = self.backend.update(word)
+        colour, line_len, warmth, placed = None, None, None, None
+        if state == VALID or state == WON:
+            colour = self.calc_colour(word)
+            line_len = self.calc_line_len(word, message)
+            warmth = self.backend.get_warmth_feedback(word)
+            placed = self.place(word, message, line_len)
+        return word, state, message, colour, line_len, warmth, placed
+
+    def handle_guess(self, seq, result):
+        word, state, message, colour, line_len, warmth, placed = result
+        if state == VALID or state == WON:
+            closest_word = message
+            self.successful_guess(word, closest_word, colour, line_len, warmth, placed)
+            if state == WON:
+                self.win()
+            # Debug
+            if self.debug:
+                print(f"Similarity: {self.backend.get_similarity(word, closest_word, adjust=True)}")
+        else:
+            self.display(message)
+
+    def handle_finished(self, seq, kind, result):
+        if self.bridge.is_stale(seq):
+            return
+        if kind == 'load':
+            self.backend = result
+            self.start_game()
+        elif kind == 'new_game':
+            self.clear_game()
+            self.start_game()
+        elif kind == 'guess':
+            self.guess_done(seq)
+            self.handle_guess(seq, result)
+
+    def handle_failed(self, seq, kind, error):
+        if self.bridge.is_stale(seq):
+            return
+        if kind == 'load':
+            self.loading_text.setText(f"Failed to load model: {error}")
+        elif kind == 'new_game':
+            self.starting = False
+            self.display(f"Failed to start a new game: {error}")
+        elif kind == 'guess':
+            word = self.pending_guesses.get(seq)
+            self.guess_done(seq)
+            self.display(error if word is None else f"'{word}': {error}")
+
     # Events
     def eventFilter(self, src, event: QEvent):
-        if (event.type() == QEvent.User):
-            self.start_game()
-        elif (event.type() == QEvent.MouseMove and src is self.view.viewport()):
+        if (event.type() == QEvent.MouseMove and src is self.view.viewport()):
             self.handle_mouse_move(event)
+        elif (event.type() == QEvent.Wheel and src is self.view.viewport() and NAVIGATION_MODE == 'view'):
+            self.zoom(event.angleDelta().y() / 120)
+            return True
         elif (event.type() == QEvent.KeyPress and src is self.textbox):
             self.handle_key_press(event)
         elif (event.type() == QEvent.Resize):
@@ -445,7 +651,7 @@ class Gui(QWidget):
         self.mouse_pos = new_pos
 
         if event.buttons() == Qt.MouseButton.LeftButton:
-            self.move_all_items(dpos.x(), dpos.y())
+            self.pan(dpos.x(), dpos.y())
     
     def handle_key_press(self, event: QKeyEvent):
         if event.key() == Qt.Key_Return:
@@ -454,9 +660,12 @@ class Gui(QWidget):
     
     def handle_resize_event(self, event: QResizeEvent):
         size = self.view.viewport().size()
-        self.scene.setSceneRect(0, 0, size.width(), size.height())
-        pos = QPointF(size.width() / 2, size.height() - DISPLAY_TEXT_PAD)
-        self.display_text.update_pos(pos)
+        if NAVIGATION_MODE == 'view':
+            self.update_overlays()
+        else:
+            self.scene.setSceneRect(0, 0, size.width(), size.height())
+            pos = QPointF(size.width() / 2, size.height() - DISPLAY_TEXT_PAD)
+            self.display_text.update_pos(pos)
         self.center_on(self.prev_node)
     
     # Settings
@@ -470,8 +679,8 @@ if __name__ == '__main__':
     app = QApplication([])
     gui = Gui()
 
-    t1 = threading.Thread(target=gui.load_backend, daemon=True)
-    t1.start()
+    gui.load()
 
     gui.show()
     app.exec()
+    gui.bridge.close()
@@ -0,0 +1,180 @@
+"""
+Headless newline-delimited JSON front end for a SessionManager, for bots and load generators.
+Every input line is one SessionManager command and gets exactly one response line, in order:
+
+    {"cmd": "new", "session": "bot-1", "id": 1}
+    {"cmd": "guess", "session": "bot-1", "word": "cat", "id": 2}
+    {"cmd": "hint", "session": "bot-1", "id": 3}
+    {"cmd": "state", "session": "bot-1", "id": 4}
+
+An optional "id" is echoed back in the response. Clients may choose the session id of a new game,
+so commands for many sessions can be pipelined over one stream without waiting for replies.
+
+    python headless.py                           stdin / stdout (logging goes to stderr)
+    python headless.py --socket /tmp/wordchain   Unix socket, one stream per connection
+"""
+import argparse
+import asyncio
+import contextlib
+import inspect
+import json
+import os
+import stat
+import sys
+import time
+
+from config import *
+from engine import Engine
+from server import SessionManager
+import similarity
+
+
+class LineProtocol:
+    """
+    Serves anything with the SessionManager handle/evict_idle interface over NDJSON streams.
+    handle may be async (e.g. workerpool.WorkerPool) when served over a socket; a synchronous
+    handle then runs on the loop's default executor, so one slow command does not stall other connections.
+    """
+    def __init__(self, sessions, evict_interval=None):
+        self.sessions = sessions
+        if evict_interval is None:
+            evict_interval = max(1, sessions.idle_timeout / 4)
+        self.evict_interval = evict_interval
+        self.last_evict = time.monotonic()
+
+    def decode(self, line):
+        """
+        Return:
+            dict: the command, or None if line is not a JSON object
+        """
+        try:
+            request = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return None
+        return request if isinstance(request, dict) else None
+
+    def encode(self, request, response):
+        if request is not None and 'id' in request:
+            response = {'id': request['id'], **response}
+        return json.dumps(response) + '\n'
+
+    def error(self):
+        return {'error': 'Message is not a JSON object.'}
+
+    def failure(self, e):
+        return {'error': str(e) if isinstance(e, ValueError) else f"Internal error: {e}"}
+
+    def handle_line(self, line):
+        request = self.decode(line)
+        if request is None:
+            return self.encode(request, self.error())
+        try:
+            # checked here too, so a WorkerPool does not route on a malformed session
+            SessionManager.validate(request)
+            response = self.sessions.handle(request)
+        except Exception as e:
+            # every line gets its reply, whatever went wrong
+            response = self.failure(e)
+        return self.encode(request, response)
+
+    async def dispatch_line(self, line):
+        request = self.decode(line)
+        if request is None:
+            return self.encode(request, self.error())
+        try:
+            SessionManager.validate(request)
+            if inspect.iscoroutinefunction(self.sessions.handle):
+                response = await self.sessions.handle(request)
+            else:
+                # frontier updates and hints scan the vocab, so they run off the event loop
+                response = await asyncio.get_running_loop().run_in_executor(None, self.sessions.handle, request)
+        except Exception as e:
+            response = self.failure(e)
+        return self.encode(request, response)
+
+    def maybe_evict(self):
+        now = time.monotonic()
+        if now - self.last_evict >= self.evict_interval:
+            self.last_evict = now
+            self.sessions.evict_idle()
+
+    # stdin / stdout
+    def serve_stdio(self, infile=None, outfile=None):
+        infile = sys.stdin if infile is None else infile
+        outfile = sys.stdout if outfile is None else outfile
+        # keep stray prints (e.g. lazy index builds) out of the response stream
+        with contextlib.redirect_stdout(sys.stderr):
+            for line in infile:
+                if not line.strip():
+                    continue
+                outfile.write(self.handle_line(line))
+                outfile.flush()
+                self.maybe_evict()
+
+    # Unix socket
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                writer.write((await self.dispatch_line(line)).encode())
+                await writer.drain()
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            writer.close()
+
+    async def evict_loop(self):
+        while True:
+            await asyncio.sleep(self.evict_interval)
+            # a WorkerPool waits for its workers to evict
+            await asyncio.get_running_loop().run_in_executor(None, self.sessions.evict_idle)
+
+    @staticmethod
+    def remove_socket(path):
+        """Remove a stale socket at path, but never a regular file that happens to be there."""
+        try:
+            mode = os.stat(path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise FileExistsError(f"{path} exists and is not a socket.")
+        os.unlink(path)
+
+    async def serve_unix(self, path):
+        self.remove_socket(path)
+        server = await asyncio.start_unix_server(self.handle_client, path, limit=2 ** 20)
+        evictor = asyncio.create_task(self.evict_loop())
+        print(f"Serving WordChain on unix:{path}", file=sys.stderr, flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            evictor.cancel()
+            self.remove_socket(path)
+
+    def run(self, socket_path=None):
+        if socket_path is None:
+            self.serve_stdio()
+        else:
+            asyncio.run(self.serve_unix(socket_path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless WordChain: newline-delimited JSON commands over stdin/stdout or a Unix socket.")
+    parser.add_argument('--socket', default=None, help="serve on this Unix socket path instead of stdin/stdout")
+    parser.add_argument('--model', default=FILE_NAME)
+    parser.add_argument('--algo', default=SIMILARITY_ALGO, choices=list(similarity.ENGINES))
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--idle-timeout', type=float, default=SESSION_IDLE_TIMEOUT)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(sys.stderr):
+        engine = Engine(args.model, mmap=LOAD_MMAP, lexicon=LOAD_LEXICON, full_hints=FULL_PRECISION_HINTS,
+                        ann_hints=ANN_HINTS, puzzles=USE_PUZZLE_BANK, quantized=QUANTIZED)
+    sessions = SessionManager(engine, args.tolerance, args.algo, args.idle_timeout)
+    print(sessions.describe_memory(), file=sys.stderr, flush=True)
+    LineProtocol(sessions).run(args.socket)
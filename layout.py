@@ -0,0 +1,211 @@
+from collections import defaultdict, deque
+
+import numpy as np
+
+from config import *
+
+
+class QuadTree:
+    """
+    Barnes-Hut quadtree stored as flat arrays. Points are reordered so every node owns the
+    contiguous range order[start:end]; internal nodes keep their centre of mass.
+    """
+    def __init__(self, points, leaf_size=8):
+        self.points = points
+        self.leaf_size = leaf_size
+        self.order = np.arange(len(points))
+        self.children = []
+        self.start = []
+        self.end = []
+        self.mass = []
+        self.com = []
+        self.size = []
+        if len(points):
+            lo, hi = points.min(axis=0), points.max(axis=0)
+            self.build(0, len(points), lo, max(float((hi - lo).max()), 1e-6))
+
+        self.children = np.array(self.children, dtype=np.int64).reshape(-1, 4)
+        self.start = np.array(self.start, dtype=np.int64)
+        self.end = np.array(self.end, dtype=np.int64)
+        self.mass = np.array(self.mass, dtype=np.float64)
+        self.com = np.array(self.com, dtype=np.float64).reshape(-1, 2)
+        self.size = np.array(self.size, dtype=np.float64)
+        self.is_leaf = (self.children < 0).all(axis=1)
+
+    def build(self, start, end, lo, size):
+        node = len(self.start)
+        members = self.points[self.order[start:end]]
+        self.children.append([-1, -1, -1, -1])
+        self.start.append(start)
+        self.end.append(end)
+        self.mass.append(end - start)
+        self.com.append(members.mean(axis=0))
+        self.size.append(size)
+        if end - start <= self.leaf_size or size < 1e-3:
+            return node
+
+        half = size / 2
+        mid = lo + half
+        quadrant = (members[:, 0] >= mid[0]).astype(np.int64) + 2 * (members[:, 1] >= mid[1])
+        sort = np.argsort(quadrant, kind='stable')
+        self.order[start:end] = self.order[start:end][sort]
+        counts = np.bincount(quadrant, minlength=4)
+
+        offset = start
+        for q in range(4):
+            if counts[q]:
+                child_lo = lo + half * np.array([q % 2, q // 2])
+                self.children[node][q] = self.build(offset, offset + counts[q], child_lo, half)
+            offset += counts[q]
+        return node
+
+    def repulsion(self, targets, strength, theta=0.8, min_dist=1.0):
+        """
+        Approximate sum over tree points q of strength * (p - q) / |p - q|^3 for every target p.
+        The traversal is level-synchronous over (target, node) pairs, so it is vectorized.
+        """
+        forces = np.zeros_like(targets, dtype=np.float64)
+        if len(self.start) == 0:
+            return forces
+
+        pair_t = np.arange(len(targets))
+        pair_n = np.zeros(len(targets), dtype=np.int64)
+        while len(pair_t):
+            delta = targets[pair_t] - self.com[pair_n]
+            dist = np.maximum(np.linalg.norm(delta, axis=1), min_dist)
+            far = self.size[pair_n] / dist < theta
+            leaf = self.is_leaf[pair_n] & ~far
+
+            # distant cells act as a single mass at their centre of mass
+            contrib = strength * self.mass[pair_n[far], None] * delta[far] / dist[far, None] ** 3
+            np.add.at(forces, pair_t[far], contrib)
+
+            # nearby leaves are summed exactly
+            if leaf.any():
+                leaf_t, leaf_n = pair_t[leaf], pair_n[leaf]
+                counts = self.end[leaf_n] - self.start[leaf_n]
+                rep_t = np.repeat(leaf_t, counts)
+                offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                members = self.order[np.repeat(self.start[leaf_n], counts) + offsets]
+                d = targets[rep_t] - self.points[members]
+                r = np.maximum(np.linalg.norm(d, axis=1), min_dist)
+                np.add.at(forces, rep_t, strength * d / r[:, None] ** 3)
+
+            # open the remaining cells
+            split = ~far & ~leaf
+            children = self.children[pair_n[split]]
+            valid = children >= 0
+            pair_t = np.repeat(pair_t[split], valid.sum(axis=1))
+            pair_n = children[valid]
+        return forces
+
+
+class ForceLayout:
+    """
+    Incremental force-directed layout of the chain graph.
+    Adding a node starts a relaxation of its neighbourhood only (up to max_active nodes within
+    hops of it); each step() advances that relaxation once, so it can be spread over frames.
+    Springs pull linked nodes to their line length; every node repels every active node,
+    approximated with a Barnes-Hut tree of the fixed nodes.
+    """
+    def __init__(self, hops=LAYOUT_HOPS, max_active=LAYOUT_MAX_ACTIVE, steps=LAYOUT_STEPS,
+                 repulsion=LAYOUT_REPULSION, spring=LAYOUT_SPRING, max_move=LAYOUT_MAX_MOVE, theta=0.8):
+        self.hops = hops
+        self.max_active = max_active
+        self.steps = steps
+        self.repulsion = repulsion
+        self.spring = spring
+        self.max_move = max_move
+        self.theta = theta
+
+        self.keys = []
+        self.index = {}
+        self.positions = np.zeros((16, 2))
+        self.adjacency = defaultdict(list)
+
+        self.active = None
+        self.tree = None
+        self.remaining = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def running(self):
+        return self.remaining > 0
+
+    def add_node(self, key, pos):
+        if len(self.keys) == len(self.positions):
+            bigger = np.zeros((2 * len(self.positions), 2))
+            bigger[:len(self.positions)] = self.positions
+            self.positions = bigger
+        self.index[key] = len(self.keys)
+        self.positions[len(self.keys)] = pos
+        self.keys.append(key)
+
+    def add_edge(self, key1, key2, length):
+        i, j = self.index[key1], self.index[key2]
+        self.adjacency[i].append((j, length))
+        self.adjacency[j].append((i, length))
+
+    def get_neighbourhood(self, key):
+        seen = {self.index[key]: 0}
+        queue = deque([self.index[key]])
+        while queue and len(seen) < self.max_active:
+            node = queue.popleft()
+            if seen[node] >= self.hops:
+                continue
+            for neighbour, _ in self.adjacency[node]:
+                if neighbour not in seen and len(seen) < self.max_active:
+                    seen[neighbour] = seen[node] + 1
+                    queue.append(neighbour)
+        return np.array(sorted(seen), dtype=np.int64)
+
+    def start(self, key):
+        """Begin relaxing the neighbourhood of key (replaces any relaxation in progress)."""
+        self.active = self.get_neighbourhood(key)
+        fixed = np.ones(len(self.keys), dtype=bool)
+        fixed[self.active] = False
+        self.fixed_positions = self.positions[:len(self.keys)][fixed]
+        self.tree = QuadTree(self.fixed_positions)
+        self.remaining = self.steps
+
+        edges = [(a, j, length) for a in self.active for j, length in self.adjacency[a]]
+        self.edge_src = np.array([self.active.searchsorted(a) for a, _, _ in edges], dtype=np.int64)
+        self.edge_dst = np.array([j for _, j, _ in edges], dtype=np.int64)
+        self.edge_len = np.array([length for _, _, length in edges], dtype=np.float64)
+
+    def get_forces(self, pos):
+        forces = self.tree.repulsion(pos, self.repulsion, self.theta)
+
+        # active nodes repel each other exactly
+        delta = pos[:, None, :] - pos[None, :, :]
+        dist = np.maximum(np.linalg.norm(delta, axis=-1), 1.0)
+        np.fill_diagonal(dist, np.inf)
+        forces += (self.repulsion * delta / dist[..., None] ** 3).sum(axis=1)
+
+        if len(self.edge_src):
+            other = self.positions[self.edge_dst]
+            other_active = np.isin(self.edge_dst, self.active)
+            other[other_active] = pos[self.active.searchsorted(self.edge_dst[other_active])]
+            d = other - pos[self.edge_src]
+            length = np.maximum(np.linalg.norm(d, axis=1), 1e-6)
+            pull = self.spring * (length - self.edge_len) / length
+            np.add.at(forces, self.edge_src, pull[:, None] * d)
+        return forces
+
+    def step(self):
+        """
+        Return:
+            list(tuple(str, np.array)): moved keys and their new positions
+        """
+        if not self.running:
+            return []
+        pos = self.positions[self.active]
+        moves = self.get_forces(pos)
+        norms = np.maximum(np.linalg.norm(moves, axis=1, keepdims=True), 1e-12)
+        cooling = self.remaining / self.steps
+        moves *= np.minimum(1, self.max_move * cooling / norms)
+        self.positions[self.active] = pos + moves
+        self.remaining -= 1
+        return [(self.keys[i], self.positions[i].copy()) for i in self.active]
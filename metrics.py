@@ -0,0 +1,259 @@
+"""
+Opt-in instrumentation: timing histograms per operation, value histograms, labelled counters,
+gauges and a log of slow calls, exported as JSON or Prometheus text exposition.
+Every process records its own metrics; snapshot() and merge() combine them (see workerpool.py).
+
+Functions are marked with @timed and their owner (class or module) with register(). Marking
+returns the function unchanged; enable() swaps timing wrappers in and disable() swaps the
+originals back, so disabled instrumentation costs nothing on the hot path.
+"""
+import bisect
+import copy
+import functools
+import sys
+import threading
+import time
+from collections import deque
+
+from config import *
+
+
+# upper bounds (seconds) of the timing histogram buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# upper bounds of the buckets of counted values, e.g. chain lengths
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+    def get_cumulative(self):
+        total, cumulative = 0, []
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'max': self.max,
+            'buckets': {str(le): n for le, n in zip(self.buckets + ('+Inf',), self.get_cumulative())},
+        }
+
+
+class Metrics:
+    def __init__(self, prefix='wordchain', slow_threshold=METRICS_SLOW_MS / 1000, slow_log_size=1000, verbose=False):
+        self.prefix = prefix
+        self.slow_threshold = slow_threshold
+        self.verbose = verbose
+        self.enabled = False
+        self.owners = []
+        self.originals = {}
+        self.lock = threading.Lock()
+        self.reset(slow_log_size)
+
+    def reset(self, slow_log_size=None):
+        with self.lock:
+            self.timings = {}
+            self.histograms = {}
+            self.counters = {}
+            self.gauges = {}
+            self.slow_calls = deque(maxlen=slow_log_size or self.slow_calls.maxlen)
+
+    # Recording
+    def observe(self, name, seconds):
+        with self.lock:
+            if name not in self.timings:
+                self.timings[name] = Histogram()
+            self.timings[name].observe(seconds)
+            if seconds >= self.slow_threshold:
+                self.slow_calls.append({'op': name, 'ms': seconds * 1000, 'time': time.time()})
+        if seconds >= self.slow_threshold and self.verbose:
+            print(f"[metrics] slow call: {name} took {seconds * 1000:.1f} ms", flush=True)
+
+    def record(self, name, value, buckets=COUNT_BUCKETS):
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(buckets)
+            self.histograms[name].observe(value)
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    # Combining processes
+    def snapshot(self):
+        """
+        Return:
+            dict: a picklable copy of everything recorded, for merge() in another process
+        """
+        with self.lock:
+            return copy.deepcopy({
+                'timings': self.timings,
+                'histograms': self.histograms,
+                'counters': self.counters,
+                'gauges': self.gauges,
+                'slow_calls': list(self.slow_calls),
+            })
+
+    def merge(self, snapshot):
+        """Add a snapshot() of another process; gauges are summed."""
+        with self.lock:
+            for attr in ('timings', 'histograms'):
+                merged = getattr(self, attr)
+                for name, histogram in snapshot[attr].items():
+                    if name in merged:
+                        merged[name].merge(histogram)
+                    else:
+                        merged[name] = copy.deepcopy(histogram)
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, value in snapshot['gauges'].items():
+                self.gauges[name] = self.gauges.get(name, 0) + value
+            slow_calls = sorted([*self.slow_calls, *snapshot['slow_calls']], key=lambda call: call['time'])
+            self.slow_calls = deque(slow_calls, maxlen=self.slow_calls.maxlen)
+
+    # Instrumentation
+    def register(self, owner):
+        """Instrument the @timed functions of a class or module (by name) while enabled."""
+        if isinstance(owner, str):
+            owner = sys.modules[owner]
+        self.owners.append(owner)
+        if self.enabled:
+            self.wrap(owner)
+        return owner
+
+    def get_marked(self, owner):
+        return [(attr, fn) for attr, fn in vars(owner).items() if hasattr(fn, '_metric')]
+
+    def wrap(self, owner):
+        for attr, fn in self.get_marked(owner):
+            self.originals[(owner, attr)] = fn
+            setattr(owner, attr, self.make_wrapper(fn))
+
+    def make_wrapper(self, fn):
+        name, on_result = fn._metric, fn._on_result
+        perf_counter = time.perf_counter
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            result = fn(*args, **kwargs)
+            self.observe(name, perf_counter() - start)
+            if on_result is not None:
+                on_result(self, args, result)
+            return result
+        return wrapper
+
+    def enable(self):
+        if not self.enabled:
+            self.enabled = True
+            for owner in self.owners:
+                self.wrap(owner)
+
+    def disable(self):
+        if self.enabled:
+            self.enabled = False
+            for (owner, attr), fn in self.originals.items():
+                setattr(owner, attr, fn)
+            self.originals = {}
+
+    # Export
+    def to_dict(self):
+        with self.lock:
+            counters = {}
+            for (name, labels), value in self.counters.items():
+                counters.setdefault(name, {})[','.join(f"{k}={v}" for k, v in labels)] = value
+            return {
+                'enabled': self.enabled,
+                'timings': {name: histogram.to_dict() for name, histogram in self.timings.items()},
+                'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+                'counters': counters,
+                'gauges': dict(self.gauges),
+                'slow_calls': list(self.slow_calls),
+            }
+
+    def to_prometheus(self):
+        p = self.prefix
+        lines = []
+        with self.lock:
+            lines.append(f"# HELP {p}_op_seconds Time spent per operation.")
+            lines.append(f"# TYPE {p}_op_seconds histogram")
+            for name, histogram in self.timings.items():
+                for le, n in zip(histogram.buckets + ('+Inf',), histogram.get_cumulative()):
+                    lines.append(f'{p}_op_seconds_bucket{{op="{name}",le="{le}"}} {n}')
+                lines.append(f'{p}_op_seconds_sum{{op="{name}"}} {histogram.sum}')
+                lines.append(f'{p}_op_seconds_count{{op="{name}"}} {histogram.count}')
+
+            for name, histogram in self.histograms.items():
+                lines.append(f"# TYPE {p}_{name} histogram")
+                for le, n in zip(histogram.buckets + ('+Inf',), histogram.get_cumulative()):
+                    lines.append(f'{p}_{name}_bucket{{le="{le}"}} {n}')
+                lines.append(f"{p}_{name}_sum {histogram.sum}")
+                lines.append(f"{p}_{name}_count {histogram.count}")
+
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {p}_{name}_total counter")
+                for (counter, labels), value in self.counters.items():
+                    if counter == name:
+                        labels = ','.join(f'{k}="{v}"' for k, v in labels)
+                        labels = f"{{{labels}}}" if labels else ''
+                        lines.append(f"{p}_{name}_total{labels} {value}")
+
+            for name, value in self.gauges.items():
+                lines.append(f"# TYPE {p}_{name} gauge")
+                lines.append(f"{p}_{name} {value}")
+
+            lines.append(f"# TYPE {p}_slow_calls gauge")
+            lines.append(f"{p}_slow_calls {len(self.slow_calls)}")
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = Metrics()
+
+
+def timed(name, on_result=None):
+    """
+    Mark a function to be timed as name while METRICS is enabled.
+    on_result(metrics, args, result) is also called after each call, e.g. to count result codes.
+    """
+    def decorator(fn):
+        fn._metric = name
+        fn._on_result = on_result
+        return fn
+    return decorator
+
+def enable():
+    METRICS.enable()
+
+def disable():
+    METRICS.disable()
+
+
+if METRICS_ENABLED:
+    enable()
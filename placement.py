@@ -0,0 +1,205 @@
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from config import *
+
+
+def point_segment_distance_sq(points, p, q):
+    """Broadcasted squared distance from points to segments pq."""
+    dx, dy = q[..., 0] - p[..., 0], q[..., 1] - p[..., 1]
+    px, py = points[..., 0] - p[..., 0], points[..., 1] - p[..., 1]
+    length_sq = np.maximum(dx * dx + dy * dy, 1e-12)
+    t = np.clip((px * dx + py * dy) / length_sq, 0, 1)
+    ex, ey = px - t * dx, py - t * dy
+    return ex * ex + ey * ey
+
+def cross(o, a, b):
+    return (a[..., 0] - o[..., 0]) * (b[..., 1] - o[..., 1]) - (a[..., 1] - o[..., 1]) * (b[..., 0] - o[..., 0])
+
+def segments_intersect(p1, q1, p2, q2):
+    """Broadcasted test for proper intersection of segments p1q1 and p2q2."""
+    d1, d2 = cross(p2, q2, p1), cross(p2, q2, q1)
+    d3, d4 = cross(p1, q1, p2), cross(p1, q1, q2)
+    return (d1 * d2 < 0) & (d3 * d4 < 0)
+
+
+class PlacementEngine:
+    """
+    Pure-geometry model of the chain graph for collision-free node placement.
+    Nodes are circles and edges are segments between node centres, both bucketed in a
+    uniform grid so a placement only looks at its neighbourhood. Candidate angles are
+    scored in vectorized batches with the same rules as Gui.collide used to:
+        node_node: new circle overlaps a circle
+        other:     new circle crosses a segment, new segment crosses a circle (other than
+                   its ends) or crosses a segment not sharing its anchor
+    Coordinates are world coordinates (independent of panning).
+    """
+    def __init__(self, radius=NODE_SIZE / 2, cell_size=MAX_LINE_LENGTH + NODE_SIZE):
+        self.radius = radius
+        self.cell_size = cell_size
+
+        self.keys = {}
+        self.centers = np.zeros((16, 2))
+        self.n_nodes = 0
+
+        self.segments = np.zeros((16, 4))
+        self.segment_nodes = np.zeros((16, 2), dtype=np.int64)
+        self.n_segments = 0
+
+        self.node_cells = defaultdict(set)
+        self.segment_cells = defaultdict(set)
+        self.node_segments = defaultdict(list)
+
+    def __len__(self):
+        return self.n_nodes
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def get_center(self, key):
+        return self.centers[self.keys[key]].copy()
+
+    def get_cell(self, x, y):
+        return int(math.floor(x / self.cell_size)), int(math.floor(y / self.cell_size))
+
+    def iter_cells(self, xmin, ymin, xmax, ymax):
+        cx0, cy0 = self.get_cell(xmin, ymin)
+        cx1, cy1 = self.get_cell(xmax, ymax)
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                yield cx, cy
+
+    def grow(self, arr, n):
+        if n < len(arr):
+            return arr
+        bigger = np.zeros((2 * len(arr),) + arr.shape[1:], dtype=arr.dtype)
+        bigger[:len(arr)] = arr
+        return bigger
+
+    def add_node(self, key, center):
+        self.centers = self.grow(self.centers, self.n_nodes)
+        node = self.n_nodes
+        self.centers[node] = center
+        self.keys[key] = node
+        self.n_nodes += 1
+        self.bucket_node(node)
+        return node
+
+    def add_segment(self, key1, key2):
+        self.segments = self.grow(self.segments, self.n_segments)
+        self.segment_nodes = self.grow(self.segment_nodes, self.n_segments)
+        segment = self.n_segments
+        a, b = self.keys[key1], self.keys[key2]
+        p, q = self.centers[a], self.centers[b]
+        self.segments[segment] = (*p, *q)
+        self.segment_nodes[segment] = (a, b)
+        self.n_segments += 1
+        self.node_segments[a].append(segment)
+        self.node_segments[b].append(segment)
+        self.bucket_segment(segment)
+        return segment
+
+    def node_cells_of(self, node):
+        x, y = self.centers[node]
+        r = self.radius
+        return self.iter_cells(x - r, y - r, x + r, y + r)
+
+    def segment_cells_of(self, segment):
+        x1, y1, x2, y2 = self.segments[segment]
+        return self.iter_cells(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+
+    def bucket_node(self, node, remove=False):
+        for cell in self.node_cells_of(node):
+            if remove:
+                self.node_cells[cell].discard(node)
+            else:
+                self.node_cells[cell].add(node)
+
+    def bucket_segment(self, segment, remove=False):
+        for cell in self.segment_cells_of(segment):
+            if remove:
+                self.segment_cells[cell].discard(segment)
+            else:
+                self.segment_cells[cell].add(segment)
+
+    def move_node(self, key, center):
+        """Move a node and its incident segments, re-bucketing them in the grid."""
+        node = self.keys[key]
+        self.bucket_node(node, remove=True)
+        self.centers[node] = center
+        self.bucket_node(node)
+        for segment in self.node_segments[node]:
+            self.bucket_segment(segment, remove=True)
+            a, b = self.segment_nodes[segment]
+            self.segments[segment] = (*self.centers[a], *self.centers[b])
+            self.bucket_segment(segment)
+
+    def query(self, xmin, ymin, xmax, ymax):
+        """
+        Return:
+            tuple(np.array, np.array): ids of nodes and segments in cells overlapping the box
+        """
+        nodes, segments = set(), set()
+        for cell in self.iter_cells(xmin, ymin, xmax, ymax):
+            nodes.update(self.node_cells.get(cell, ()))
+            segments.update(self.segment_cells.get(cell, ()))
+        return np.fromiter(nodes, dtype=np.int64), np.fromiter(segments, dtype=np.int64)
+
+    def score(self, anchor, candidates, nodes, segments):
+        """
+        Return:
+            tuple(np.array, np.array): (node_node, other) collision counts per candidate centre
+        """
+        r_sq = self.radius ** 2
+        a = self.centers[anchor]
+        n = self.centers[nodes]
+        s = self.segments[segments]
+        sp, sq = s[:, :2], s[:, 2:]
+        c = candidates[:, None, :]
+
+        diff = c - n[None]
+        node_node = ((diff ** 2).sum(axis=-1) < 4 * r_sq).sum(axis=1)
+        node_line = (point_segment_distance_sq(c, sp[None], sq[None]) < r_sq).sum(axis=1)
+
+        others = n[nodes != anchor]
+        line_node = (point_segment_distance_sq(others[None], a, c) < r_sq).sum(axis=1)
+
+        not_incident = (self.segment_nodes[segments] != anchor).all(axis=1)
+        p2, q2 = sp[not_incident][None], sq[not_incident][None]
+        line_line = segments_intersect(a, c, p2, q2).sum(axis=1)
+
+        return node_node, node_line + line_node + line_line
+
+    def find_position(self, anchor_key, line_len, max_tries=MAX_TRIES, batch_size=1024, rng=None):
+        """
+        Try up to max_tries random directions at distance line_len from the anchor.
+
+        Return:
+            tuple(np.array, int, int): (best centre, node_node, other) - stops at the first
+                                       collision-free candidate
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        line_len = float(line_len)
+        anchor = self.keys[anchor_key]
+        a = self.centers[anchor]
+        reach = line_len + 2 * self.radius
+        nodes, segments = self.query(a[0] - reach, a[1] - reach, a[0] + reach, a[1] + reach)
+        nodes = nodes[((self.centers[nodes] - a) ** 2).sum(axis=1) <= reach ** 2]
+        s = self.segments[segments]
+        segments = segments[point_segment_distance_sq(a, s[:, :2], s[:, 2:]) <= reach ** 2]
+
+        best, best_key = None, (math.inf, math.inf)
+        for start in range(0, max_tries, batch_size):
+            theta = rng.uniform(0, 2 * math.pi, min(batch_size, max_tries - start))
+            candidates = a + line_len * np.stack([np.cos(theta), np.sin(theta)], axis=1)
+            node_node, other = self.score(anchor, candidates, nodes, segments)
+
+            i = int(np.lexsort((other, node_node))[0])
+            if (node_node[i], other[i]) < best_key:
+                best, best_key = candidates[i], (int(node_node[i]), int(other[i]))
+            if best_key == (0, 0):
+                break
+        return best, best_key[0], best_key[1]
@@ -0,0 +1,187 @@
+from sklearn.manifold import TSNE
+
+import numpy as np
+import json
+import os
+import time
+
+from utils import *
+from embedding import Embedding2D
+
+import dataloader
+
+
+class ProjectionPipeline:
+    """
+    Staged, resumable 2D projection of the playable vocabulary:
+
+        restrict -> pca -> sample -> tsne -> place -> save
+
+    Each stage checkpoints into models/<file_name>/projection/, so an interrupted run
+    picks up after the last finished stage (and after the last finished batch of 'place').
+    The checkpoints are stamped with the model, dictionary and parameters in params.json and
+    discarded if a run with different ones finds them.
+    Only a sample is fitted with t-SNE; every other word is placed at the distance-weighted
+    mean of its nearest sampled neighbours in PCA space.
+    """
+    def __init__(self, model, dictionary, file_name, pca_dims=50, sample_size=20000,
+                 n_neighbors=10, batch_size=2048, random_state=0, verbose=True):
+        self.model = model
+        self.dictionary = dictionary
+        self.file_name = file_name
+        self.pca_dims = pca_dims
+        self.sample_size = sample_size
+        self.n_neighbors = n_neighbors
+        self.batch_size = batch_size
+        self.random_state = random_state
+        self.verbose = verbose
+
+        self.work_path = f"{dataloader.get_model_path(file_name)}/projection"
+        if not os.path.exists(self.work_path):
+            os.makedirs(self.work_path)
+        self.params = {
+            'vocab': vocab_checksum(model.wv.index_to_key), 'vector_size': model.wv.vector_size,
+            'dictionary': vocab_checksum(sorted(set(dictionary))), 'pca_dims': pca_dims,
+            'sample_size': sample_size, 'n_neighbors': n_neighbors, 'random_state': random_state,
+        }
+        self.check_params()
+
+    def log(self, message):
+        if self.verbose:
+            print(f"[projection] {message}", flush=True)
+
+    def get_path(self, name):
+        return f"{self.work_path}/{name}.npy"
+
+    def get_params_path(self):
+        return f"{self.work_path}/params.json"
+
+    def check_params(self):
+        """Drop checkpoints made for another model, dictionary or parameters, then stamp the directory with these."""
+        params_path = self.get_params_path()
+        if os.path.isfile(params_path):
+            with open(params_path, 'r') as f:
+                if json.load(f) == self.params:
+                    return
+        stale = [name for name in os.listdir(self.work_path) if name.endswith('.npy') or name == 'place_progress.txt']
+        if stale:
+            self.log("Checkpoints were made with other parameters, starting over")
+            for name in stale:
+                os.remove(f"{self.work_path}/{name}")
+        with atomic_path(params_path) as tmp:
+            with open(tmp, 'w') as f:
+                json.dump(self.params, f)
+
+    def checkpoint(self, name, compute):
+        path = self.get_path(name)
+        if os.path.isfile(path):
+            self.log(f"{name}: resuming from checkpoint")
+            return np.load(path, mmap_mode='r')
+        start = time.time()
+        result = compute()
+        with atomic_path(path) as tmp:
+            np.save(tmp, result)
+        self.log(f"{name}: done in {time.time() - start:.1f}s")
+        return np.load(path, mmap_mode='r')
+
+    def restrict(self):
+        dict_set = set(self.dictionary)
+        vocab = self.model.wv.index_to_key
+        return np.array([i for i, word in enumerate(vocab) if word in dict_set], dtype=np.int64)
+
+    def iter_normed(self, indices):
+        wv = self.model.wv
+        wv.fill_norms()
+        for start in range(0, len(indices), self.batch_size):
+            rows = indices[start:start + self.batch_size]
+            norms = np.maximum(wv.norms[rows], np.finfo(np.float32).tiny)
+            yield wv.vectors[rows].astype(np.float32) / norms[:, None]
+
+    def pca(self, indices):
+        """Streamed PCA: accumulate the covariance in batches, then project in batches."""
+        dims = self.model.wv.vector_size
+        total = np.zeros(dims, dtype=np.float64)
+        outer = np.zeros((dims, dims), dtype=np.float64)
+        for batch in self.iter_normed(indices):
+            total += batch.sum(axis=0)
+            outer += batch.T.astype(np.float64) @ batch
+        mean = total / len(indices)
+        cov = outer / len(indices) - np.outer(mean, mean)
+        _, eigvecs = np.linalg.eigh(cov)
+        components = eigvecs[:, ::-1][:, :self.pca_dims].astype(np.float32)
+
+        reduced = np.empty((len(indices), components.shape[1]), dtype=np.float32)
+        for i, batch in enumerate(self.iter_normed(indices)):
+            start = i * self.batch_size
+            reduced[start:start + len(batch)] = (batch - mean.astype(np.float32)) @ components
+        return reduced
+
+    def sample(self, n):
+        rng = np.random.default_rng(self.random_state)
+        size = min(self.sample_size, n)
+        return np.sort(rng.choice(n, size=size, replace=False))
+
+    def tsne(self, reduced, sample):
+        tsne = TSNE(n_components=2, random_state=self.random_state, verbose=int(self.verbose))
+        return tsne.fit_transform(np.asarray(reduced[sample])).astype(np.float32)
+
+    def place(self, reduced, sample, sample_2d):
+        """Place every word in batches; progress is persisted after each batch."""
+        path = self.get_path('coords')
+        progress_path = f"{self.work_path}/place_progress.txt"
+
+        done = 0
+        if os.path.isfile(path) and os.path.isfile(progress_path):
+            coords = np.load(path, mmap_mode='r+')
+            done = int(open(progress_path, 'r').read())
+            self.log(f"place: resuming at row {done}/{len(reduced)}")
+        else:
+            coords = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(len(reduced), 2))
+
+        anchors = np.asarray(reduced[sample])
+        anchor_sq = (anchors ** 2).sum(axis=1)
+        k = min(self.n_neighbors, len(sample))
+        start_time = time.time()
+
+        for start in range(done, len(reduced), self.batch_size):
+            batch = np.asarray(reduced[start:start + self.batch_size])
+            dist_sq = (batch ** 2).sum(axis=1)[:, None] + anchor_sq[None, :] - 2 * batch @ anchors.T
+            dist_sq = np.maximum(dist_sq, 0)
+
+            nearest = np.argpartition(dist_sq, k - 1, axis=1)[:, :k]
+            dists = np.sqrt(np.take_along_axis(dist_sq, nearest, axis=1))
+            weights = 1 / np.maximum(dists, 1e-6)
+            weights /= weights.sum(axis=1, keepdims=True)
+            coords[start:start + len(batch)] = (weights[:, :, None] * sample_2d[nearest]).sum(axis=1)
+
+            coords.flush()
+            end = start + len(batch)
+            open(progress_path, 'w').write(str(end))
+            self.log(f"place: {end}/{len(reduced)} rows ({time.time() - start_time:.1f}s)")
+
+        # sampled words keep their exact t-SNE position
+        coords[sample] = sample_2d
+        coords.flush()
+        return coords
+
+    def run(self):
+        indices = self.checkpoint('indices', self.restrict)
+        self.log(f"restrict: {len(indices)} playable words")
+        reduced = self.checkpoint('pca', lambda: self.pca(indices))
+        sample = self.checkpoint('sample', lambda: self.sample(len(indices)))
+        sample_2d = self.checkpoint('sample_2d', lambda: self.tsne(reduced, sample))
+        coords = self.place(reduced, sample, np.asarray(sample_2d))
+
+        vocab = self.model.wv.index_to_key
+        embedding = Embedding2D([vocab[i] for i in indices], np.asarray(coords))
+        dataloader.save_embedding(self.file_name, embedding)
+        self.log(f"saved {len(embedding)} words to {dataloader.get_embedding_path(self.file_name)}")
+        return embedding
+
+
+if __name__ == '__main__':
+    from config import *
+
+    model = dataloader.load(FILE_NAME, mmap=LOAD_MMAP, lexicon=LOAD_LEXICON)
+    pipeline = ProjectionPipeline(model, dataloader.load_words(), FILE_NAME)
+    pipeline.run()
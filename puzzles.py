@@ -0,0 +1,212 @@
+import argparse
+import numpy as np
+import multiprocessing
+import random
+import time
+
+from config import *
+from utils import *
+
+
+class PuzzleBank:
+    """
+    Persisted (start, target) pairs with difficulty metrics:
+        par: fewest guesses found by the solver, an upper bound (see ChainSolver; -1 when scored by similarity only)
+        sim: adjusted start -> target similarity
+        tier: index into DIFFICULTIES
+    Words are stored as model indices, so a bank belongs to one model (checked by its WordIndex
+    checksum), and par and sim depend on the tolerance and adjust power it was generated at.
+    """
+    def __init__(self, starts, targets, par, sim, tier, n_vocab, tolerance=None, power=None, checksum=None):
+        self.starts = starts
+        self.targets = targets
+        self.par = par
+        self.sim = sim
+        self.tier = tier
+        self.n_vocab = n_vocab
+        self.tolerance = tolerance
+        self.power = power
+        self.checksum = checksum
+        self.tier_positions = [np.flatnonzero(tier == i) for i in range(len(DIFFICULTIES))]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def save(self, path):
+        with atomic_path(path) as tmp:
+            np.savez(
+                tmp,
+                starts=self.starts, targets=self.targets, par=self.par, sim=self.sim, tier=self.tier,
+                n_vocab=np.array(self.n_vocab), tolerance=np.nan if self.tolerance is None else self.tolerance,
+                power=np.nan if self.power is None else self.power, checksum=-1 if self.checksum is None else self.checksum,
+            )
+
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        # banks from before the settings were stored match none
+        tolerance, power = (float(data[key]) if key in data else np.nan for key in ('tolerance', 'power'))
+        checksum = int(data['checksum']) if 'checksum' in data else -1
+        return PuzzleBank(
+            data['starts'], data['targets'], data['par'], data['sim'], data['tier'], int(data['n_vocab']),
+            None if np.isnan(tolerance) else tolerance, None if np.isnan(power) else power,
+            None if checksum < 0 else checksum,
+        )
+
+    def matches(self, word_index, tolerance, power):
+        """Whether the bank was generated for this model and WordIndex, tolerance and adjust power."""
+        return (
+            self.n_vocab == len(word_index.vocab) and self.checksum == word_index.checksum
+            and self.tolerance == tolerance and self.power == power
+        )
+
+    def get_tier(self, difficulty):
+        return DIFFICULTIES.index(difficulty)
+
+    def count(self, difficulty):
+        return len(self.tier_positions[self.get_tier(difficulty)])
+
+    def draw(self, difficulty=None, rng=random):
+        """
+        Return:
+            int: position of a random puzzle, optionally restricted to a difficulty tier; an empty
+                tier falls back to the nearest tier that has puzzles
+        """
+        if len(self) == 0:
+            raise ValueError("The puzzle bank is empty.")
+        if difficulty is None:
+            return rng.randrange(len(self))
+        tier = self.get_tier(difficulty)
+        nearest = min((abs(i - tier), i) for i, positions in enumerate(self.tier_positions) if len(positions))[1]
+        positions = self.tier_positions[nearest]
+        return positions[rng.randrange(len(positions))]
+
+
+# Worker state, set once per process by init_worker
+_agent = None
+
+def init_worker(agent_kwargs):
+    global _agent
+    from backend import Agent
+    _agent = Agent(**agent_kwargs)
+    _agent.load_solver()
+
+def solve_batch(pairs):
+    return [_agent.solver.get_par(start, target) for start, target in pairs]
+
+
+class PuzzleGenerator:
+    """
+    Generates puzzles in vectorized batches and scores them with the chain solver in a process pool.
+    With use_solver=False, tiers come from start -> target similarity alone (no graph needed).
+    """
+    def __init__(self, agent, agent_kwargs=None, use_solver=True, basic=False, top_n=None, verbose=True):
+        self.agent = agent
+        self.agent_kwargs = agent_kwargs
+        self.use_solver = use_solver
+        self.basic = basic
+        self.top_n = top_n
+        self.verbose = verbose
+
+    def log(self, message):
+        if self.verbose:
+            print(f"[puzzles] {message}", flush=True)
+
+    def draw_pairs(self, size, rng):
+        word_index = self.agent.word_index
+        starts = word_index.draw_many(size, basic=self.basic, top_n=self.top_n, rng=rng)
+        targets = word_index.draw_many(size, basic=self.basic, top_n=self.top_n, rng=rng)
+        keep = starts != targets
+        return starts[keep], targets[keep]
+
+    def score_pairs(self, starts, targets):
+        agent = self.agent
+        return agent.adjust(agent.similarity.many_to_many(starts, targets)).astype(np.float32)
+
+    def get_similarity_tiers(self, sim):
+        """Higher start -> target similarity is easier; split into equal-sized tiers."""
+        cuts = np.quantile(sim, np.linspace(0, 1, len(DIFFICULTIES) + 1)[1:-1])
+        return (len(DIFFICULTIES) - 1 - np.searchsorted(cuts, sim)).astype(np.int8)
+
+    def get_par_tiers(self, par):
+        tier = np.full(len(par), -1, dtype=np.int8)
+        for i, difficulty in enumerate(DIFFICULTIES):
+            low, high = PUZZLE_PAR_RANGES[difficulty]
+            tier[(par >= low) & (par <= high)] = i
+        return tier
+
+    def solve(self, pool, starts, targets, chunk_size=64):
+        vocab = self.agent.vocab
+        pairs = [(vocab[s], vocab[t]) for s, t in zip(starts, targets)]
+        chunks = [pairs[i:i + chunk_size] for i in range(0, len(pairs), chunk_size)]
+        par = []
+        for result in pool.imap(solve_batch, chunks):
+            par.extend(result)
+        return np.array(par, dtype=np.int16)
+
+    def generate(self, n, batch_size=4096, processes=None, random_state=None, max_batches=1000):
+        """
+        Args:
+            processes (int): solver worker processes (default: one per core)
+            max_batches (int): give up after this many batches, returning what was found
+        """
+        pool = None
+        if self.use_solver:
+            pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(self.agent_kwargs,))
+        try:
+            return self._generate(n, batch_size, pool, random_state, max_batches)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    def _generate(self, n, batch_size, pool, random_state, max_batches):
+        rng = np.random.default_rng(random_state)
+        start_time = time.time()
+        starts, targets, par, sim, tier = (
+            [np.empty(0, dtype=dtype)] for dtype in (np.int64, np.int64, np.int16, np.float32, np.int8)
+        )
+        total = 0
+        for _ in range(max_batches):
+            if total >= n:
+                break
+            s, t = self.draw_pairs(batch_size, rng)
+            batch_sim = self.score_pairs(s, t)
+            if pool is not None:
+                batch_par = self.solve(pool, s, t)
+                batch_tier = self.get_par_tiers(batch_par)
+            else:
+                batch_par = np.full(len(s), -1, dtype=np.int16)
+                batch_tier = self.get_similarity_tiers(batch_sim)
+
+            keep = batch_tier >= 0
+            for arr, batch in zip((starts, targets, par, sim, tier), (s, t, batch_par, batch_sim, batch_tier)):
+                arr.append(batch[keep])
+            total += keep.sum()
+            self.log(f"{min(total, n)}/{n} puzzles ({time.time() - start_time:.1f}s)")
+
+        starts, targets, par, sim, tier = (np.concatenate(arr)[:n] for arr in (starts, targets, par, sim, tier))
+        return PuzzleBank(
+            starts.astype(np.int32), targets.astype(np.int32), par, sim, tier, len(self.agent.vocab),
+            float(self.agent.tolerance), float(self.agent.power), self.agent.word_index.checksum,
+        )
+
+
+if __name__ == '__main__':
+    from backend import Agent
+
+    import dataloader
+
+    parser = argparse.ArgumentParser(description="Generate the puzzle bank of a model for one tolerance and adjust power.")
+    parser.add_argument('--model', default=FILE_NAME)
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--power', type=float, default=ADJUST_POWER)
+    parser.add_argument('--size', type=int, default=PUZZLE_BANK_SIZE)
+    args = parser.parse_args()
+
+    agent_kwargs = dict(model_name=args.model, tolerance=args.tolerance, mmap=LOAD_MMAP, lexicon=LOAD_LEXICON, power=args.power)
+    agent = Agent(**agent_kwargs)
+    generator = PuzzleGenerator(agent, agent_kwargs)
+    bank = generator.generate(args.size)
+    bank.save(dataloader.get_puzzle_bank_path(agent.model_name, args.tolerance, args.power))
+    print(", ".join(f"{difficulty}: {bank.count(difficulty)}" for difficulty in DIFFICULTIES))
@@ -0,0 +1,319 @@
+"""
+Quantized copies of a model's vectors, scanned instead of the float vectors:
+    int8 scalar codes of every vocab row, for similarity and the chain frontier
+    product-quantization codes of the playable words, for hints
+
+Run to build the store of the configured model and report memory and agreement with the exact path:
+
+    python quantization.py --queries 200
+"""
+import argparse
+import os
+
+import numpy as np
+
+from config import *
+from utils import *
+from annindex import IVFIndex
+
+
+class ScalarQuantizer:
+    """
+    Per-row symmetric int8 quantization of unit-normalized vectors: row ≈ scale * codes.
+    residual is the largest |row - scale * codes| over all rows, so for a unit query vector
+    |cos - approximate cos| <= residual (Cauchy-Schwarz).
+    """
+    def __init__(self, codes, scales, residual):
+        self.codes = codes
+        self.scales = scales
+        self.residual = residual
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    @staticmethod
+    def build(keyed_vectors):
+        n, dims = len(keyed_vectors.vectors), keyed_vectors.vector_size
+        codes = np.empty((n, dims), dtype=np.int8)
+        scales = np.empty(n, dtype=np.float32)
+        residual = 0.0
+        for start, batch in IVFIndex.iter_normed(keyed_vectors, np.arange(n)):
+            scale = np.maximum(np.abs(batch).max(axis=1), np.finfo(np.float32).tiny) / 127
+            batch_codes = np.clip(np.rint(batch / scale[:, None]), -127, 127).astype(np.int8)
+            error = np.linalg.norm(batch - scale[:, None] * batch_codes, axis=1)
+            codes[start:start + len(batch)] = batch_codes
+            scales[start:start + len(batch)] = scale
+            residual = max(residual, float(error.max()))
+        return ScalarQuantizer(codes, scales, residual)
+
+    def dot(self, vec, rows=None):
+        """
+        Return:
+            np.array: approximate rows @ vec for a float query (all rows by default)
+        """
+        if rows is None:
+            return matvec(self.codes, vec) * self.scales
+        return (self.codes[rows].astype(np.float32) @ vec) * self.scales[rows]
+
+
+class ProductQuantizer:
+    """
+    Product quantization: vectors are split into n_subspaces slices and each slice is replaced
+    by the id of its nearest of 256 k-means centroids, so a vector costs n_subspaces bytes.
+    Queries use asymmetric distance: a (n_subspaces, 256) table of query-slice · centroid dots
+    is built once and every code row is scored by summing table lookups.
+    """
+    def __init__(self, centroids, codes, ids):
+        self.centroids = centroids
+        self.codes = codes
+        self.ids = ids
+        self.source = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def n_subspaces(self):
+        return len(self.centroids)
+
+    @property
+    def nbytes(self):
+        return self.centroids.nbytes + self.codes.nbytes + self.ids.nbytes
+
+    def attach(self, keyed_vectors):
+        """Use keyed_vectors (indexed by the same ids) for exact re-ranking."""
+        keyed_vectors.fill_norms()
+        self.source = keyed_vectors
+
+    @staticmethod
+    def split(vectors, n_subspaces):
+        """Zero-pad to a multiple of n_subspaces and reshape to (n, n_subspaces, sub_dims)."""
+        pad = -vectors.shape[1] % n_subspaces
+        if pad:
+            vectors = np.pad(vectors, ((0, 0), (0, pad)))
+        return vectors.reshape(len(vectors), n_subspaces, -1)
+
+    @staticmethod
+    def assign(slices, centroids, batch_size=65536):
+        labels = np.empty(len(slices), dtype=np.uint8)
+        c_sq = (centroids ** 2).sum(axis=1)
+        for start in range(0, len(slices), batch_size):
+            batch = slices[start:start + batch_size]
+            labels[start:start + batch_size] = np.argmin(c_sq - 2 * batch @ centroids.T, axis=1)
+        return labels
+
+    @staticmethod
+    def kmeans(slices, n_centroids, n_iter, rng):
+        centroids = slices[rng.choice(len(slices), n_centroids, replace=len(slices) < n_centroids)].copy()
+        for _ in range(n_iter):
+            labels = ProductQuantizer.assign(slices, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, slices)
+            counts = np.bincount(labels, minlength=n_centroids)
+            empty = counts == 0
+            sums[empty] = slices[rng.choice(len(slices), empty.sum())]
+            counts[empty] = 1
+            centroids = sums / counts[:, None]
+        return centroids
+
+    @staticmethod
+    def build(keyed_vectors, ids, n_subspaces=PQ_SUBSPACES, n_iter=10, train_size=65536, random_state=0):
+        ids = np.asarray(ids, dtype=np.int64)
+        rng = np.random.default_rng(random_state)
+        vectors = np.empty((len(ids), keyed_vectors.vector_size), dtype=np.float32)
+        for start, batch in IVFIndex.iter_normed(keyed_vectors, ids):
+            vectors[start:start + len(batch)] = batch
+        slices = ProductQuantizer.split(vectors, n_subspaces)
+
+        train = slices[rng.choice(len(ids), min(train_size, len(ids)), replace=False)]
+        centroids = np.stack([
+            ProductQuantizer.kmeans(train[:, m], 256, n_iter, rng) for m in range(n_subspaces)
+        ]).astype(np.float32)
+        codes = np.stack([
+            ProductQuantizer.assign(slices[:, m], centroids[m]) for m in range(n_subspaces)
+        ], axis=1)
+        return ProductQuantizer(centroids, codes, ids)
+
+    def scores(self, vec, chunk_size=65536):
+        """
+        Return:
+            np.array: approximate dot of vec with every indexed vector
+        """
+        query = self.split(vec[None].astype(np.float32), self.n_subspaces)[0]
+        table = np.einsum('mcd,md->mc', self.centroids, query).ravel()
+        offsets = np.arange(self.n_subspaces) * 256
+        out = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), chunk_size):
+            codes = self.codes[start:start + chunk_size].astype(np.int64) + offsets
+            out[start:start + chunk_size] = table[codes].sum(axis=1)
+        return out
+
+    def query(self, vec, topn=5, rerank=True, rerank_factor=8, exclude=()):
+        """
+        Return:
+            list(tuple(int, float)): (id, cosine similarity) of the topn approximate neighbours of vec
+        """
+        vec = np.asarray(vec, dtype=np.float32)
+        vec = vec / max(np.linalg.norm(vec), np.finfo(np.float32).tiny)
+        scores = self.scores(vec)
+        scores[np.isin(self.ids, np.asarray(exclude, dtype=np.int64))] = -np.inf
+
+        rerank = rerank and self.source is not None
+        n = min(int(np.isfinite(scores).sum()), topn * rerank_factor if rerank else topn)
+        if n == 0:
+            return []
+        best = np.argpartition(-scores, n - 1)[:n]
+        ids, scores = self.ids[best], scores[best]
+
+        if rerank:
+            exact = self.source.vectors[ids].astype(np.float32) @ vec
+            scores = exact / self.source.norms[ids]
+
+        order = np.argsort(-scores)[:topn]
+        return [(int(ids[i]), float(scores[i])) for i in order]
+
+
+class QuantizedStore:
+    """
+    Scalar codes of every vocab row (chain frontier, scalar similarity) plus product codes of the
+    playable words (hints), stamped with the vocab size they were built for.
+    The per-row arrays are saved as .npy files next to the .npz and memory-mapped on load.
+    """
+    ROW_ARRAYS = ('codes', 'scales', 'pq_codes', 'ids')
+
+    def __init__(self, scalar, product, n_vocab, checksum=None):
+        self.scalar = scalar
+        self.product = product
+        self.n_vocab = n_vocab
+        # WordIndex.checksum of the vocab and playable words the store was built for
+        self.checksum = checksum
+
+    @property
+    def margin(self):
+        """Bound on |approximate - exact| normalized cosine similarity ((cos + 1) / 2)."""
+        return self.scalar.residual / 2
+
+    @property
+    def nbytes(self):
+        return self.scalar.nbytes + self.product.nbytes
+
+    @staticmethod
+    def build(keyed_vectors, ids, n_subspaces=PQ_SUBSPACES):
+        return QuantizedStore(
+            ScalarQuantizer.build(keyed_vectors),
+            ProductQuantizer.build(keyed_vectors, ids, n_subspaces),
+            len(keyed_vectors.vectors),
+        )
+
+    @staticmethod
+    def get_array_path(path, name):
+        return f"{os.path.splitext(path)[0]}_{name}.npy"
+
+    @staticmethod
+    def get_paths(path):
+        """Return: list(str): every file of a store saved at path"""
+        return [path] + [QuantizedStore.get_array_path(path, name) for name in QuantizedStore.ROW_ARRAYS]
+
+    def save(self, path):
+        """Write every file under a temporary name and replace; the .npz goes last and marks the store complete."""
+        arrays = dict(codes=self.scalar.codes, scales=self.scalar.scales, pq_codes=self.product.codes, ids=self.product.ids)
+        for name in self.ROW_ARRAYS:
+            with atomic_path(self.get_array_path(path, name)) as tmp:
+                np.save(tmp, arrays[name])
+        with atomic_path(path) as tmp:
+            np.savez(
+                tmp, residual=self.scalar.residual, centroids=self.product.centroids,
+                n_vocab=self.n_vocab, checksum=-1 if self.checksum is None else self.checksum,
+            )
+
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        arrays = {name: np.load(QuantizedStore.get_array_path(path, name), mmap_mode='r') for name in QuantizedStore.ROW_ARRAYS}
+        scalar = ScalarQuantizer(arrays['codes'], arrays['scales'], float(data['residual']))
+        product = ProductQuantizer(data['centroids'], arrays['pq_codes'], arrays['ids'])
+        checksum = int(data['checksum']) if 'checksum' in data else -1
+        return QuantizedStore(scalar, product, int(data['n_vocab']), None if checksum < 0 else checksum)
+
+    def attach(self, keyed_vectors):
+        self.product.attach(keyed_vectors)
+
+
+class QuantizationReport:
+    """Memory saved by a QuantizedStore and how often it agrees with the exact float path."""
+    def __init__(self, agent, rng=None):
+        self.agent = agent
+        self.store = agent.quantized
+        self.rng = np.random.default_rng() if rng is None else rng
+
+    def get_memory(self):
+        wv = self.agent.model.wv
+        n, dims = len(wv.vectors), wv.vector_size
+        return {
+            'float32_mb': n * dims * 4 / 2 ** 20,
+            'model_mb': wv.vectors.nbytes / 2 ** 20,
+            'int8_mb': self.store.scalar.nbytes / 2 ** 20,
+            'float32_hint_mb': len(self.store.product) * dims * 4 / 2 ** 20,
+            'pq_mb': self.store.product.nbytes / 2 ** 20,
+        }
+
+    def get_exact_similarities(self, index):
+        wv = self.agent.model.wv
+        wv.fill_norms()
+        vec = wv.vectors[index].astype(np.float32) / wv.norms[index]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (matvec(wv.vectors, vec) / wv.norms + 1) / 2
+
+    def get_agreement(self, n_queries, topn=5):
+        agent = self.agent
+        queries = agent.word_index.draw_many(n_queries, rng=self.rng)
+        max_error, decisions, decisions_reranked, hint_overlap = 0.0, 0, 0, 0
+        playable = agent.word_index.indices
+        for index in queries:
+            exact = self.get_exact_similarities(index)[playable]
+            approx = agent.similarity.one_to_many(index, playable)
+            max_error = max(max_error, float(np.nanmax(np.abs(exact - approx))))
+
+            exact_valid = agent.validate_score(agent.adjust(exact))
+            approx_valid = agent.validate_score(agent.adjust(approx))
+            # Agent.get_closest_word_and_score re-ranks exactly whenever the margin straddles the tolerance
+            reranked = np.where(agent.near_tolerance(approx), exact_valid, approx_valid)
+            decisions += (exact_valid == approx_valid).sum()
+            decisions_reranked += (exact_valid == reranked).sum()
+
+            exact[playable == index] = -np.inf
+            exact_top = set(playable[np.argsort(-exact)[:topn]])
+            pq_top = {i for i, _ in self.store.product.query(agent.model.wv.get_vector(agent.vocab[index]), topn, exclude=[index])}
+            hint_overlap += len(exact_top & pq_top)
+
+        n_decisions = len(queries) * len(playable)
+        return {
+            'queries': len(queries),
+            'margin': self.store.margin,
+            'max_error': max_error,
+            'decision_agreement': float(decisions / n_decisions),
+            'decision_agreement_reranked': float(decisions_reranked / n_decisions),
+            f'hint_recall@{topn}': hint_overlap / (len(queries) * topn),
+        }
+
+    def run(self, n_queries=200):
+        return {'memory': self.get_memory(), 'agreement': self.get_agreement(n_queries)}
+
+
+if __name__ == '__main__':
+    import json
+
+    from backend import Agent
+
+    parser = argparse.ArgumentParser(description="Build the quantized store and compare it to the exact path.")
+    parser.add_argument('--model', default=FILE_NAME)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    agent = Agent(args.model, tolerance=TOLERANCE, mmap=LOAD_MMAP, lexicon=LOAD_LEXICON, full_hints=FULL_PRECISION_HINTS, quantized=True)
+    print(json.dumps(QuantizationReport(agent, np.random.default_rng(args.seed)).run(args.queries), indent=2))
@@ -0,0 +1,402 @@
+import asyncio
+import argparse
+import base64
+import concurrent.futures
+import hashlib
+import inspect
+import json
+import struct
+import threading
+import time
+import uuid
+
+from config import *
+from backend import Agent
+from engine import Engine
+from metrics import METRICS
+from targettable import TargetTableCache
+import similarity
+
+
+class UnknownSession(KeyError):
+    pass
+
+
+class SessionManager:
+    """
+    Game sessions sharing one Engine, with idle eviction.
+    A session costs its Agent's chain frontier, 8 bytes per guessable word (see get_memory). Target
+    tables (12 bytes per playable word) are shared by the sessions on the same target through a
+    TargetTableCache, which computes them on a small pool of threads.
+    handle() is the transport-independent command interface:
+        {"cmd": "new", "difficulty": optional}
+        {"cmd": "guess", "session": id, "word": str}
+        {"cmd": "hint", "session": id, "word": optional, defaults to the last chain word}
+        {"cmd": "state", "session": id}
+        {"cmd": "end", "session": id}
+    Safe to call from several threads: commands for one session run one at a time.
+    """
+    STRING_FIELDS = ('cmd', 'session', 'word', 'difficulty')
+
+    def __init__(self, engine, tolerance=TOLERANCE, algo='default', idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.engine = engine
+        self.tolerance = tolerance
+        self.algo = algo
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.locks = {}
+        self.last_seen = {}
+        self.lock = threading.Lock()
+        # scores the shared tables, so they do not keep a session's Agent alive
+        table_agent = Agent(tolerance=tolerance, algo=algo, engine=engine)
+        self.target_tables = TargetTableCache(table_agent.similarity, engine.word_index)
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def create(self, difficulty=None, session_id=None):
+        if session_id is None:
+            session_id = uuid.uuid4().hex
+        if session_id in self.sessions:
+            raise ValueError(f"Session '{session_id}' already exists.")
+        agent = Agent(tolerance=self.tolerance, algo=self.algo, engine=self.engine)
+        agent.target_tables = self.target_tables
+        agent.init_core(difficulty)
+        with self.lock:
+            # checked again, another thread may have created it meanwhile
+            if session_id in self.sessions:
+                raise ValueError(f"Session '{session_id}' already exists.")
+            self.sessions[session_id] = agent
+            self.locks[session_id] = threading.Lock()
+            self.last_seen[session_id] = time.monotonic()
+        return session_id, agent
+
+    def get(self, session_id):
+        """
+        Return:
+            tuple(Agent, threading.Lock): the session's agent and the lock to hold while using it
+        """
+        with self.lock:
+            try:
+                agent = self.sessions[session_id]
+            except KeyError:
+                raise UnknownSession(f"Unknown or expired session '{session_id}'.")
+            self.last_seen[session_id] = time.monotonic()
+            return agent, self.locks[session_id]
+
+    def end(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+            self.locks.pop(session_id, None)
+            self.last_seen.pop(session_id, None)
+
+    def evict_idle(self):
+        """
+        Return:
+            int: number of evicted sessions
+        """
+        cutoff = time.monotonic() - self.idle_timeout
+        with self.lock:
+            expired = [session_id for session_id, seen in self.last_seen.items() if seen < cutoff]
+        for session_id in expired:
+            self.end(session_id)
+        return len(expired)
+
+    def get_memory(self):
+        """
+        Return:
+            dict: bytes held by each session's frontier and by each shared target table, and the most tables kept
+        """
+        return {
+            'session_bytes': 8 * len(self.engine.guessable),
+            'table_bytes': 12 * len(self.engine.word_index),
+            'max_tables': self.target_tables.size,
+        }
+
+    def describe_memory(self):
+        memory = self.get_memory()
+        return (
+            f"Each session holds {memory['session_bytes'] / 2 ** 20:.1f} MB; up to {memory['max_tables']} shared "
+            f"target tables hold {memory['table_bytes'] / 2 ** 20:.1f} MB each."
+        )
+
+    @classmethod
+    def validate(cls, request):
+        if not isinstance(request, dict):
+            raise ValueError("Request must be a JSON object.")
+        for key in cls.STRING_FIELDS:
+            if request.get(key) is not None and not isinstance(request[key], str):
+                raise ValueError(f"'{key}' must be a string.")
+
+    def get_state(self, session_id, agent):
+        return {
+            'session': session_id,
+            'start': agent.start,
+            'target': agent.target,
+            'guesses': agent.guesses,
+            'won': agent.target in agent.guesses_set,
+        }
+
+    def guess(self, session_id, agent, word):
+        word = agent.parse_input(word)
+        result, message = agent.update(word)
+        response = {'session': session_id, 'word': word, 'result': RESULT_NAMES[result]}
+        if result == VALID or result == WON:
+            response['closest'] = message
+        else:
+            response['message'] = message
+        if result != INVALID:
+            response['rank'] = agent.get_target_rank(word)
+        return response
+
+    def hint(self, session_id, agent, word=None):
+        if word is None:
+            word = agent.guesses[-1]
+        if not agent.validate_word(word):
+            raise ValueError(agent.get_invalid_feedback())
+        return {'session': session_id, 'word': word, 'hints': agent.get_hints(word)}
+
+    def handle(self, request):
+        """
+        Return:
+            dict: response; failures are reported as {"error": message} instead of raising,
+                  with "status": 404 when the session does not exist
+        """
+        try:
+            self.validate(request)
+            cmd = request.get('cmd')
+            if cmd == 'new':
+                session_id, agent = self.create(request.get('difficulty'), request.get('session'))
+                return self.get_state(session_id, agent)
+
+            session_id = request.get('session')
+            agent, lock = self.get(session_id)
+            with lock:
+                if cmd == 'guess':
+                    if request.get('word') is None:
+                        raise ValueError("Missing 'word'.")
+                    return self.guess(session_id, agent, request['word'])
+                elif cmd == 'hint':
+                    return self.hint(session_id, agent, request.get('word'))
+                elif cmd == 'state':
+                    return self.get_state(session_id, agent)
+                elif cmd == 'end':
+                    self.end(session_id)
+                    return {'session': session_id, 'ended': True}
+            raise ValueError(f"Unknown command '{cmd}'.")
+        except UnknownSession as e:
+            return {'error': str(e.args[0]), 'status': 404}
+        except (KeyError, ValueError) as e:
+            return {'error': str(e.args[0]) if e.args else str(e)}
+
+
+class GameServer:
+    """
+    Minimal asyncio HTTP/1.1 + WebSocket front end for a SessionManager (or anything with the same
+    handle/evict_idle interface, e.g. workerpool.WorkerPool). No dependencies.
+
+        POST   /sessions                 {"difficulty": optional}     -> new game
+        GET    /sessions/<id>                                          -> state
+        POST   /sessions/<id>/guess      {"word": str}
+        POST   /sessions/<id>/hint       {"word": optional}
+        DELETE /sessions/<id>
+        GET    /ws                        WebSocket; each text frame is a SessionManager command
+    """
+    WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+    def __init__(self, sessions, host=SERVER_HOST, port=SERVER_PORT, evict_interval=None, threads=SERVER_THREADS):
+        self.sessions = sessions
+        self.host = host
+        self.port = port
+        if evict_interval is None:
+            evict_interval = max(1, sessions.idle_timeout / 4)
+        self.evict_interval = evict_interval
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+
+    async def dispatch(self, command):
+        try:
+            if inspect.iscoroutinefunction(self.sessions.handle):
+                return await self.sessions.handle(command)
+            # frontier updates and hints scan the vocab, so they run off the event loop
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.sessions.handle, command)
+        except Exception as e:
+            return {'error': f"Internal error: {e}"}
+
+    async def evict_loop(self):
+        while True:
+            await asyncio.sleep(self.evict_interval)
+            # a WorkerPool waits for its workers to evict
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.sessions.evict_idle)
+
+    def route(self, method, path, body):
+        parts = [part for part in path.split('?')[0].split('/') if part]
+        if parts == ['sessions'] and method == 'POST':
+            return {'cmd': 'new', **body}
+        if len(parts) >= 2 and parts[0] == 'sessions':
+            request = {**body, 'session': parts[1]}
+            if len(parts) == 2 and method == 'GET':
+                return {**request, 'cmd': 'state'}
+            if len(parts) == 2 and method == 'DELETE':
+                return {**request, 'cmd': 'end'}
+            if len(parts) == 3 and method == 'POST' and parts[2] in ('guess', 'hint'):
+                return {**request, 'cmd': parts[2]}
+        return None
+
+    async def read_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        method, path, _ = line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        body = await reader.readexactly(length) if length else b''
+        return method, path, headers, body
+
+    def write_response(self, writer, status, payload, keep_alive=True, content_type='application/json'):
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found'}
+        data = payload.encode() if isinstance(payload, str) else json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {reasons[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data
+        )
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+
+                if path.split('?')[0] == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+                    await self.handle_websocket(reader, writer, headers)
+                    break
+
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                if method == 'GET' and path.split('?')[0] in ('/metrics', '/metrics.json'):
+                    self.write_metrics(writer, await self.get_metrics(), path.split('?')[0], keep_alive)
+                    await writer.drain()
+                    continue
+                try:
+                    body = json.loads(body) if body else {}
+                except json.JSONDecodeError:
+                    self.write_response(writer, 400, {'error': 'Request body is not valid JSON.'}, keep_alive)
+                    continue
+                if not isinstance(body, dict):
+                    self.write_response(writer, 400, {'error': 'Request body must be a JSON object.'}, keep_alive)
+                    continue
+
+                command = self.route(method, path, body)
+                if command is None:
+                    self.write_response(writer, 404, {'error': f"No route for {method} {path}."}, keep_alive)
+                else:
+                    response = await self.dispatch(command)
+                    status = response.pop('status', 400) if 'error' in response else 200
+                    self.write_response(writer, status, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def get_metrics(self):
+        """
+        Return:
+            Metrics: this process's metrics, merged with the workers' when sessions is a WorkerPool
+        """
+        if not hasattr(self.sessions, 'get_metrics'):
+            return METRICS
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.sessions.get_metrics)
+
+    def write_metrics(self, writer, metrics, path, keep_alive):
+        if path == '/metrics.json':
+            self.write_response(writer, 200, metrics.to_dict(), keep_alive)
+        else:
+            self.write_response(writer, 200, metrics.to_prometheus(), keep_alive, 'text/plain; version=0.0.4')
+
+    # WebSocket (RFC 6455), unfragmented frames only
+    async def handle_websocket(self, reader, writer, headers):
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + self.WS_GUID).encode()).digest())
+        writer.write(
+            b"HTTP/1.1 101 Switching Protocols\r\n"
+            b"Upgrade: websocket\r\nConnection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+        )
+        await writer.drain()
+
+        while True:
+            opcode, payload = await self.read_frame(reader)
+            if opcode == 0x8:
+                self.write_frame(writer, 0x8, payload[:2])
+                break
+            elif opcode == 0x9:
+                self.write_frame(writer, 0xA, payload)
+            elif opcode == 0x1:
+                try:
+                    response = await self.dispatch(json.loads(payload))
+                except json.JSONDecodeError:
+                    response = {'error': 'Message is not a JSON object.'}
+                self.write_frame(writer, 0x1, json.dumps(response).encode())
+            await writer.drain()
+
+    async def read_frame(self, reader):
+        head = await reader.readexactly(2)
+        opcode = head[0] & 0x0F
+        masked = head[1] & 0x80
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', await reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', await reader.readexactly(8))[0]
+        mask = await reader.readexactly(4) if masked else b''
+        payload = await reader.readexactly(length)
+        if masked:
+            payload = bytes(byte ^ mask[i % 4] for i, byte in enumerate(payload))
+        return opcode, payload
+
+    def write_frame(self, writer, opcode, payload):
+        head = bytes([0x80 | opcode])
+        if len(payload) < 126:
+            head += bytes([len(payload)])
+        elif len(payload) < 1 << 16:
+            head += bytes([126]) + struct.pack('!H', len(payload))
+        else:
+            head += bytes([127]) + struct.pack('!Q', len(payload))
+        writer.write(head + payload)
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        evictor = asyncio.create_task(self.evict_loop())
+        print(f"Serving WordChain on http://{self.host}:{self.port}", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            evictor.cancel()
+            self.executor.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="WordChain game server.")
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--idle-timeout', type=float, default=SESSION_IDLE_TIMEOUT)
+    parser.add_argument('--algo', default=SIMILARITY_ALGO, choices=list(similarity.ENGINES))
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS)
+    args = parser.parse_args()
+
+    engine = Engine(FILE_NAME, mmap=LOAD_MMAP, lexicon=LOAD_LEXICON, full_hints=FULL_PRECISION_HINTS,
+                    ann_hints=ANN_HINTS, puzzles=USE_PUZZLE_BANK, quantized=QUANTIZED)
+    sessions = SessionManager(engine, algo=args.algo, idle_timeout=args.idle_timeout)
+    print(sessions.describe_memory(), flush=True)
+    asyncio.run(GameServer(sessions, args.host, args.port, threads=args.threads).serve())
@@ -0,0 +1,242 @@
+"""
+Similarity engines behind Agent.similarity, selected by name (Agent's algo argument).
+
+An engine scores model indices in batches:
+    one_to_many(index, indices=None)  index against indices (default: the whole vocab)
+    many_to_many(a, b)                elementwise, a[i] against b[i]
+    block(a, b)                       every a[i] against every b[j], shape (len(a), len(b))
+and derives the scalar similarity(i, j) from many_to_many. Scores are unadjusted and in [0, 1].
+New engines subclass SimilarityEngine and are made available with @register('name').
+"""
+import numpy as np
+
+from config import *
+from utils import *
+
+
+ENGINES = {}
+
+
+def register(name):
+    def decorator(cls):
+        cls.name = name
+        ENGINES[name] = cls
+        return cls
+    return decorator
+
+def create(name, agent):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown similarity algorithm '{name}'. Choose from: {', '.join(ENGINES)}.")
+    return ENGINES[name](agent)
+
+
+class SimilarityEngine:
+    name = None
+    needs_embedding = False
+    # scores may deviate from the exact ones (see Agent.near_tolerance)
+    approximate = False
+
+    def __init__(self, agent):
+        self.agent = agent
+
+    def one_to_many(self, index, indices=None):
+        raise NotImplementedError
+
+    def many_to_many(self, a, b):
+        raise NotImplementedError
+
+    def prepare(self, b):
+        """Whatever score_block needs of b, computed once for iter_blocks."""
+        return b
+
+    def score_block(self, a, prepared):
+        return np.stack([self.one_to_many(i, prepared) for i in a])
+
+    def block(self, a, b):
+        return self.score_block(a, self.prepare(b))
+
+    def iter_blocks(self, a, b, batch_size=256):
+        """
+        Return:
+            generator(tuple(int, np.array)): (start, block(a[start:start + batch_size], b)) over a
+        """
+        prepared = self.prepare(b)
+        for start in range(0, len(a), batch_size):
+            yield start, self.score_block(a[start:start + batch_size], prepared)
+
+    def similarity(self, i, j):
+        return float(self.many_to_many(np.array([i]), np.array([j]))[0])
+
+    def bounds(self, scores):
+        """
+        Return:
+            tuple(np.array, np.array): range the exact scores lie in, for approximate engines
+        """
+        return scores, scores
+
+    def exact_one_to_many(self, index, indices):
+        return self.one_to_many(index, indices)
+
+
+@register('default')
+class CosineEngine(SimilarityEngine):
+    """(cosine + 1) / 2 of the model vectors, scanning the int8 codes when the Agent has a quantized store."""
+    @property
+    def approximate(self):
+        return self.agent.quantized is not None
+
+    @property
+    def margin(self):
+        return self.agent.quantized.margin if self.approximate else 0.0
+
+    @staticmethod
+    def normalize(cos):
+        return (cos + 1) / 2
+
+    def get_points(self, indices):
+        wv = self.agent.model.wv
+        wv.fill_norms()
+        norms = np.maximum(wv.norms[indices], np.finfo(np.float32).tiny)
+        return wv.vectors[indices].astype(np.float32) / norms[:, None]
+
+    def one_to_many(self, index, indices=None):
+        vec = self.get_points(np.array([index]))[0]
+        quantized = self.agent.quantized
+        if quantized is not None:
+            return self.normalize(quantized.scalar.dot(vec, indices))
+        if indices is not None:
+            return self.normalize(self.get_points(indices) @ vec)
+        wv = self.agent.model.wv
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.normalize(matvec(wv.vectors, vec) / wv.norms)
+
+    def many_to_many(self, a, b):
+        return self.normalize(np.einsum('ij,ij->i', self.get_points(a), self.get_points(b)))
+
+    def bounds(self, scores):
+        return scores - self.margin, scores + self.margin
+
+    def exact_one_to_many(self, index, indices):
+        return self.normalize(self.get_points(indices) @ self.get_points(np.array([index]))[0])
+
+    def prepare(self, b):
+        return self.get_points(b)
+
+    def score_block(self, a, prepared):
+        return self.normalize(self.get_points(a) @ prepared.T)
+
+
+@register('2d')
+class Embedding2DEngine(SimilarityEngine):
+    """1 - distance in the 2D embedding, relative to its diagonal."""
+    needs_embedding = True
+
+    def get_points(self, indices):
+        return np.asarray(self.agent.embedding_matrix[indices], dtype=np.float32)
+
+    def one_to_many(self, index, indices=None):
+        matrix = self.agent.embedding_matrix if indices is None else self.get_points(indices)
+        dist = np.linalg.norm(matrix - self.agent.embedding_matrix[index], axis=1)
+        return 1 - dist / self.agent.bounds.maxDist
+
+    def many_to_many(self, a, b):
+        dist = np.linalg.norm(self.get_points(a) - self.get_points(b), axis=1)
+        return 1 - dist / self.agent.bounds.maxDist
+
+    def prepare(self, b):
+        return self.get_points(b)
+
+    def score_block(self, a, prepared):
+        x, y = self.get_points(a), prepared
+        dist_sq = (x ** 2).sum(axis=1)[:, None] + (y ** 2).sum(axis=1)[None, :] - 2 * x @ y.T
+        return 1 - np.sqrt(np.maximum(dist_sq, 0)) / self.agent.bounds.maxDist
+
+
+@register('rank')
+class RankPercentileEngine(SimilarityEngine):
+    """
+    Share of random playable word pairs that are less similar (by cosine) than the scored pair.
+    Spreads scores evenly over [0, 1] whatever the model's cosine distribution looks like.
+    The reference sample is drawn once per Engine and shared by its Agents.
+    """
+    def __init__(self, agent, sample_size=RANK_SAMPLE_SIZE):
+        super().__init__(agent)
+        self.base = CosineEngine(agent)
+        cache = agent.engine.similarity_cache
+        if 'rank' not in cache:
+            rng = np.random.default_rng(0)
+            a = agent.word_index.draw_many(sample_size, rng=rng)
+            b = agent.word_index.draw_many(sample_size, rng=rng)
+            cache['rank'] = np.sort(self.base.many_to_many(a, b))
+        self.reference = cache['rank']
+
+    @property
+    def approximate(self):
+        return self.base.approximate
+
+    def transform(self, sims):
+        # zero-norm rows give NaN cosines over the whole vocab; score them like get_points does
+        sims = np.nan_to_num(sims, nan=self.base.normalize(0.0))
+        return (np.searchsorted(self.reference, sims, side='right') / len(self.reference)).astype(np.float32)
+
+    def bounds(self, scores):
+        # a score of k / n means the approximate cosine lies between reference[k - 1] and reference[k]
+        reference = self.reference
+        k = np.rint(np.asarray(scores) * len(reference)).astype(np.int64)
+        low = np.where(k > 0, reference[np.clip(k - 1, 0, len(reference) - 1)], -np.inf)
+        high = np.where(k < len(reference), reference[np.clip(k, 0, len(reference) - 1)], np.inf)
+        return self.transform(self.base.bounds(low)[0]), self.transform(self.base.bounds(high)[1])
+
+    def exact_one_to_many(self, index, indices):
+        return self.transform(self.base.exact_one_to_many(index, indices))
+
+    def one_to_many(self, index, indices=None):
+        return self.transform(self.base.one_to_many(index, indices))
+
+    def many_to_many(self, a, b):
+        return self.transform(self.base.many_to_many(a, b))
+
+    def prepare(self, b):
+        return self.base.prepare(b)
+
+    def score_block(self, a, prepared):
+        return self.transform(self.base.score_block(a, prepared))
+
+
+@register('blend')
+class BlendedEngine(SimilarityEngine):
+    """BLEND_WEIGHT * cosine + (1 - BLEND_WEIGHT) * 2D similarity."""
+    needs_embedding = True
+
+    def __init__(self, agent, weight=BLEND_WEIGHT):
+        super().__init__(agent)
+        self.weight = weight
+        self.cosine = CosineEngine(agent)
+        self.embedding = Embedding2DEngine(agent)
+
+    @property
+    def approximate(self):
+        return self.cosine.approximate
+
+    def mix(self, cosine, embedding):
+        return self.weight * cosine + (1 - self.weight) * embedding
+
+    def bounds(self, scores):
+        # only the cosine part is approximate
+        margin = self.weight * self.cosine.margin
+        return scores - margin, scores + margin
+
+    def exact_one_to_many(self, index, indices):
+        return self.mix(self.cosine.exact_one_to_many(index, indices), self.embedding.one_to_many(index, indices))
+
+    def one_to_many(self, index, indices=None):
+        return self.mix(self.cosine.one_to_many(index, indices), self.embedding.one_to_many(index, indices))
+
+    def many_to_many(self, a, b):
+        return self.mix(self.cosine.many_to_many(a, b), self.embedding.many_to_many(a, b))
+
+    def prepare(self, b):
+        return self.cosine.prepare(b), self.embedding.prepare(b)
+
+    def score_block(self, a, prepared):
+        return self.mix(self.cosine.score_block(a, prepared[0]), self.embedding.score_block(a, prepared[1]))
@@ -0,0 +1,312 @@
+"""
+Self-play: scripted players play games against Agent.update in a process pool that shares one
+copy of the model vectors, over a grid of game parameters:
+
+    tolerance    Agent.tolerance (TOLERANCE)
+    power        Agent.power, the exponent of Agent.adjust (ADJUST_POWER)
+
+Every setting replays the same games (seeded random start/target pairs, or bank puzzles with
+--puzzles), so settings can be compared pair-wise.
+MIN_SIM and MAX_SIM_POS only affect how the GUI draws a chain, not its outcome, so they are
+evaluated on the recorded links instead of replaying games:
+
+    short_line_rate   accepted links scoring >= MAX_SIM_POS, drawn at MIN_LINE_LENGTH
+    red_rate          accepted words drawn fully red (norm_colour(sim) <= MIN_SIM)
+
+    python simulator.py --games 2000 --tolerance 0.2 0.25 0.3 --power 2 3 4 --json sweep.json
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import random
+import time
+
+import numpy as np
+
+from config import *
+from utils import *
+from backend import Agent
+from engine import Engine
+from workerpool import SharedVectors
+import dataloader
+import similarity
+
+
+class Player:
+    """
+    Picks the next guess by sampling the whole playable lexicon, weighted by similarity to an
+    anchor: softmax(score / temperature). Far-off words keep a small chance, so guesses can be
+    rejected as UNSIMILAR, and how often depends on the tolerance and power being simulated.
+    """
+    def __init__(self, agent, temperature=0.02, rng=None):
+        self.agent = agent
+        self.temperature = temperature
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.cache = {}
+        self.tried = set()
+
+    def reset(self, rng=None):
+        if rng is not None:
+            self.rng = rng
+        # similarities to chain words, one row per anchor, only live for one game
+        self.cache = {}
+        self.tried = set()
+
+    def get_similarities(self, index):
+        """
+        Return:
+            np.array: similarity of index to every playable word, indexed like word_index.indices
+        """
+        if index not in self.cache:
+            self.cache[index] = self.agent.similarity.one_to_many(index, self.agent.word_index.indices)
+        return self.cache[index]
+
+    def get_scores(self, anchor):
+        """
+        Return:
+            np.array: how much the player wants to guess each playable word, from anchor
+        """
+        raise NotImplementedError
+
+    def sample(self, scores):
+        """
+        Return:
+            str: a playable word not guessed or tried yet drawn by softmax(scores / temperature), or None
+        """
+        agent = self.agent
+        playable = agent.word_index.indices
+        logits = np.asarray(scores, dtype=np.float64) / self.temperature
+        used = [agent.word_index.get_rank(agent.get_index(word)) for word in agent.guesses_set]
+        used += [agent.word_index.get_rank(index) for index in self.tried]
+        logits[[position for position in used if position >= 0]] = -np.inf
+        if not np.isfinite(logits).any():
+            return None
+        weights = np.exp(logits - logits[np.isfinite(logits)].max())
+        position = self.rng.choice(len(playable), p=weights / weights.sum())
+        return agent.vocab[playable[position]]
+
+    def choose(self):
+        """
+        Return:
+            str: next guess, or None to give up
+        """
+        raise NotImplementedError
+
+    def observe(self, word, result):
+        self.tried.add(self.agent.get_index(word))
+
+
+class GreedyPlayer(Player):
+    """Aims between the chain word closest to the target and the target itself."""
+    def choose(self):
+        agent = self.agent
+        target_table = agent.target_table.wait()
+        anchor = max((agent.get_index(word) for word in agent.guesses), key=target_table.get_similarity)
+        return self.sample((self.get_similarities(anchor) + target_table.sims) / 2)
+
+
+class RandomAnchorPlayer(Player):
+    """Guesses words related to a random chain word, ignoring the target."""
+    def choose(self):
+        agent = self.agent
+        anchor = agent.get_index(agent.guesses[self.rng.integers(len(agent.guesses))])
+        return self.sample(self.get_similarities(anchor))
+
+
+PLAYERS = {
+    'greedy': GreedyPlayer,
+    'random': RandomAnchorPlayer,
+}
+
+
+def play_game(agent, player, max_guesses, difficulty=None):
+    """
+    Return:
+        dict: outcome of one game, with the adjusted score of every accepted link and the
+            unadjusted similarity to the target of every accepted word
+    """
+    from_bank = agent.puzzle_bank is not None
+    agent.init_core(difficulty)
+    target_table = agent.target_table.wait()
+    counts = dict.fromkeys(RESULT_NAMES.values(), 0)
+    links, sims, attempts, won = [], [], 0, False
+    while attempts < max_guesses:
+        word = player.choose()
+        if word is None:
+            break
+        result, message = agent.update(word)
+        attempts += 1
+        counts[RESULT_NAMES[result]] += 1
+        player.observe(word, result)
+        if result == VALID or result == WON:
+            links.append(float(agent.get_similarity(word, message, adjust=True)))
+            sims.append(target_table.get_similarity(agent.get_index(word)))
+        if result == WON:
+            won = True
+            break
+    return {'won': won, 'attempts': attempts, 'counts': counts, 'links': links, 'sims': sims, 'from_bank': from_bank}
+
+
+# Worker state, set once per process by init_worker
+_agent = None
+
+def init_worker(shared, vocab, engine_kwargs, agent_kwargs):
+    global _agent
+    engine = Engine(model=shared.attach(vocab), **engine_kwargs)
+    _agent = Agent(engine=engine, **agent_kwargs)
+
+def play_batch(task):
+    key, seeds, max_guesses, temperature, difficulty = task
+    player_name, tolerance, power = key
+    _agent.set_rules(tolerance, power)
+    player = PLAYERS[player_name](_agent, temperature)
+    games = []
+    for seed in seeds:
+        # the same seed draws the same puzzle for every setting
+        random.seed(seed)
+        player.reset(np.random.default_rng(seed))
+        games.append(play_game(_agent, player, max_guesses, difficulty))
+    return key, games
+
+
+class Simulator:
+    """
+    Plays games for every (player, tolerance, power) in the grid in a pool of worker processes
+    and aggregates them, per MIN_SIM and MAX_SIM_POS value, with summarize().
+    """
+    def __init__(self, model_name=FILE_NAME, algo=SIMILARITY_ALGO, processes=None, mmap=LOAD_MMAP,
+                 lexicon=LOAD_LEXICON, puzzles=False, quantized=QUANTIZED, verbose=True):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.verbose = verbose
+        model = dataloader.load(model_name, mmap=mmap, lexicon=lexicon)
+        self.vocab = model.wv.index_to_key
+        self.shared = SharedVectors.share(model.wv.vectors, mmap or lexicon)
+        del model
+
+        self.engine_kwargs = dict(model_name=model_name, lexicon=lexicon, puzzles=puzzles, quantized=quantized)
+        # play_batch switches the tolerance and power per setting with Agent.set_rules
+        self.agent_kwargs = dict(algo=algo, tolerance=TOLERANCE, power=ADJUST_POWER)
+        # build the on-disk caches once so workers don't race to build them
+        Engine(model=self.shared.attach(self.vocab), **self.engine_kwargs)
+
+    def log(self, message):
+        if self.verbose:
+            print(f"[simulator] {message}", flush=True)
+
+    def get_tasks(self, grid, n_games, max_guesses, temperature, difficulty, seed, chunk_size):
+        seeds = np.random.default_rng(seed).integers(0, 2 ** 32, n_games).tolist()
+        chunks = [seeds[i:i + chunk_size] for i in range(0, n_games, chunk_size)]
+        return [(key, chunk, max_guesses, temperature, difficulty) for key in grid for chunk in chunks]
+
+    def run(self, players, tolerances, powers, n_games, max_guesses=50, temperature=0.02, difficulty=None,
+            seed=0, chunk_size=25):
+        """
+        Return:
+            dict: (player, tolerance, power) -> list of play_game outcomes
+        """
+        grid = list(itertools.product(players, tolerances, powers))
+        tasks = self.get_tasks(grid, n_games, max_guesses, temperature, difficulty, seed, chunk_size)
+        games = {key: [] for key in grid}
+        start_time = time.time()
+        initargs = (self.shared, self.vocab, self.engine_kwargs, self.agent_kwargs)
+
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        with context.Pool(self.processes, initializer=init_worker, initargs=initargs) as pool:
+            for done, (key, batch) in enumerate(pool.imap_unordered(play_batch, tasks), 1):
+                games[key].extend(batch)
+                if done % max(1, len(tasks) // 20) == 0 or done == len(tasks):
+                    self.log(f"{done}/{len(tasks)} batches ({time.time() - start_time:.1f}s)")
+        if self.engine_kwargs['puzzles']:
+            missing = sorted({key[1:] for key, outcomes in games.items() if not all(game['from_bank'] for game in outcomes)})
+            if missing:
+                self.log(f"No puzzle bank for (tolerance, power) in {missing}, those settings played random pairs")
+        return games
+
+    def close(self):
+        self.shared.release(unlink=True)
+
+    @staticmethod
+    def summarize(games, min_sims=(MIN_SIM,), max_sim_positions=(MAX_SIM_POS,)):
+        """
+        Return:
+            list(dict): one row of aggregate statistics per setting and display parameters
+        """
+        rows = []
+        for (player, tolerance, power), outcomes in games.items():
+            won = np.array([game['won'] for game in outcomes])
+            attempts = np.array([game['attempts'] for game in outcomes])
+            chain = np.array([len(game['links']) for game in outcomes])
+            unsimilar = sum(game['counts']['UNSIMILAR'] for game in outcomes)
+            links = np.array([s for game in outcomes for s in game['links']], dtype=np.float64)
+            colours = norm_colour(np.array([s for game in outcomes for s in game['sims']], dtype=np.float64))
+            row = {
+                'player': player,
+                'tolerance': tolerance,
+                'power': power,
+                'games': len(outcomes),
+                'bank_games': sum(game['from_bank'] for game in outcomes),
+                'win_rate': float(won.mean()) if len(won) else 0.0,
+                'guesses_to_win': float(attempts[won].mean()) if won.any() else None,
+                'guesses_to_win_median': float(np.median(attempts[won])) if won.any() else None,
+                'chain_to_win': float(chain[won].mean()) if won.any() else None,
+                'unsimilar_rate': float(unsimilar / attempts.sum()) if attempts.sum() else 0.0,
+            }
+            for min_sim, max_sim_pos in itertools.product(min_sims, max_sim_positions):
+                rows.append({
+                    **row,
+                    'min_sim': min_sim,
+                    'max_sim_pos': max_sim_pos,
+                    'short_line_rate': float((links >= max_sim_pos).mean()) if len(links) else 0.0,
+                    'red_rate': float((colours <= min_sim).mean()) if len(colours) else 0.0,
+                })
+        return rows
+
+
+def format_table(rows):
+    columns = [
+        ('player', '{}'), ('tolerance', '{:.3f}'), ('power', '{:g}'), ('min_sim', '{:.2f}'), ('max_sim_pos', '{:.2f}'),
+        ('games', '{}'), ('bank_games', '{}'), ('win_rate', '{:.1%}'), ('guesses_to_win', '{:.1f}'), ('chain_to_win', '{:.1f}'),
+        ('unsimilar_rate', '{:.1%}'), ('short_line_rate', '{:.1%}'), ('red_rate', '{:.1%}'),
+    ]
+    cells = [[name for name, _ in columns]]
+    for row in rows:
+        cells.append(['-' if row[name] is None else fmt.format(row[name]) for name, fmt in columns])
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    lines = ['  '.join(cell.rjust(width) for cell, width in zip(line, widths)) for line in cells]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Self-play sweep of the game parameters.")
+    parser.add_argument('--model', default=FILE_NAME)
+    parser.add_argument('--algo', default=SIMILARITY_ALGO, choices=list(similarity.ENGINES))
+    parser.add_argument('--games', type=int, default=1000, help="games per setting")
+    parser.add_argument('--players', nargs='+', default=list(PLAYERS), choices=list(PLAYERS))
+    parser.add_argument('--tolerance', nargs='+', type=float, default=[TOLERANCE])
+    parser.add_argument('--power', nargs='+', type=float, default=[ADJUST_POWER])
+    parser.add_argument('--min-sim', nargs='+', type=float, default=[MIN_SIM])
+    parser.add_argument('--max-sim-pos', nargs='+', type=float, default=[MAX_SIM_POS])
+    parser.add_argument('--max-guesses', type=int, default=50, help="a game is lost after this many guesses")
+    parser.add_argument('--temperature', type=float, default=0.02, help="lower makes players pick closer words more often")
+    parser.add_argument('--puzzles', action='store_true', help="draw puzzles from the puzzle bank instead of random pairs")
+    parser.add_argument('--difficulty', default=None, choices=DIFFICULTIES, help="puzzle tier, with --puzzles")
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    simulator = Simulator(args.model, args.algo, args.processes, puzzles=args.puzzles)
+    try:
+        games = simulator.run(args.players, args.tolerance, args.power, args.games, args.max_guesses,
+                              args.temperature, args.difficulty, args.seed)
+    finally:
+        simulator.close()
+    rows = Simulator.summarize(games, args.min_sim, args.max_sim_pos)
+    print(format_table(rows))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': rows}, f, indent=2)
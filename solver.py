@@ -0,0 +1,282 @@
+import numpy as np
+import heapq
+import time
+
+from config import *
+from utils import *
+
+
+class WordGraph:
+    """
+    Symmetric graph over the WordIndex words, stored as CSR arrays, holding every edge whose weight
+    is >= min_weight (optionally capped at the k heaviest per word).
+    Node i is word_index.indices[i]; edge weights are Agent.get_similarity(..., adjust=True), scored with Agent.similarity.
+    checksum is the WordIndex.checksum the graph was built over.
+    exact is False when the cap dropped qualifying edges. Even an exact graph only covers the WordIndex
+    (lowercase alphabetic) words, while Agent.validate_word also accepts other dictionary words such as
+    capitalized ones, so chains through those are never found.
+    """
+    def __init__(self, indptr, indices, weights, min_weight=0.0, power=None, exact=True, checksum=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.min_weight = min_weight
+        self.power = power
+        self.exact = exact
+        self.checksum = checksum
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    @staticmethod
+    def build(agent, min_weight=None, k=GRAPH_K, batch_size=256, verbose=True):
+        """
+        Score the words against each other a batch of rows at a time, keeping each batch's edges
+        straight into preallocated arrays, then mirror them into a symmetric CSR graph.
+
+        Args:
+            min_weight (float): lowest edge weight kept, i.e. the lowest tolerance the graph can solve (default: agent.tolerance)
+            k (int): keep at most the k heaviest edges per word, bounding the build at about n * k edges
+                (None keeps them all, which is tens of millions of edges on a full dictionary)
+        """
+        if min_weight is None:
+            min_weight = agent.tolerance
+        nodes = agent.word_index.indices
+        n = len(nodes)
+        capped = k is not None and k < n - 1
+
+        # directed edges row by row; columns come out of np.nonzero ascending within each row
+        counts = np.zeros(n, dtype=np.int64)
+        dst = np.empty(n * k if capped else n, dtype=np.int32)
+        weights = np.empty(len(dst), dtype=np.float32)
+        n_edges = 0
+        exact = True
+        start_time = time.time()
+        for start, sims in agent.similarity.iter_blocks(nodes, nodes, batch_size):
+            end = start + len(sims)
+            sims = agent.adjust(sims)
+            sims[np.arange(end - start), np.arange(start, end)] = -np.inf
+            with np.errstate(invalid='ignore'):
+                keep = sims >= min_weight
+            if capped and (keep.sum(axis=1) > k).any():
+                exact = False
+                nearest = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+                top = np.zeros_like(keep)
+                np.put_along_axis(top, nearest, True, axis=1)
+                keep &= top
+            rows, cols = np.nonzero(keep)
+            if n_edges + len(cols) > len(dst):
+                extra = max(len(dst), n_edges + len(cols) - len(dst))
+                dst = np.concatenate([dst, np.empty(extra, dtype=np.int32)])
+                weights = np.concatenate([weights, np.empty(extra, dtype=np.float32)])
+            dst[n_edges:n_edges + len(cols)] = cols
+            weights[n_edges:n_edges + len(cols)] = sims[rows, cols]
+            counts[start:end] = np.bincount(rows, minlength=end - start)
+            n_edges += len(cols)
+            if verbose and (start // batch_size) % 50 == 0:
+                print(f"[graph] {end}/{n} nodes, {n_edges} edges ({time.time() - start_time:.1f}s)", flush=True)
+
+        graph = WordGraph.from_rows(counts, dst[:n_edges], weights[:n_edges])
+        graph.min_weight, graph.power, graph.exact = float(min_weight), float(agent.power), exact
+        graph.checksum = agent.word_index.checksum
+        return graph
+
+    @staticmethod
+    def from_rows(counts, dst, weights):
+        """
+        Pack directed edges, given row by row (counts[i] edges out of node i, destinations ascending),
+        as a symmetric CSR graph. Edges kept from both ends are already in both rows; the rest are
+        mirrored onto the row of their destination, after that row's own edges.
+        """
+        n = len(counts)
+        src = np.repeat(np.arange(n, dtype=np.int32), counts)
+        if len(dst):
+            # row-major with ascending columns, so the keys are sorted without sorting them
+            keys = src.astype(np.int64) * n + dst
+            reverse = dst.astype(np.int64) * n + src
+            found = np.minimum(np.searchsorted(keys, reverse), len(keys) - 1)
+            mirror = np.flatnonzero(keys[found] != reverse)
+            del keys, reverse, found
+        else:
+            mirror = np.empty(0, dtype=np.int64)
+        mirror = mirror[np.argsort(dst[mirror], kind='stable')]
+        mirror_src = dst[mirror]
+        mirror_counts = np.bincount(mirror_src, minlength=n)
+
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(counts + mirror_counts)
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        out_weights = np.empty(indptr[-1], dtype=np.float32)
+        own = indptr[src] + np.arange(len(dst)) - (np.cumsum(counts) - counts)[src]
+        indices[own], out_weights[own] = dst, weights
+        mirrored = (
+            indptr[mirror_src] + counts[mirror_src]
+            + np.arange(len(mirror)) - (np.cumsum(mirror_counts) - mirror_counts)[mirror_src]
+        )
+        indices[mirrored], out_weights[mirrored] = src[mirror], weights[mirror]
+        return WordGraph(indptr, indices, out_weights)
+
+    def save(self, path):
+        with atomic_path(path) as tmp:
+            np.savez(
+                tmp, indptr=self.indptr, indices=self.indices, weights=self.weights,
+                min_weight=self.min_weight, power=np.nan if self.power is None else self.power, exact=self.exact,
+                checksum=-1 if self.checksum is None else self.checksum,
+            )
+
+    @staticmethod
+    def load(path):
+        data = np.load(path)
+        if 'min_weight' not in data:
+            # top-k graph from before edges were thresholded
+            return WordGraph(data['indptr'], data['indices'], data['weights'], exact=False)
+        power = float(data['power'])
+        checksum = int(data['checksum']) if 'checksum' in data else -1
+        return WordGraph(
+            data['indptr'], data['indices'], data['weights'],
+            float(data['min_weight']), None if np.isnan(power) else power, bool(data['exact']),
+            None if checksum < 0 else checksum,
+        )
+
+    def neighbours(self, node, tolerance):
+        start, end = self.indptr[node], self.indptr[node + 1]
+        ok = self.weights[start:end] >= tolerance
+        return self.indices[start:end][ok]
+
+    def expand(self, frontier, tolerance):
+        """
+        Return:
+            tuple(np.array, np.array): (src, dst) of every edge out of frontier with weight >= tolerance
+        """
+        starts = self.indptr[frontier]
+        counts = self.indptr[frontier + 1] - starts
+        total = counts.sum()
+        src = np.repeat(frontier, counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(starts, counts)
+        ok = self.weights[offsets] >= tolerance
+        return src[ok], self.indices[offsets][ok]
+
+
+class ChainSolver:
+    """
+    Shortest chain from start to target over a WordGraph.
+    A chain is valid when every word scores >= tolerance against some earlier word, so the
+    fewest guesses equals the shortest start -> target path using edges >= tolerance.
+    Solutions are shortest within the graph. As the graph leaves out guessable words outside the WordIndex
+    (and the k-capped edges unless graph.exact), they are upper bounds on the true fewest guesses, and
+    "no chain" only means none exists through the graph's words (see WordGraph).
+    """
+    def __init__(self, graph: WordGraph, agent):
+        self.graph = graph
+        self.agent = agent
+        self.word_index = agent.word_index
+
+    def check(self, tolerance):
+        """Refuse tolerances and scoring curves the graph was not built for, as its edges would be missing or misweighted."""
+        if tolerance < self.graph.min_weight:
+            raise ValueError(f"The solver graph only holds edges >= {self.graph.min_weight}; rebuild it for tolerance {tolerance}.")
+        if self.graph.power is not None and self.graph.power != self.agent.power:
+            raise ValueError(f"The solver graph was built with adjust power {self.graph.power}, not {self.agent.power}; rebuild it.")
+
+    def get_node(self, word):
+        node = self.word_index.get_rank(self.agent.get_index(word))
+        if node < 0:
+            raise KeyError(f"'{word}' is not in the solver graph.")
+        return node
+
+    def get_word(self, node):
+        return self.agent.vocab[self.word_index.indices[node]]
+
+    def build_path(self, parent, target):
+        path = [target]
+        while parent[path[-1]] != path[-1]:
+            path.append(parent[path[-1]])
+        return [self.get_word(node) for node in reversed(path)]
+
+    def bfs(self, start, target, tolerance):
+        parent = np.full(len(self.graph), -1, dtype=np.int64)
+        parent[start] = start
+        frontier = np.array([start], dtype=np.int64)
+        while len(frontier) and parent[target] < 0:
+            src, dst = self.graph.expand(frontier, tolerance)
+            new = parent[dst] < 0
+            dst, first = np.unique(dst[new], return_index=True)
+            parent[dst] = src[new][first]
+            frontier = dst
+        return parent
+
+    def get_target_sims(self, target_word):
+        sims = self.agent.similarity.one_to_many(self.agent.get_index(target_word), self.word_index.indices)
+        return self.agent.adjust(sims)
+
+    def astar(self, start, target, tolerance, target_word):
+        """
+        A* with an admissible step heuristic from similarity to target: 0 at the target,
+        1 if the word could link to the target directly, otherwise 2.
+        Ties are broken towards words more similar to the target.
+        """
+        target_sims = self.get_target_sims(target_word)
+        heuristic = np.where(target_sims >= tolerance, 1, 2)
+        heuristic[target] = 0
+
+        parent = np.full(len(self.graph), -1, dtype=np.int64)
+        cost = np.full(len(self.graph), np.iinfo(np.int64).max, dtype=np.int64)
+        parent[start] = start
+        cost[start] = 0
+        heap = [(heuristic[start], -target_sims[start], 0, start)]
+        while heap:
+            _, _, node_cost, node = heapq.heappop(heap)
+            if node_cost > cost[node]:
+                # stale entry, the node was pushed again with a lower cost
+                continue
+            if node == target:
+                break
+            for neighbour in self.graph.neighbours(node, tolerance):
+                if cost[node] + 1 < cost[neighbour]:
+                    cost[neighbour] = cost[node] + 1
+                    parent[neighbour] = node
+                    heapq.heappush(heap, (cost[neighbour] + heuristic[neighbour], -target_sims[neighbour], cost[neighbour], neighbour))
+        return parent
+
+    def solve(self, start, target, tolerance=None, method='bfs'):
+        """
+        Return:
+            list(str): shortest chain through the graph from start to target (inclusive), or None if there is none
+        """
+        if tolerance is None:
+            tolerance = self.agent.tolerance
+        self.check(tolerance)
+        start_node, target_node = self.get_node(start), self.get_node(target)
+        if method == 'astar':
+            parent = self.astar(start_node, target_node, tolerance, target)
+        else:
+            parent = self.bfs(start_node, target_node, tolerance)
+        if parent[target_node] < 0:
+            return None
+        return self.build_path(parent, target_node)
+
+    def get_par(self, start, target, tolerance=None):
+        """
+        Return:
+            int: fewest guesses to reach target from start through the graph, or -1 if it has no chain
+                (an upper bound on the true par, see ChainSolver)
+        """
+        path = self.solve(start, target, tolerance)
+        if path is None:
+            return -1
+        return len(path) - 1
+
+
+if __name__ == '__main__':
+    from backend import Agent
+
+    import dataloader
+
+    agent = Agent(model_name=FILE_NAME, tolerance=TOLERANCE, mmap=LOAD_MMAP, lexicon=LOAD_LEXICON)
+    graph = WordGraph.build(agent, k=GRAPH_K)
+    graph.save(dataloader.get_graph_path(agent.model_name))
+    print(f"Saved {'uncapped' if graph.exact else f'capped (k={GRAPH_K})'} graph with {len(graph)} nodes and {graph.n_edges} edges >= {graph.min_weight}.")
@@ -0,0 +1,119 @@
+import concurrent.futures
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from config import *
+from metrics import METRICS, timed
+
+
+class TargetTable:
+    """
+    Similarity of every playable word (WordIndex) to a game's target and its rank among them,
+    computed once per target on a background thread (or on executor). Lookups wait for it to finish,
+    and re-raise the error if it failed. Other words are scored against the target on demand.
+    Ranks count the playable words strictly closer to the target, plus one; the target is rank 0.
+    Holds 12 bytes per playable word (sims, ranks and closer).
+    """
+    def __init__(self, similarity, target, target_index, word_index, background=True, executor=None):
+        self.similarity = similarity
+        self.target = target
+        self.target_index = target_index
+        self.word_index = word_index
+        # indexed by position in word_index
+        self.sims = None
+        self.ranks = None
+        # ascending negated similarities of the other playable words, so searchsorted counts closer words
+        self.closer = None
+        self.n_ranked = 0
+        self.error = None
+        self.ready = threading.Event()
+        if executor is not None:
+            executor.submit(self.compute)
+        elif background:
+            threading.Thread(target=self.compute, daemon=True).start()
+        else:
+            self.compute()
+
+    @property
+    def nbytes(self):
+        return 12 * len(self.word_index)
+
+    @timed('target_table.compute')
+    def compute(self):
+        try:
+            playable = self.word_index.indices
+            sims = np.asarray(self.similarity.one_to_many(self.target_index, playable), dtype=np.float32)
+            closer = np.sort(-sims[playable != self.target_index])
+            with np.errstate(invalid='ignore'):
+                ranks = np.searchsorted(closer, -sims, side='left').astype(np.int32) + 1
+            ranks[playable == self.target_index] = 0
+
+            self.sims, self.ranks, self.closer, self.n_ranked = sims, ranks, closer, len(closer)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready.set()
+
+    def wait(self):
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+        return self
+
+    def get_similarity(self, index):
+        position = self.word_index.get_rank(index)
+        if position < 0:
+            return float(self.similarity.similarity(self.target_index, index))
+        return float(self.wait().sims[position])
+
+    def get_rank(self, index):
+        if index == self.target_index:
+            return 0
+        position = self.word_index.get_rank(index)
+        if position < 0:
+            sim = self.get_similarity(index)
+            return int(np.searchsorted(self.wait().closer, -sim, side='left')) + 1
+        return int(self.wait().ranks[position])
+
+    def get_percentile(self, index):
+        """
+        Return:
+            float: share of the playable words that are further from the target (1 for the target)
+        """
+        rank = self.get_rank(index)
+        if self.n_ranked == 0:
+            return 1.0
+        return max(0.0, 1 - rank / self.n_ranked) if rank else 1.0
+
+
+class TargetTableCache:
+    """
+    TargetTables shared by every game with the same target, keeping the size most recently used.
+    Tables are computed on a pool of threads, so many new games queue rather than each starting a thread.
+    One cache serves one similarity engine (tables hold its scores).
+    """
+    def __init__(self, similarity, word_index, size=TARGET_TABLE_CACHE, threads=TARGET_TABLE_THREADS):
+        self.similarity = similarity
+        self.word_index = word_index
+        self.size = size
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads, thread_name_prefix='target-table')
+        self.tables = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tables)
+
+    def get(self, target, target_index):
+        with self.lock:
+            table = self.tables.pop(target_index, None)
+            if table is None or table.error is not None:
+                table = TargetTable(self.similarity, target, target_index, self.word_index, executor=self.executor)
+            self.tables[target_index] = table
+            while len(self.tables) > self.size:
+                self.tables.popitem(last=False)
+        return table
+
+
+METRICS.register(TargetTable)
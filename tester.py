@@ -1,21 +1,120 @@
-from backend import Backend
+import argparse
+import json
+import time
 
+import numpy as np
+
+from config import *
+from utils import *
+from backend import Agent
+from engine import Engine
+import similarity
+
+
+class Tester(Agent):
+    PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+    # name -> (score the game compares it with, value); 'colour' is norm_colour of the raw similarity, as in Gui.calc_colour
+    THRESHOLDS = {
+        'TOLERANCE': ('adjusted', TOLERANCE),
+        'MIN_SIM': ('colour', MIN_SIM),
+        'MIN_SIM_FEEDBACK': ('adjusted', MIN_SIM_FEEDBACK),
+    }
+
+    def __init__(self, model_name=None, tolerance=TOLERANCE, algo='default', engine=None, **kwargs):
+        super().__init__(model_name, tolerance, algo=algo, engine=engine, **kwargs)
 
-class Tester(Backend):
-    def __init__(self, model_name=None, tolerance=0.3):
-        super().__init__(model_name, tolerance)
-    
     def get_average_sim(self, sample_size=100000):
-        total = 0
-        for _ in range(sample_size):
-            w1 = self.get_random_word()
-            w2 = self.get_random_word()
-            total += self.get_similarity(w1, w2)
-        avg = total / sample_size
-        return avg
+        return float(self.sample_similarities(sample_size).mean())
+
+    def get_pair_similarities(self, a, b):
+        """
+        Args:
+            a, b (np.array): model indices of the pairs
+        Return:
+            np.array: get_similarity(a[i], b[i]) for every pair, unadjusted
+        """
+        return self.similarity.many_to_many(a, b)
+
+    def sample_similarities(self, n_pairs, batch_size=1000000, adjust=False, valid_only=False, rng=None):
+        """Monte-Carlo sample of the similarity of random word pairs, in batches."""
+        if rng is None:
+            rng = np.random.default_rng()
+        sims = np.empty(n_pairs, dtype=np.float32)
+        for start in range(0, n_pairs, batch_size):
+            size = min(batch_size, n_pairs - start)
+            if valid_only:
+                a, b = self.word_index.draw_many(size, rng=rng), self.word_index.draw_many(size, rng=rng)
+            else:
+                a, b = rng.integers(0, len(self.vocab), size), rng.integers(0, len(self.vocab), size)
+            batch = self.get_pair_similarities(a, b)
+            sims[start:start + size] = self.adjust(batch) if adjust else batch
+        return sims[np.isfinite(sims)]
+
+    def get_stats(self, sims, adjusted=False, bins=20):
+        """Threshold fractions are only reported for the sample the game compares each threshold with."""
+        counts, edges = np.histogram(sims, bins=bins, range=(0, 1))
+        scores = {'adjusted': sims} if adjusted else {'raw': sims, 'colour': norm_colour(sims)}
+        return {
+            'pairs': int(len(sims)),
+            'mean': float(sims.mean()),
+            'std': float(sims.std()),
+            'percentiles': {str(p): float(v) for p, v in zip(self.PERCENTILES, np.percentile(sims, self.PERCENTILES))},
+            'above': {
+                name: float((scores[score] >= value).mean())
+                for name, (score, value) in self.THRESHOLDS.items() if score in scores
+            },
+            'histogram': {'edges': edges.tolist(), 'counts': counts.tolist()},
+        }
+
+    def run(self, n_pairs, batch_size=1000000, valid_only=False, seed=None):
+        results = {}
+        for adjust in (False, True):
+            start = time.time()
+            sims = self.sample_similarities(n_pairs, batch_size, adjust, valid_only, np.random.default_rng(seed))
+            stats = self.get_stats(sims, adjust)
+            stats['seconds'] = time.time() - start
+            results['adjusted' if adjust else 'raw'] = stats
+        return results
+
+
+def format_stats(name, stats, width=40):
+    lines = [f"== {name}: {stats['pairs']} pairs in {stats['seconds']:.2f}s =="]
+    lines.append(f"mean {stats['mean']:.4f}  std {stats['std']:.4f}")
+    lines.append("percentiles  " + "  ".join(f"p{p}={v:.4f}" for p, v in stats['percentiles'].items()))
+    lines.append("fraction >=  " + "  ".join(
+        f"{k} ({Tester.THRESHOLDS[k][1]}{', colour' if Tester.THRESHOLDS[k][0] == 'colour' else ''}): {v:.2%}"
+        for k, v in stats['above'].items()
+    ))
+    counts, edges = stats['histogram']['counts'], stats['histogram']['edges']
+    peak = max(max(counts), 1)
+    for count, low, high in zip(counts, edges, edges[1:]):
+        lines.append(f"  [{low:.2f}, {high:.2f})  {'#' * round(width * count / peak):<{width}} {count}")
+    return '\n'.join(lines)
 
 
 if __name__ == "__main__":
-    tester = Tester('v1')
-    avg = tester.get_average_sim(100000)
-    print(f"\nAverage pairwise similarity: {avg}\n")
+    parser = argparse.ArgumentParser(description="Similarity statistics of random word pairs.")
+    parser.add_argument('--model', default=FILE_NAME)
+    parser.add_argument('--pairs', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=1000000)
+    parser.add_argument('--algos', nargs='+', default=['default', '2d'], choices=list(similarity.ENGINES))
+    parser.add_argument('--valid-only', action='store_true', help="sample only words that can start or end a game")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    engine = Engine(args.model, mmap=LOAD_MMAP, lexicon=LOAD_LEXICON)
+    results = {}
+    for algo in args.algos:
+        try:
+            tester = Tester(args.model, algo=algo, engine=engine)
+        except FileNotFoundError as e:
+            print(f"Skipping '{algo}': {e}\n")
+            continue
+        results[algo] = tester.run(args.pairs, args.batch_size, args.valid_only, args.seed)
+        for kind, stats in results[algo].items():
+            print(format_stats(f"{algo} ({kind})", stats) + "\n")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
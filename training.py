@@ -0,0 +1,195 @@
+"""
+Train a Word2Vec model on a corpus in datasets/ and save it where dataloader.load finds it:
+
+    python training.py wikisent2.txt --name wiki --workers 8 --epochs 5 --prune
+
+An interrupted run picks up from its last finished epoch when started again with the same name.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import time
+
+import numpy as np
+from gensim.models import KeyedVectors, Word2Vec
+
+from utils import *
+
+import dataloader
+from dataprocessing import DataProcessor
+
+
+class Trainer:
+    """
+    Word2Vec training with one checkpoint per epoch under models/<name>/training/.
+    The learning rate decays linearly over all epochs as in a single model.train call,
+    so a resumed run ends with the same schedule as an uninterrupted one.
+    """
+    def __init__(self, name, corpus, vector_size=100, window=5, min_count=5, sg=0, negative=5,
+                 epochs=5, alpha=0.025, min_alpha=0.0001, workers=None, seed=1, verbose=True):
+        self.name = name
+        self.corpus = corpus
+        self.params = dict(
+            vector_size=vector_size, window=window, min_count=min_count, sg=sg, negative=negative,
+            alpha=alpha, min_alpha=min_alpha, seed=seed,
+        )
+        self.epochs = epochs
+        self.workers = workers or multiprocessing.cpu_count()
+        self.verbose = verbose
+
+    def log(self, message):
+        if self.verbose:
+            print(f"[train {self.name}] {message}", flush=True)
+
+    def get_checkpoint_dir(self):
+        return f"{dataloader.get_model_path(self.name)}/training"
+
+    def get_state_path(self):
+        return f"{self.get_checkpoint_dir()}/state.json"
+
+    def get_alpha(self, epoch):
+        alpha, min_alpha = self.params['alpha'], self.params['min_alpha']
+        return alpha - (alpha - min_alpha) * epoch / self.epochs
+
+    def load_checkpoint(self):
+        """
+        Return:
+            tuple(Word2Vec, int): last checkpointed model and the number of finished epochs,
+                                  or (None, 0) if there is no matching checkpoint
+        """
+        if not os.path.isfile(self.get_state_path()):
+            return None, 0
+        with open(self.get_state_path(), 'r') as f:
+            state = json.load(f)
+        if state['params'] != self.params or state['epochs'] != self.epochs:
+            self.log("Checkpoint was made with other parameters, starting over")
+            return None, 0
+        model = Word2Vec.load(f"{self.get_checkpoint_dir()}/{state['checkpoint']}/checkpoint.model")
+        model.workers = self.workers
+        return model, state['done']
+
+    def save_checkpoint(self, model, done):
+        """Write the new checkpoint fully before pointing state.json at it, then drop the old one."""
+        checkpoint = f"epoch_{done}"
+        path = f"{self.get_checkpoint_dir()}/{checkpoint}"
+        os.makedirs(path, exist_ok=True)
+        model.save(f"{path}/checkpoint.model")
+
+        state = {'checkpoint': checkpoint, 'done': done, 'epochs': self.epochs, 'params': self.params}
+        with open(f"{self.get_state_path()}.tmp", 'w') as f:
+            json.dump(state, f)
+        os.replace(f"{self.get_state_path()}.tmp", self.get_state_path())
+
+        for old in os.listdir(self.get_checkpoint_dir()):
+            if old.startswith('epoch_') and old != checkpoint:
+                shutil.rmtree(f"{self.get_checkpoint_dir()}/{old}", ignore_errors=True)
+
+    def build(self):
+        model = Word2Vec(workers=self.workers, epochs=self.epochs, **self.params)
+        start = time.time()
+        model.build_vocab(self.corpus)
+        self.log(f"Vocabulary of {len(model.wv)} words from {model.corpus_count} sentences ({time.time() - start:.1f}s)")
+        return model
+
+    def train(self):
+        model, done = self.load_checkpoint()
+        if model is None:
+            model = self.build()
+        elif done:
+            self.log(f"Resuming after epoch {done}/{self.epochs}")
+
+        for epoch in range(done, self.epochs):
+            start = time.time()
+            model.train(
+                self.corpus, total_examples=model.corpus_count, epochs=1,
+                start_alpha=self.get_alpha(epoch), end_alpha=self.get_alpha(epoch + 1),
+            )
+            self.save_checkpoint(model, epoch + 1)
+            self.log(f"Epoch {epoch + 1}/{self.epochs} ({time.time() - start:.1f}s)")
+        return model
+
+    def clear_derived(self):
+        """
+        Sidecars, indexes and lexicons of a previous model with this name are stale now.
+        Only files this repo builds are removed; anything else in the model folder is kept.
+        """
+        for name in (self.name, dataloader.get_lexicon_name(self.name)):
+            if not os.path.isdir(f"{DIR_PATH}/models/{name}"):
+                continue
+            for path in dataloader.get_derived_paths(name):
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+
+    def replace_model(self, staging):
+        """Move a model saved under staging over the old one, dropping old files the new save lacks."""
+        model_path = dataloader.get_model_path(self.name)
+        new = set(os.listdir(staging))
+        for entry in os.listdir(model_path):
+            is_model = entry == f"{self.name}.model" or entry.startswith(f"{self.name}.model.")
+            if is_model and entry not in new:
+                os.remove(f"{model_path}/{entry}")
+        for entry in new:
+            os.replace(f"{staging}/{entry}", f"{model_path}/{entry}")
+        os.rmdir(staging)
+
+    def save(self, model, prune=False, keep_checkpoints=False):
+        """
+        Save to models/<name>/<name>.model. prune keeps only the vectors of dictionary words
+        (what Agent.validate_word accepts) and drops the training state.
+        The model is saved to a staging folder first, so a failed save leaves the old model
+        and its sidecars in place.
+        """
+        staging = f"{dataloader.get_model_path(self.name)}/.saving"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        path = f"{staging}/{self.name}.model"
+        try:
+            if prune:
+                dict_set = set(dataloader.load_words())
+                words = [word for word in model.wv.index_to_key if word in dict_set]
+                keyed_vectors = KeyedVectors(model.wv.vector_size)
+                keyed_vectors.add_vectors(words, model.wv[words] if words else np.zeros((0, model.wv.vector_size)))
+                keyed_vectors.save(path)
+            else:
+                model.save(path)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        if prune:
+            self.log(f"Saved {len(words)}/{len(model.wv)} dictionary words to {self.name}.model")
+        else:
+            self.log(f"Saved {len(model.wv)} words to {self.name}.model")
+        self.clear_derived()
+        self.replace_model(staging)
+        if not keep_checkpoints:
+            shutil.rmtree(self.get_checkpoint_dir(), ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train a Word2Vec model for WordChain.")
+    parser.add_argument('corpus', help="text file in datasets/, one sentence per line")
+    parser.add_argument('--name', required=True, help="model name, saved as models/<name>/<name>.model")
+    parser.add_argument('--sample-size', type=int, default=None, help="train on a random sample of lines")
+    parser.add_argument('--processes', type=int, default=None, help="preprocessing processes (default: one per core)")
+    parser.add_argument('--workers', type=int, default=None, help="training threads (default: one per core)")
+    parser.add_argument('--vector-size', type=int, default=100)
+    parser.add_argument('--window', type=int, default=5)
+    parser.add_argument('--min-count', type=int, default=5)
+    parser.add_argument('--sg', action='store_true', help="skip-gram instead of CBOW")
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--prune', action='store_true', help="keep only words in the game dictionary")
+    parser.add_argument('--keep-checkpoints', action='store_true')
+    args = parser.parse_args()
+
+    corpus = DataProcessor().stream(args.corpus, args.sample_size, args.processes, seed=args.seed)
+    trainer = Trainer(
+        args.name, corpus, vector_size=args.vector_size, window=args.window, min_count=args.min_count,
+        sg=int(args.sg), epochs=args.epochs, workers=args.workers, seed=args.seed,
+    )
+    model = trainer.train()
+    trainer.save(model, prune=args.prune, keep_checkpoints=args.keep_checkpoints)
@@ -1,4 +1,55 @@
+import contextlib
 import os
+import zlib
+
+import numpy as np
 
 
 DIR_PATH = os.path.dirname(__file__)
+
+
+def ordinal(n):
+    if 10 <= n % 100 <= 20:
+        suffix = 'th'
+    else:
+        suffix = {1: 'st', 2: 'nd', 3: 'rd'}.get(n % 10, 'th')
+    return f"{n}{suffix}"
+
+def norm_colour(x):
+    """Sigmoid that spreads similarities to the target around 0.5 over the colour range."""
+    return 1 / (1 + np.exp(-10 * (x - 0.5)))
+
+def matvec(matrix, vec, chunk_size=65536):
+    """
+    matrix @ vec, upcasting reduced-precision (e.g. float16) matrices to float32 in chunks
+    so the product still runs through BLAS.
+    """
+    if matrix.dtype == np.float32 or matrix.dtype == np.float64:
+        return matrix @ vec
+    vec = vec.astype(np.float32)
+    out = np.empty(len(matrix), dtype=np.float32)
+    for start in range(0, len(matrix), chunk_size):
+        out[start:start + chunk_size] = matrix[start:start + chunk_size].astype(np.float32) @ vec
+    return out
+
+@contextlib.contextmanager
+def atomic_path(path):
+    """
+    Yield a temporary path next to path (same extension) and move it into place once the block
+    has written it, so readers never see a partial file and mmaps of the old file stay valid.
+    """
+    root, ext = os.path.splitext(path)
+    tmp = f"{root}.{os.getpid()}.tmp{ext}"
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def vocab_checksum(words, crc=0):
+    """
+    Return:
+        int: crc32 of the words in order (continuing crc), to tell whether derived files were built from this vocabulary
+    """
+    return zlib.crc32('\n'.join(words).encode(), crc)
@@ -0,0 +1,96 @@
+import numpy as np
+import random
+import zlib
+
+from utils import *
+
+
+class WordIndex:
+    """
+    Contiguous index of the words that can start or end a game: lowercase, alphabetic,
+    in the dictionary and in the model vocab. Entries are stored as model indices sorted
+    ascending, so for frequency-ordered models (e.g. GoogleNews) position is frequency rank.
+    """
+    def __init__(self, vocab, indices, basic):
+        self.vocab = vocab
+        self.indices = indices
+        self.basic = basic
+        self.basic_positions = np.flatnonzero(basic)
+        self._checksum = None
+
+    def __len__(self):
+        return len(self.indices)
+
+    @property
+    def checksum(self):
+        """crc32 of the model vocab and the playable rows, stamped into the files derived from this index."""
+        if self._checksum is None:
+            self._checksum = zlib.crc32(np.asarray(self.indices, dtype=np.int32).tobytes(), vocab_checksum(self.vocab))
+        return self._checksum
+
+    @staticmethod
+    def build(vocab, key_to_index, dictionary, basic_words):
+        indices = {
+            key_to_index[word] for word in dictionary
+            if word.isalpha() and word.islower() and word in key_to_index
+        }
+        indices = np.array(sorted(indices), dtype=np.int32)
+        basic_set = set(basic_words)
+        basic = np.array([vocab[i] in basic_set for i in indices], dtype=bool)
+        return WordIndex(vocab, indices, basic)
+
+    def get_pool(self, basic=False, top_n=None):
+        """
+        Return:
+            np.array: positions into self.indices matching the filter, in rank order (a view, no rescan)
+        """
+        if basic:
+            pool = self.basic_positions
+        else:
+            pool = np.arange(len(self.indices))
+        if top_n is not None:
+            pool = pool[:top_n]
+        return pool
+
+    def get_model_indices(self, basic=False, top_n=None):
+        return self.indices[self.get_pool(basic, top_n)]
+
+    def get_words(self, basic=False, top_n=None):
+        return [self.vocab[i] for i in self.get_model_indices(basic, top_n)]
+
+    def get_rank(self, model_index):
+        """
+        Return:
+            int: position of the word in the index (its frequency rank among valid words), or -1
+        """
+        position = int(np.searchsorted(self.indices, model_index))
+        if position < len(self.indices) and self.indices[position] == model_index:
+            return position
+        return -1
+
+    def draw(self, basic=False, top_n=None, rng=random):
+        if basic:
+            n = len(self.basic_positions)
+        else:
+            n = len(self.indices)
+        if top_n is not None:
+            n = min(n, top_n)
+        if n == 0:
+            raise ValueError("No valid words match the requested filter.")
+
+        position = rng.randrange(n)
+        if basic:
+            position = self.basic_positions[position]
+        return self.vocab[self.indices[position]]
+
+    def draw_many(self, size, basic=False, top_n=None, rng=None):
+        """
+        Return:
+            np.array: model indices of size words drawn with replacement
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        pool = self.get_pool(basic, top_n)
+        if len(pool) == 0:
+            raise ValueError("No valid words match the requested filter.")
+        return self.indices[pool[rng.integers(0, len(pool), size)]]
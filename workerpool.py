@@ -0,0 +1,272 @@
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+import uuid
+import zlib
+
+import numpy as np
+from multiprocessing import shared_memory
+
+from config import *
+from engine import Engine
+from metrics import METRICS, Metrics
+from server import SessionManager, GameServer
+import similarity
+
+import dataloader
+
+
+class SharedVectors:
+    """
+    Picklable handle to a vectors matrix every worker can map without copying:
+    either the model's .npy sidecar (mmap) or a multiprocessing.shared_memory block.
+    """
+    def __init__(self, shape, dtype, normalized, path=None, shm_name=None):
+        self.shape = shape
+        self.dtype = dtype
+        self.normalized = normalized
+        self.path = path
+        self.shm_name = shm_name
+        self.shm = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shm'] = None
+        return state
+
+    @staticmethod
+    def share(vectors, normalized, chunk_size=100000):
+        if isinstance(vectors, np.memmap) and vectors.filename is not None:
+            return SharedVectors(vectors.shape, vectors.dtype, normalized, path=vectors.filename)
+
+        handle = SharedVectors(vectors.shape, vectors.dtype, normalized)
+        handle.shm = shared_memory.SharedMemory(create=True, size=max(1, vectors.nbytes))
+        handle.shm_name = handle.shm.name
+        shared = handle.view()
+        for start in range(0, len(vectors), chunk_size):
+            shared[start:start + chunk_size] = vectors[start:start + chunk_size]
+        return handle
+
+    def view(self):
+        if self.path is not None:
+            return np.load(self.path, mmap_mode='r')
+        if self.shm is None:
+            self.shm = shared_memory.SharedMemory(name=self.shm_name)
+        return np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    def attach(self, vocab):
+        """Return: a model wrapping the shared matrix (zero-copy)"""
+        vectors = self.view()
+        vectors.flags.writeable = False
+        return dataloader.wrap_vectors(vocab, vectors, normalized=self.normalized)
+
+    def release(self, unlink=False):
+        if self.shm is not None:
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+            self.shm = None
+
+
+def worker_main(shared, vocab, engine_kwargs, session_kwargs, requests, responses):
+    # a forked worker inherits what the parent recorded, which the parent reports itself
+    METRICS.reset()
+    engine = Engine(model=shared.attach(vocab), **engine_kwargs)
+    sessions = SessionManager(engine, **session_kwargs)
+    evict_interval = max(1, sessions.idle_timeout / 4)
+    last_evict = time.monotonic()
+
+    while True:
+        try:
+            item = requests.get(timeout=evict_interval)
+        except queue.Empty:
+            item = ()
+        if item is None:
+            break
+        if item:
+            request_id, method, request = item
+            try:
+                if method == 'handle':
+                    response = sessions.handle(request)
+                elif method == 'evict_idle':
+                    response = sessions.evict_idle()
+                else:
+                    response = METRICS.snapshot()
+            except Exception as e:
+                response = {'error': f"Internal error: {e}"}
+            responses.put((request_id, response))
+        if time.monotonic() - last_evict >= evict_interval:
+            sessions.evict_idle()
+            last_evict = time.monotonic()
+
+
+class WorkerPool:
+    """
+    Pre-forked game workers sharing one copy of the model vectors.
+    Every session lives in exactly one worker (crc32(session) % n_workers), so its Agent
+    state never has to move; requests are routed there over a per-worker queue.
+    Implements the SessionManager.handle interface (async) so GameServer can front it.
+    If a worker dies its sessions are lost: its pending and later requests fail with RuntimeError.
+    """
+    def __init__(self, n_workers=None, model_name=FILE_NAME, mmap=LOAD_MMAP, lexicon=LOAD_LEXICON,
+                 full_hints=FULL_PRECISION_HINTS, ann_hints=ANN_HINTS, puzzles=USE_PUZZLE_BANK,
+                 quantized=QUANTIZED, tolerance=TOLERANCE, algo='default', idle_timeout=SESSION_IDLE_TIMEOUT):
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        self.n_workers = n_workers
+        self.idle_timeout = idle_timeout
+
+        model = dataloader.load(model_name, mmap=mmap, lexicon=lexicon)
+        normalized = mmap or lexicon
+        vocab = model.wv.index_to_key
+        self.shared = SharedVectors.share(model.wv.vectors, normalized)
+        del model
+
+        # warm the on-disk caches once so workers don't race to build them
+        Engine(model_name, lexicon=lexicon, full_hints=full_hints, ann_hints=ann_hints, puzzles=puzzles,
+               quantized=quantized, model=self.shared.attach(vocab))
+
+        engine_kwargs = dict(model_name=model_name, lexicon=lexicon, full_hints=full_hints,
+                             ann_hints=ann_hints, puzzles=puzzles, quantized=quantized)
+        session_kwargs = dict(tolerance=tolerance, algo=algo, idle_timeout=idle_timeout)
+
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        self.responses = context.Queue()
+        self.requests = [context.Queue() for _ in range(n_workers)]
+        self.workers = [
+            context.Process(
+                target=worker_main,
+                args=(self.shared, vocab, engine_kwargs, session_kwargs, requests, self.responses),
+                daemon=True,
+            )
+            for requests in self.requests
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        self.ids = itertools.count()
+        # request id -> (future, worker)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.router = threading.Thread(target=self.route_responses, daemon=True)
+        self.router.start()
+
+    def route_responses(self, check_interval=1.0):
+        last_check = time.monotonic()
+        while True:
+            try:
+                item = self.responses.get(timeout=check_interval)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                request_id, response = item
+                with self.lock:
+                    future, _ = self.pending.pop(request_id, (None, None))
+                if future is not None:
+                    future.set_result(response)
+            if time.monotonic() - last_check >= check_interval:
+                self.check_workers()
+                last_check = time.monotonic()
+
+    def worker_error(self, worker):
+        return RuntimeError(f"Worker {worker} died (exit code {self.workers[worker].exitcode}).")
+
+    def check_workers(self):
+        """Fail the pending requests of dead workers, which would otherwise never be answered."""
+        dead = {worker for worker, process in enumerate(self.workers) if not process.is_alive()}
+        if not dead:
+            return
+        with self.lock:
+            failed = [(request_id, worker) for request_id, (_, worker) in self.pending.items() if worker in dead]
+            futures = [(self.pending.pop(request_id)[0], worker) for request_id, worker in failed]
+        for future, worker in futures:
+            future.set_exception(self.worker_error(worker))
+
+    def get_worker(self, session_id):
+        return zlib.crc32(str(session_id).encode()) % self.n_workers
+
+    def submit(self, request):
+        """
+        Return:
+            concurrent.futures.Future: resolves to the SessionManager response
+        """
+        if request.get('cmd') == 'new' and request.get('session') is None:
+            request = {**request, 'session': uuid.uuid4().hex}
+        return self.send(self.get_worker(request.get('session')), 'handle', request)
+
+    def send(self, worker, method, request=None):
+        future = concurrent.futures.Future()
+        if not self.workers[worker].is_alive():
+            future.set_exception(self.worker_error(worker))
+            return future
+        request_id = next(self.ids)
+        with self.lock:
+            self.pending[request_id] = (future, worker)
+        self.requests[worker].put((request_id, method, request))
+        return future
+
+    def call(self, request):
+        return self.submit(request).result()
+
+    async def handle(self, request):
+        return await asyncio.wrap_future(self.submit(request))
+
+    def evict_idle(self):
+        """
+        Return:
+            int: number of sessions evicted across the live workers
+        """
+        futures = [self.send(worker, 'evict_idle') for worker in range(self.n_workers)]
+        concurrent.futures.wait(futures)
+        return sum(future.result() for future in futures if future.exception() is None)
+
+    def get_metrics(self):
+        """
+        Return:
+            Metrics: the metrics of this process and every live worker, merged
+        """
+        futures = [self.send(worker, 'metrics') for worker in range(self.n_workers)]
+        concurrent.futures.wait(futures)
+        merged = Metrics()
+        merged.enabled = METRICS.enabled
+        merged.merge(METRICS.snapshot())
+        for future in futures:
+            if future.exception() is None and 'error' not in future.result():
+                merged.merge(future.result())
+        return merged
+
+    def close(self):
+        for requests in self.requests:
+            requests.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.responses.put(None)
+        self.router.join()
+        self.shared.release(unlink=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="WordChain game server backed by a pre-forked worker pool.")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--model', default=FILE_NAME)
+    parser.add_argument('--algo', default=SIMILARITY_ALGO, choices=list(similarity.ENGINES))
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--idle-timeout', type=float, default=SESSION_IDLE_TIMEOUT)
+    args = parser.parse_args()
+
+    pool = WorkerPool(args.workers, model_name=args.model, tolerance=args.tolerance, algo=args.algo,
+                      idle_timeout=args.idle_timeout)
+    try:
+        asyncio.run(GameServer(pool, args.host, args.port).serve())
+    finally:
+        pool.close()